@@ -0,0 +1,38 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class () extends Migration {
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // Full chunk text and HTML of the Pinecone vectors written by the
+        // unstructured service when it runs with slim metadata
+        Schema::create('data_source_chunks', function (Blueprint $table) {
+            $table->string('vector_id')->primary();
+            $table->uuid('data_source_id');
+            $table
+                ->foreign('data_source_id')
+                ->references('id')
+                ->on('data_sources')
+                ->onDelete('cascade');
+            $table->text('text');
+            $table->text('text_as_html')->nullable();
+            $table->timestamps();
+
+            $table->index('data_source_id');
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('data_source_chunks');
+    }
+};
@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import uuid
+import random
+import hashlib
+
+# Document tiers of the benchmark corpus: pages per document and documents
+# per tier
+TIERS = {
+    "small": {"pages": 3, "documents": 12},
+    "medium": {"pages": 40, "documents": 4},
+    "huge": {"pages": 300, "documents": 1},
+}
+
+# Every page of a generated PDF carries this marker in its content stream, so
+# the partition server knows which recorded page it was sent, whatever page
+# range file it comes in
+PAGE_MARKER = b"% bench-page"
+_PAGE_MARKER_PATTERN = re.compile(rb"% bench-page (\S+) (\d+)")
+
+_WORDS = (
+    "agenda budget client contract decision deadline delivery design estimate "
+    "feature forecast goal hiring invoice launch meeting milestone migration "
+    "onboarding owner pipeline plan pricing priority project quarter release "
+    "report review revenue risk roadmap scope sprint stakeholder support team "
+    "timeline update vendor workflow"
+).split()
+
+
+def data_source_id_for(doc_id):
+    """
+    Deterministic data source ID of a corpus document.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"ingest-bench/{doc_id}"))
+
+
+def parse_tiers(value):
+    return [tier.strip() for tier in value.split(",") if tier.strip()] if value else None
+
+
+def parse_documents(value):
+    """
+    Parse "small=20,huge=2" into {"small": 20, "huge": 2}.
+    """
+    documents = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            tier, _, count = item.partition("=")
+            documents[tier.strip()] = int(count)
+    return documents
+
+
+def _sentence(rng):
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_recording(doc_id, pages, elements_per_page=8):
+    """
+    Elements shaped like a recorded Unstructured API response: a title and
+    narrative paragraphs on every page. The text only depends on doc_id.
+    """
+    rng = random.Random(doc_id)
+    elements = []
+    for page_number in range(1, pages + 1):
+        for position in range(elements_per_page):
+            if position == 0:
+                element_type, text = "Title", _sentence(rng)[:-1]
+            else:
+                element_type = "NarrativeText"
+                text = " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+            elements.append({
+                "type": element_type,
+                "element_id": hashlib.sha256(f"{doc_id}/{page_number}/{position}".encode("utf-8")).hexdigest()[:32],
+                "text": text,
+                "metadata": {
+                    "page_number": page_number,
+                    "languages": ["eng"],
+                    "filetype": "application/pdf",
+                },
+            })
+    return elements
+
+
+def load_corpus(corpus_dir=None, tiers=None, documents=None):
+    """
+    The documents of the benchmark corpus.
+
+    Recordings are read from corpus_dir/<tier>/*.json when it is given, each
+    a list of elements as returned by the Unstructured API for one document.
+    Otherwise synthetic recordings are generated for every tier.
+
+    Args:
+        corpus_dir: A directory of recorded element JSON, per tier.
+        tiers: The tiers to load, every tier when omitted.
+        documents: Overrides the number of documents per tier.
+
+    Returns:
+        A dict of tier to a list of {"doc_id", "pages", "elements"} dicts.
+    """
+    corpus = {}
+    for tier in tiers or TIERS:
+        if tier not in TIERS:
+            raise ValueError(f"Unknown tier {tier}, expected one of {', '.join(TIERS)}")
+        count = documents.get(tier, TIERS[tier]["documents"]) if documents else TIERS[tier]["documents"]
+
+        if corpus_dir:
+            tier_dir = os.path.join(corpus_dir, tier)
+            names = sorted(name for name in os.listdir(tier_dir) if name.endswith(".json"))[:count]
+            recordings = []
+            for name in names:
+                with open(os.path.join(tier_dir, name), "r", encoding="utf-8") as file:
+                    recordings.append((f"{tier}-{name[:-5]}", json.load(file)))
+        else:
+            recordings = [
+                (f"{tier}-{i:03d}", synthetic_recording(f"{tier}-{i:03d}", TIERS[tier]["pages"]))
+                for i in range(count)
+            ]
+
+        corpus[tier] = [
+            {
+                "doc_id": doc_id,
+                "pages": max((element.get("metadata", {}).get("page_number") or 1 for element in elements), default=1),
+                "elements": elements,
+            }
+            for doc_id, elements in recordings
+        ]
+    return corpus
+
+
+def recorded_pages(corpus):
+    """
+    Index the recorded elements of a corpus by (doc_id, page_number), for the
+    partition server.
+    """
+    pages = {}
+    for documents in corpus.values():
+        for document in documents:
+            for element in document["elements"]:
+                page_number = element.get("metadata", {}).get("page_number") or 1
+                pages.setdefault((document["doc_id"], page_number), []).append(element)
+    return pages
+
+
+def build_pdf(doc_id, pages):
+    """
+    A minimal PDF with one text line per page and the page marker in every
+    content stream, so each page has its own fingerprint.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page_number in range(1, pages + 1):
+        page_object = len(objects) + 1
+        kids.append(f"{page_object} 0 R")
+        content = (
+            PAGE_MARKER + f" {doc_id} {page_number}\n".encode("ascii")
+            + f"BT /F1 12 Tf 72 720 Td ({doc_id} page {page_number}) Tj ET\n".encode("ascii")
+        )
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_object + 1} 0 R >>".encode("ascii")
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"endstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode("ascii")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+
+def page_markers(content):
+    """
+    The (doc_id, page_number) markers found in a PDF page's content stream.
+    """
+    return [
+        (doc_id.decode("ascii"), int(page_number))
+        for doc_id, page_number in _PAGE_MARKER_PATTERN.findall(content)
+    ]
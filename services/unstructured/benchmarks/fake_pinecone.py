@@ -0,0 +1,146 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+# Pinecone request limits checked by the fake
+UPSERT_MAX_VECTORS = 1000
+DELETE_MAX_IDS = 1000
+LIST_PAGE_SIZE = 100
+
+
+class IndexDescription(dict):
+    """
+    describe_index() result, readable as a dict and by attribute.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class IndexList(list):
+    def names(self):
+        return [description["name"] for description in self]
+
+
+class FakeIndex:
+    """
+    In-memory index with the data plane calls the service makes. Values are
+    kept as float32 bytes so the fake adds little to the peak RSS.
+    """
+
+    def __init__(self, name, dimension, upsert_latency=0.0):
+        self.name = name
+        self.dimension = dimension
+        self.upsert_latency = upsert_latency
+        self.namespaces = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def _count(self, operation):
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def upsert(self, vectors, namespace=""):
+        self._count("upsert")
+        if len(vectors) > UPSERT_MAX_VECTORS:
+            raise ValueError(f"Upsert of {len(vectors)} vectors is over the limit of {UPSERT_MAX_VECTORS}")
+        time.sleep(self.upsert_latency)
+
+        records = {}
+        for vector in vectors:
+            values = np.asarray(vector["values"], dtype=np.float32)
+            if values.shape != (self.dimension,):
+                raise ValueError(f"Vector dimension {values.shape} does not match the index dimension {self.dimension}")
+            records[vector["id"]] = (values.tobytes(), dict(vector.get("metadata") or {}))
+        with self.lock:
+            self.namespaces.setdefault(namespace, {}).update(records)
+        return {"upserted_count": len(records)}
+
+    def fetch(self, ids, namespace=""):
+        self._count("fetch")
+        with self.lock:
+            records = self.namespaces.get(namespace, {})
+            found = {
+                vector_id: SimpleNamespace(id=vector_id, metadata=dict(records[vector_id][1]))
+                for vector_id in ids
+                if vector_id in records
+            }
+        return SimpleNamespace(vectors=found, namespace=namespace)
+
+    def update(self, id, set_metadata=None, namespace=""):
+        self._count("update")
+        with self.lock:
+            records = self.namespaces.get(namespace, {})
+            if id in records:
+                values, metadata = records[id]
+                records[id] = (values, dict(metadata, **(set_metadata or {})))
+
+    def delete(self, ids=None, delete_all=False, namespace=""):
+        self._count("delete")
+        with self.lock:
+            if delete_all:
+                self.namespaces.pop(namespace, None)
+                return
+            if len(ids) > DELETE_MAX_IDS:
+                raise ValueError(f"Delete of {len(ids)} IDs is over the limit of {DELETE_MAX_IDS}")
+            records = self.namespaces.get(namespace, {})
+            for vector_id in ids:
+                records.pop(vector_id, None)
+
+    def list(self, prefix="", namespace=""):
+        self._count("list")
+        with self.lock:
+            vector_ids = sorted(
+                vector_id for vector_id in self.namespaces.get(namespace, {}) if vector_id.startswith(prefix)
+            )
+        for i in range(0, len(vector_ids), LIST_PAGE_SIZE):
+            yield vector_ids[i:i + LIST_PAGE_SIZE]
+
+    def describe_index_stats(self):
+        with self.lock:
+            namespaces = {
+                namespace: SimpleNamespace(vector_count=len(records))
+                for namespace, records in self.namespaces.items()
+            }
+        return SimpleNamespace(
+            dimension=self.dimension,
+            namespaces=namespaces,
+            total_vector_count=sum(namespace.vector_count for namespace in namespaces.values()),
+        )
+
+    def close(self):
+        pass
+
+
+class FakePinecone:
+    """
+    Stands in for the Pinecone client: describe_index resolves an index to a
+    fake host and Index(host=...) returns its in-memory index.
+    """
+
+    def __init__(self, dimension, upsert_latency=0.0):
+        self.dimension = dimension
+        self.upsert_latency = upsert_latency
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def _index(self, name):
+        with self.lock:
+            if name not in self.indexes:
+                self.indexes[name] = FakeIndex(name, self.dimension, self.upsert_latency)
+            return self.indexes[name]
+
+    def describe_index(self, name):
+        index = self._index(name)
+        return IndexDescription(name=name, host=f"{name}.pinecone.local", dimension=index.dimension)
+
+    def list_indexes(self):
+        return IndexList(self.describe_index(name) for name in sorted(self.indexes))
+
+    def Index(self, host):
+        return self._index(host.replace("https://", "").split(".")[0])
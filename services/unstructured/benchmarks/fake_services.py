@@ -0,0 +1,209 @@
+"""
+Local stand-ins for the HTTP APIs of the /process pipeline, run in their own
+process so their memory stays out of the service's peak RSS:
+
+- a partition server answering the Unstructured API with recorded elements
+- an OpenAI server with deterministic embeddings and canned summaries
+
+    python -m benchmarks.fake_services --partition-port 8701 --openai-port 8702
+"""
+import io
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from email.parser import BytesParser
+from email import policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from pypdf import PdfReader
+
+from benchmarks.corpus import load_corpus, page_markers, parse_documents, parse_tiers, recorded_pages
+
+
+def _parse_form(content_type, body):
+    # Multipart form fields of a request, files as (filename, bytes)
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        filename = part.get_filename()
+        fields[name] = (filename, payload) if filename else payload.decode("utf-8")
+    return fields
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send_json(200, {"status": "ok"})
+
+
+class PartitionHandler(_Handler):
+    """
+    Answers every POST like the Unstructured partition endpoint. The pages of
+    the uploaded PDF are matched to the recording by their page marker and
+    numbered from starting_page_number, as the API does for split requests.
+    """
+    pages = {}
+    latency_per_page = 0.0
+
+    def do_POST(self):
+        try:
+            fields = _parse_form(self.headers["Content-Type"], self._read_body())
+            filename, content = fields["files"]
+            first_page = int(fields.get("starting_page_number") or 1)
+            reader = PdfReader(io.BytesIO(content))
+        except Exception as e:
+            self._send_json(422, {"detail": f"Could not read the upload: {e}"})
+            return
+
+        elements = []
+        for offset, page in enumerate(reader.pages):
+            page_contents = page.get_contents()
+            for doc_id, page_number in page_markers(page_contents.get_data() if page_contents is not None else b""):
+                for element in self.pages.get((doc_id, page_number), []):
+                    metadata = dict(element.get("metadata", {}), page_number=first_page + offset, filename=filename)
+                    elements.append(dict(element, metadata=metadata))
+        time.sleep(self.latency_per_page * len(reader.pages))
+        self._send_json(200, elements)
+
+
+class OpenAIHandler(_Handler):
+    """
+    Answers embeddings and chat completions requests. Embeddings are derived
+    from the text, so a text always gets the same vector.
+    """
+    dimensions = 1536
+    embedding_latency = 0.0
+    embedding_latency_per_input = 0.0
+    summary_latency = 0.0
+    error_rate = 0.0
+
+    def do_POST(self):
+        request = json.loads(self._read_body() or b"{}")
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request)
+        elif self.path.endswith("/chat/completions"):
+            self._chat_completion(request)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _embeddings(self, request):
+        texts = request["input"]
+        if isinstance(texts, str):
+            texts = [texts]
+        if random.random() < self.error_rate:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"retry-after": "0.2"}
+            )
+            return
+
+        time.sleep(self.embedding_latency + self.embedding_latency_per_input * len(texts))
+        dimensions = request.get("dimensions") or self.dimensions
+        data = []
+        for index, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            if request.get("encoding_format") != "base64":
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+
+        tokens = sum(len(text) // 4 + 1 for text in texts)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat_completion(self, request):
+        time.sleep(self.summary_latency)
+        prompt_tokens = sum(len(message.get("content") or "") // 4 for message in request.get("messages", []))
+        self._send_json(200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "A benchmark document about planning and delivery."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 10, "total_tokens": prompt_tokens + 10},
+        })
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake partition and OpenAI servers for the benchmark")
+    parser.add_argument("--partition-port", type=int, required=True)
+    parser.add_argument("--openai-port", type=int, required=True)
+    parser.add_argument("--corpus-dir", help="Recorded element JSON per tier, synthetic when omitted")
+    parser.add_argument("--tiers", default=None, help="Comma separated tiers to serve")
+    parser.add_argument("--documents", default=None, help="Documents per tier, e.g. small=20,huge=2")
+    parser.add_argument("--partition-ms-per-page", type=float, default=150)
+    parser.add_argument("--embedding-ms", type=float, default=80)
+    parser.add_argument("--embedding-ms-per-input", type=float, default=0.5)
+    parser.add_argument("--summary-ms", type=float, default=1500)
+    parser.add_argument("--embedding-error-rate", type=float, default=0.0)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    corpus = load_corpus(args.corpus_dir, tiers=parse_tiers(args.tiers), documents=parse_documents(args.documents))
+    PartitionHandler.pages = recorded_pages(corpus)
+    PartitionHandler.latency_per_page = args.partition_ms_per_page / 1000
+    OpenAIHandler.dimensions = args.dimensions
+    OpenAIHandler.embedding_latency = args.embedding_ms / 1000
+    OpenAIHandler.embedding_latency_per_input = args.embedding_ms_per_input / 1000
+    OpenAIHandler.summary_latency = args.summary_ms / 1000
+    OpenAIHandler.error_rate = args.embedding_error_rate
+
+    servers = [
+        ThreadingHTTPServer(("127.0.0.1", args.partition_port), PartitionHandler),
+        ThreadingHTTPServer(("127.0.0.1", args.openai_port), OpenAIHandler),
+    ]
+    threads = [serve(server) for server in servers]
+    logging.info(f"Serving partition on :{args.partition_port} and OpenAI on :{args.openai_port}")
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,513 @@
+"""
+Offline benchmark of the /process pipeline. Documents of every tier go
+through process_and_upload as async jobs, against local stand-ins:
+
+- S3 is mocked with moto, the corpus PDFs are uploaded to it
+- the Unstructured API and OpenAI are served by benchmarks.fake_services
+- Pinecone is an in-memory fake
+- Postgres is a local database, see POSTGRES_DB_* and README.md
+
+Each tier runs in its own process so its peak RSS is its own. Run from
+services/unstructured:
+
+    python -m benchmarks.run --output benchmarks/results/results.json
+    python -m benchmarks.run --baseline benchmarks/results/results.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+
+from benchmarks.corpus import TIERS, build_pdf, data_source_id_for, load_corpus, parse_documents, parse_tiers
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUCKET = "ingest-bench"
+INDEX_NAME = "ingest-bench"
+PULSE_ID = "ingest-bench"
+
+STAGES = ("download", "partition", "chunk", "token_count", "summary", "metadata", "embedding", "upsert")
+STAGE_COUNTS = ("bytes", "pages", "chunks", "tokens", "api_calls")
+
+POLL_SECONDS = 0.05
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise Exception(f"Fake service at {url} did not start")
+            time.sleep(0.1)
+
+
+def prepare_database(documents):
+    """
+    Create the tables the pipeline uses when missing, and insert a data
+    source row for every document, replacing the rows of a previous run.
+    """
+    from utils.db_utils import db_connection
+
+    ids = [data_source_id_for(document["doc_id"]) for document in documents]
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS public.data_sources (
+                    id uuid PRIMARY KEY,
+                    name varchar,
+                    origin varchar,
+                    token_count integer,
+                    summary text
+                );
+                CREATE TABLE IF NOT EXISTS public.meetings (
+                    id uuid PRIMARY KEY,
+                    data_source_id uuid,
+                    date timestamp,
+                    source varchar
+                );
+                CREATE TABLE IF NOT EXISTS public.data_source_chunks (
+                    vector_id varchar PRIMARY KEY,
+                    data_source_id uuid REFERENCES public.data_sources (id) ON DELETE CASCADE,
+                    text text NOT NULL,
+                    text_as_html text,
+                    created_at timestamp,
+                    updated_at timestamp
+                );
+            """)
+            cursor.execute("DELETE FROM public.data_sources WHERE id = ANY(%s::uuid[]);", (ids,))
+            for document, data_source_id in zip(documents, ids):
+                cursor.execute(
+                    "INSERT INTO public.data_sources (id, name, origin) VALUES (%s, %s, %s);",
+                    (data_source_id, document["doc_id"], "upload")
+                )
+
+
+def cleanup_database(documents):
+    from utils.db_utils import db_connection
+
+    ids = [data_source_id_for(document["doc_id"]) for document in documents]
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM public.data_sources WHERE id = ANY(%s::uuid[]);", (ids,))
+
+
+def summarize_pass(results, wall_seconds):
+    """
+    Aggregate the job results of one pass: throughput, document latency and
+    the per-stage breakdown from the job records.
+    """
+    completed = [result for result in results if result["status"] == "completed"]
+    stages = {}
+    for stage in STAGES:
+        runs = [result["stages"][stage] for result in completed if stage in result["stages"]]
+        if not runs:
+            continue
+        durations = [run["duration_ms"] for run in runs]
+        stages[stage] = {
+            "runs": len(runs),
+            "mean_ms": round(sum(durations) / len(durations)),
+            "p50_ms": _percentile(durations, 50),
+            "p95_ms": _percentile(durations, 95),
+            "max_ms": max(durations),
+        }
+        if any("busy_ms" in run for run in runs):
+            stages[stage]["busy_mean_ms"] = round(sum(run.get("busy_ms", 0) for run in runs) / len(runs))
+        for name in STAGE_COUNTS:
+            total = sum(run.get(name, 0) for run in runs)
+            if total:
+                stages[stage][name] = total
+
+    latencies = [result["seconds"] for result in completed]
+    return {
+        "documents": len(results),
+        "completed": len(completed),
+        "failures": [
+            {"doc_id": result["doc_id"], "error": result["error"]}
+            for result in results
+            if result["status"] != "completed"
+        ],
+        "wall_seconds": round(wall_seconds, 2),
+        "docs_per_min": round(len(completed) / wall_seconds * 60, 2) if wall_seconds else None,
+        "latency_p50_s": _percentile(latencies, 50),
+        "latency_p95_s": _percentile(latencies, 95),
+        "vectors": sum(result["vectors"] for result in completed),
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": stages,
+    }
+
+
+def run_pass(client, documents, tier, concurrency):
+    """
+    Submit every document as an async /process job, keeping concurrency jobs
+    in flight, and wait for all of them.
+    """
+    pending = deque(documents)
+    in_flight = {}
+    results = []
+    started_at = time.monotonic()
+
+    while pending or in_flight:
+        while pending and len(in_flight) < concurrency:
+            document = pending.popleft()
+            response = client.post("/process", json={
+                "s3_url": f"s3://{BUCKET}/{tier}/{document['doc_id']}.pdf",
+                "pinecone_index_name": INDEX_NAME,
+                "data_source_id": data_source_id_for(document["doc_id"]),
+                "data_source_type": "file",
+                "pulse_id": PULSE_ID,
+                "async": True,
+            })
+            if response.status_code != 202:
+                results.append({
+                    "doc_id": document["doc_id"],
+                    "status": "rejected",
+                    "error": (response.get_json() or {}).get("error"),
+                })
+                continue
+            in_flight[response.get_json()["job_id"]] = (document, time.monotonic())
+
+        time.sleep(POLL_SECONDS)
+        for job_id in list(in_flight):
+            job = client.get(f"/process/status/{job_id}").get_json()
+            if job["status"] not in ("completed", "failed"):
+                continue
+            document, submitted_at = in_flight.pop(job_id)
+            results.append({
+                "doc_id": document["doc_id"],
+                "status": job["status"],
+                "error": job.get("error"),
+                "seconds": round(time.monotonic() - submitted_at, 3),
+                "vectors": len(job.get("vector_ids") or []),
+                "stages": job.get("metrics") or {},
+            })
+            if job["status"] == "failed":
+                logging.warning(f"{document['doc_id']} failed: {job.get('error')}")
+
+    return summarize_pass(results, time.monotonic() - started_at)
+
+
+def run_tier(args):
+    """
+    Run the passes of one tier inside this process. The service environment
+    is set up by the parent process.
+    """
+    import boto3
+    from moto import mock_aws
+
+    documents = load_corpus(
+        args.corpus_dir, tiers=[args.worker], documents=parse_documents(args.documents)
+    )[args.worker]
+
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=BUCKET)
+        for document in documents:
+            s3.put_object(
+                Bucket=BUCKET,
+                Key=f"{args.worker}/{document['doc_id']}.pdf",
+                Body=build_pdf(document["doc_id"], document["pages"])
+            )
+
+        import flask_processor
+        from utils import pinecone_utils
+        from utils.openai_utils import EMBEDDING_DIMENSIONS
+        from benchmarks.fake_pinecone import FakePinecone
+
+        logging.getLogger().setLevel(args.log_level)
+        flask_processor.WORK_DIR = os.path.join(args.workdir, "working")
+        fake_pinecone = FakePinecone(EMBEDDING_DIMENSIONS or args.dimensions, args.upsert_ms / 1000)
+        pinecone_utils._client = fake_pinecone
+
+        prepare_database(documents)
+        rss_start_mb = _peak_rss_mb()
+        client = flask_processor.app.test_client()
+        passes = []
+        try:
+            for pass_number in range(1, args.passes + 1):
+                logging.warning(f"{args.worker}: pass {pass_number} of {args.passes}")
+                passes.append(run_pass(client, documents, args.worker, args.concurrency))
+        finally:
+            cleanup_database(documents)
+
+    return {
+        "documents": len(documents),
+        "pages": sum(document["pages"] for document in documents),
+        "rss_start_mb": rss_start_mb,
+        "pinecone_requests": fake_pinecone.indexes[INDEX_NAME].requests if INDEX_NAME in fake_pinecone.indexes else {},
+        "passes": passes,
+    }
+
+
+def service_env(args, workdir, partition_port, openai_port):
+    """
+    Environment of a tier process: the service talks to the fakes and keeps
+    its caches, checkpoints and job records in the tier's work directory.
+    Tuning settings of the service are passed through from this environment.
+    """
+    env = dict(os.environ)
+    env.update({
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+        "PROCESS_CHECKPOINT_DIR": os.path.join(workdir, "checkpoints"),
+        "PROCESS_JOBS_DIR": os.path.join(workdir, "jobs"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+        "PROCESS_JOB_WORKERS": str(args.concurrency),
+        "PROCESS_JOB_QUEUE_SIZE": str(args.concurrency),
+        "SWEEPER_ENABLED": "false",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "OPENAI_SUMMARY_MODEL": "bench-summary",
+        "UNSTRUCTURED_API_KEY": "bench",
+        "UNSTRUCTURED_API_URL": f"http://127.0.0.1:{partition_port}",
+        # Checked when flask_processor imports the dubbing helpers
+        "ELEVENLABS_API_KEY": "bench",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    })
+    env.setdefault("POSTGRES_DB_HOST", "localhost")
+    env.setdefault("POSTGRES_DB_PORT", "5432")
+    env.setdefault("POSTGRES_DB_DATABASE", "ingest_bench")
+    env.setdefault("POSTGRES_DB_USERNAME", "postgres")
+    env.setdefault("POSTGRES_DB_PASSWORD", "postgres")
+    return env
+
+
+def run_benchmark(args):
+    """
+    Start the fake services, run every tier in its own process and collect
+    their results.
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ingest-bench-")
+    partition_port, openai_port = _free_port(), _free_port()
+    shared_args = [
+        "--concurrency", str(args.concurrency),
+        "--passes", str(args.passes),
+        "--dimensions", str(args.dimensions),
+        "--upsert-ms", str(args.upsert_ms),
+        "--log-level", args.log_level,
+    ]
+    corpus_args = []
+    if args.corpus_dir:
+        corpus_args += ["--corpus-dir", args.corpus_dir]
+    if args.documents:
+        corpus_args += ["--documents", args.documents]
+
+    fakes = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.fake_services",
+            "--partition-port", str(partition_port),
+            "--openai-port", str(openai_port),
+            "--tiers", ",".join(args.tiers),
+            "--partition-ms-per-page", str(args.partition_ms_per_page),
+            "--embedding-ms", str(args.embedding_ms),
+            "--embedding-ms-per-input", str(args.embedding_ms_per_input),
+            "--summary-ms", str(args.summary_ms),
+            "--embedding-error-rate", str(args.embedding_error_rate),
+            "--dimensions", str(args.dimensions),
+        ] + corpus_args,
+        cwd=SERVICE_DIR
+    )
+    tiers = {}
+    try:
+        _wait_for(f"http://127.0.0.1:{partition_port}/")
+        _wait_for(f"http://127.0.0.1:{openai_port}/")
+
+        for tier in args.tiers:
+            tier_dir = os.path.join(workdir, tier)
+            result_file = os.path.join(tier_dir, "result.json")
+            os.makedirs(tier_dir, exist_ok=True)
+            subprocess.run(
+                [
+                    sys.executable, "-m", "benchmarks.run",
+                    "--worker", tier,
+                    "--workdir", tier_dir,
+                    "--result-file", result_file,
+                ] + shared_args + corpus_args,
+                cwd=SERVICE_DIR,
+                env=service_env(args, tier_dir, partition_port, openai_port),
+                check=True
+            )
+            with open(result_file, "r") as file:
+                tiers[tier] = json.load(file)
+    finally:
+        fakes.terminate()
+        fakes.wait()
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "settings": {
+            "concurrency": args.concurrency,
+            "passes": args.passes,
+            "partition_ms_per_page": args.partition_ms_per_page,
+            "embedding_ms": args.embedding_ms,
+            "embedding_ms_per_input": args.embedding_ms_per_input,
+            "summary_ms": args.summary_ms,
+            "upsert_ms": args.upsert_ms,
+            "embedding_error_rate": args.embedding_error_rate,
+            "corpus_dir": args.corpus_dir,
+        },
+        "tiers": tiers,
+    }
+
+
+def print_report(report):
+    for tier, result in report["tiers"].items():
+        print(f"\n== {tier}: {result['documents']} documents, {result['pages']} pages ==")
+        for pass_number, summary in enumerate(result["passes"], start=1):
+            caches = "cold caches" if pass_number == 1 else "warm caches"
+            print(
+                f"pass {pass_number} ({caches}): {summary['completed']}/{summary['documents']} documents "
+                f"in {summary['wall_seconds']}s, {summary['docs_per_min']} docs/min, "
+                f"latency p50 {summary['latency_p50_s']}s p95 {summary['latency_p95_s']}s, "
+                f"peak RSS {summary['peak_rss_mb']} MB (start {result['rss_start_mb']} MB)"
+            )
+            print(f"  {'stage':<12}{'runs':>6}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}  counts")
+            for stage, stats in summary["stages"].items():
+                counts = ", ".join(f"{name} {stats[name]}" for name in STAGE_COUNTS if name in stats)
+                print(
+                    f"  {stage:<12}{stats['runs']:>6}{stats['mean_ms']:>10}{stats['p50_ms']:>10}"
+                    f"{stats['p95_ms']:>10}{stats['max_ms']:>10}  {counts}"
+                )
+            for failure in summary["failures"]:
+                print(f"  failed {failure['doc_id']}: {failure['error']}")
+
+
+def empty_passes(report):
+    """
+    The passes, as "<tier> pass <n>", that completed no document. Their
+    report has no stage timings to compare.
+    """
+    return [
+        f"{tier} pass {pass_number}"
+        for tier, result in report["tiers"].items()
+        for pass_number, summary in enumerate(result["passes"], start=1)
+        if not summary["completed"]
+    ]
+
+
+def _change(value, baseline_value):
+    if not value or not baseline_value:
+        return "n/a"
+    return f"{(value - baseline_value) / baseline_value * 100:+.1f}%"
+
+
+def print_comparison(report, baseline):
+    """
+    Compare throughput, peak RSS and stage p50s with a baseline report.
+    """
+    print(f"\n== Compared with the baseline of {baseline.get('created_at')} ==")
+    for tier, result in report["tiers"].items():
+        baseline_tier = baseline.get("tiers", {}).get(tier)
+        if not baseline_tier:
+            print(f"{tier}: not in the baseline")
+            continue
+        for pass_number, (summary, baseline_summary) in enumerate(
+            zip(result["passes"], baseline_tier["passes"]), start=1
+        ):
+            print(
+                f"{tier} pass {pass_number}: docs/min {summary['docs_per_min']} vs "
+                f"{baseline_summary['docs_per_min']} "
+                f"({_change(summary['docs_per_min'], baseline_summary['docs_per_min'])}), "
+                f"peak RSS {summary['peak_rss_mb']} vs {baseline_summary['peak_rss_mb']} MB "
+                f"({_change(summary['peak_rss_mb'], baseline_summary['peak_rss_mb'])})"
+            )
+            for stage, stats in summary["stages"].items():
+                baseline_stats = baseline_summary["stages"].get(stage)
+                if baseline_stats:
+                    print(
+                        f"  {stage:<12} p50 {stats['p50_ms']} vs {baseline_stats['p50_ms']} ms "
+                        f"({_change(stats['p50_ms'], baseline_stats['p50_ms'])})"
+                    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the /process pipeline")
+    parser.add_argument("--tiers", default=",".join(TIERS), help="Comma separated tiers to run")
+    parser.add_argument("--documents", help="Documents per tier, e.g. small=20,huge=2")
+    parser.add_argument("--corpus-dir", help="Recorded element JSON per tier, synthetic when omitted")
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs in flight, PROCESS_JOB_WORKERS")
+    parser.add_argument("--passes", type=int, default=1, help="Passes over the corpus, later ones hit warm caches")
+    parser.add_argument("--partition-ms-per-page", type=float, default=150)
+    parser.add_argument("--embedding-ms", type=float, default=80)
+    parser.add_argument("--embedding-ms-per-input", type=float, default=0.5)
+    parser.add_argument("--summary-ms", type=float, default=1500)
+    parser.add_argument("--upsert-ms", type=float, default=40)
+    parser.add_argument("--embedding-error-rate", type=float, default=0.0, help="Share of embedding calls answered 429")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--workdir", help="Work directory, a temporary one when omitted")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare with")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    if SERVICE_DIR not in sys.path:
+        sys.path.insert(0, SERVICE_DIR)
+
+    if args.worker:
+        result = run_tier(args)
+        with open(args.result_file, "w") as file:
+            json.dump(result, file)
+        return 0
+
+    # Tier processes run from the service directory
+    if args.corpus_dir:
+        args.corpus_dir = os.path.abspath(args.corpus_dir)
+    args.tiers = parse_tiers(args.tiers)
+    unknown = [tier for tier in args.tiers if tier not in TIERS]
+    if unknown:
+        parser.error(f"Unknown tiers: {', '.join(unknown)}")
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            print_comparison(report, json.load(file))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    failed = empty_passes(report)
+    if failed:
+        print(f"\nNo document completed in {', '.join(failed)}, see the failures above", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,19 +2,21 @@ from unstructured.staging.base import elements_from_dicts
 from unstructured.chunking import dispatch
 from unstructured_ingest.utils.chunking import assign_and_map_hash_ids
 from unstructured.chunking import dispatch
+from itertools import groupby
 from pathlib import Path
 import json
 import re
 
 class Chunker:
-    def __init__(self, output_dir: Path, chunking_strategy: str, chunk_max_characters: int, **kwargs):
+    def __init__(self, chunking_strategy: str, chunk_max_characters: int, chunk_overlap: int = 0, **kwargs):
+        # dispatch.chunk silently drops the arguments the chunking function
+        # doesn't take, so pass the settings under the function's own names
         self.config = {
             "chunking_strategy": chunking_strategy,
-            "chunk_max_characters": chunk_max_characters,
+            "max_characters": chunk_max_characters,
+            "overlap": chunk_overlap,
             **kwargs
         }
-        self.output_dir = output_dir
-        self.output_dir.mkdir(parents=True, exist_ok=True)
     
     def run(self, elements_filepath: Path):
         # elements_dict = elements_from_json(elements_filepath)
@@ -23,25 +25,22 @@ class Chunker:
         with open(elements_filepath, encoding=encoding) as f:
             elements_dict = json.load(f)
 
-        self._split_into_pages(elements_dict)
+        documents = self.chunk_pages(elements_dict)
 
-        page_files = sorted(self.output_dir.glob("page_*.json"))
-        
-        documents = []
-        for page_file in page_files:
-            with open(page_file, "r", encoding="utf-8") as f:
-                page_data = json.load(f)
-
-                elements_dict = elements_from_dicts(page_data)
+        # Replace original file
+        with open(elements_filepath, "w", encoding="utf-8") as mf:
+            json.dump(documents, mf, ensure_ascii=False)
 
-                chunked_elements_dicts = self.chunk(elements_dict);
+    def chunk_pages(self, elements_dict: list):
+        # Pages are chunked one by one so a chunk never spans two pages
+        documents = []
+        for page_data in self._split_into_pages(elements_dict):
+            elements = elements_from_dicts(page_data)
 
-                for chunk in chunked_elements_dicts:
-                    documents.append(chunk)
+            chunked_elements_dicts = self.chunk(elements)
 
-        # Replace original file
-        with open(elements_filepath, "w", encoding="utf-8") as mf:
-            json.dump(documents, mf, ensure_ascii=False, indent=2)
+            documents.extend(chunked_elements_dicts)
+        return documents
 
     def chunk(self, elements_dict: list):
         chunked_elements = dispatch.chunk(
@@ -53,6 +52,16 @@ class Chunker:
         return assign_and_map_hash_ids(elements=chunked_elements_dicts)
 
     def _split_into_pages(self, elements_dict):
+        # Elements partitioned by page range already carry their page number,
+        # counting the page markers would shift every page after a skipped range
+        if elements_dict and all(
+            element.get("metadata", {}).get("page_number") is not None
+            for element in elements_dict
+        ):
+            for _, page_data in groupby(elements_dict, key=lambda element: element["metadata"]["page_number"]):
+                yield list(page_data)
+            return
+
         current_page_number = 1
         page_data = []
 
@@ -68,13 +77,9 @@ class Chunker:
                 continue
 
             if has_page_number:
-                # Write previous page
+                # Emit previous page
                 if page_data:
-                    zero_padded_page_number = str(current_page_number).zfill(6)
-                    filename = f"page_{zero_padded_page_number}.json"
-                    file_path = self.output_dir / filename
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        json.dump(page_data, f, indent=2, ensure_ascii=False)
+                    yield page_data
 
                 # Start new page
                 current_page_number += 1
@@ -84,13 +89,9 @@ class Chunker:
                 element["metadata"]["page_number"] = current_page_number
                 page_data.append(element)
 
-        # Write the last page
+        # Emit the last page
         if page_data:
-            zero_padded_page_number = str(current_page_number).zfill(6)
-            filename = f"page_{zero_padded_page_number}.json"
-            file_path = self.output_dir / filename
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(page_data, f, indent=2, ensure_ascii=False)
+            yield page_data
     
 
     def _check_page_number(self, element_dict):
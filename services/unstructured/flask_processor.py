@@ -1,36 +1,91 @@
 import os
 import json
+import time
+import asyncio
 import logging
 import uuid
 import shutil
-import psycopg2
 import threading
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 import json
 from html.parser import HTMLParser
 
-from flask import Flask, request, jsonify
-from unstructured_ingest.v2.pipeline.pipeline import Pipeline
-from unstructured_ingest.v2.interfaces import ProcessorConfig
-from unstructured_ingest.v2.processes.connectors.fsspec.s3 import (
-    S3IndexerConfig,
-    S3DownloaderConfig,
-    S3ConnectionConfig,
-    S3AccessConfig
-)
-from unstructured_ingest.v2.processes.partitioner import PartitionerConfig
-from unstructured_ingest.v2.processes.chunker import ChunkerConfig
-from unstructured_ingest.v2.processes.embedder import EmbedderConfig
-from unstructured_ingest.v2.processes.connectors.local import LocalUploaderConfig
+from flask import Flask, Response, request, jsonify
+from botocore.exceptions import ClientError
+from unstructured.staging.base import elements_from_dicts
+from unstructured_ingest.v2.processes.partitioner import Partitioner, PartitionerConfig
 from chunker import Chunker
 from pathlib import Path
-from pinecone import Pinecone
-from cachetools import TTLCache
 import openai 
 from openai import OpenAI
 from utils.dub_utils import *
 from utils.openai_utils import *
 from utils import utils
+from utils.db_utils import db_connection
+from utils.job_utils import (
+    JobQueueFullError,
+    create_process_job,
+    get_process_job,
+    set_job_stage,
+    submit_process_job,
+    update_process_job,
+)
+from utils.stream_utils import run_streaming_stages
+from utils.checkpoint_utils import (
+    CheckpointBusyError,
+    acquire_checkpoint,
+    append_upserted_ids,
+    checkpoint_key,
+    checkpoint_path,
+    clear_checkpoint,
+    load_checkpoint,
+    load_checkpoint_chunks,
+    load_upserted_ids,
+    purge_expired_checkpoints,
+    release_checkpoint,
+    save_checkpoint,
+    save_checkpoint_chunks,
+)
+from utils.embedding_utils import EMBEDDING_MAX_CONCURRENCY, embed_texts, plan_embedding_batches
+from utils.metrics_utils import RunMetrics, count_run, render_metrics
+from utils.chunk_utils import PINECONE_METADATA_MODE, ChunkCollection, compact_chunk_record, slim_metadata
+from utils.chunk_store import delete_chunk_texts, fetch_chunk_texts, store_chunk_texts
+from utils.pdf_utils import (
+    PDF_PAGE_CONCURRENCY,
+    PDF_PARTITION_CONCURRENCY,
+    PDF_RANGE_TIMEOUT_SECONDS,
+    PDF_SPLIT_MIN_PAGES,
+    group_elements_by_page,
+    page_fingerprints,
+    partition_page_ranges,
+    read_pdf,
+    split_pdf,
+)
+from utils.pinecone_utils import (
+    UPSERT_MAX_CONCURRENCY,
+    delete_namespace,
+    delete_vectors,
+    get_pinecone_index,
+    list_vector_ids,
+    mark_vectors_deleted,
+    pack_upsert_batches,
+    upsert_batch,
+    vector_id_for_chunk,
+    update_moved_vectors,
+    vector_id_prefix,
+)
+from utils.sweeper import get_sweep_state, run_sweep, start_sweeper
+from utils.result_cache import (
+    get_cached_chunks,
+    get_cached_pages,
+    get_cached_summary,
+    page_cache_key,
+    result_cache_key,
+    set_cached_chunks,
+    set_cached_pages,
+    set_cached_summary,
+)
 from datetime import datetime
 
 # Versioning
@@ -42,9 +97,6 @@ current_version = staging_version
 
 WORK_DIR = '/app/working'  # Adjust this to your local working directory
 
-# Cache for storing index descriptions (TTL set to 1 hour)
-index_description_cache = TTLCache(maxsize=100, ttl=3600)
-
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -52,16 +104,39 @@ app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info('Flask Processor with S3 integration running.')
 
-# Database connection details from environment variables
-POSTGRES_DB_HOST = os.getenv('POSTGRES_DB_HOST')
-POSTGRES_DB_PORT = os.getenv('POSTGRES_DB_PORT', 5432)
-POSTGRES_DB_DATABASE = os.getenv('POSTGRES_DB_DATABASE')
-POSTGRES_DB_USERNAME = os.getenv('POSTGRES_DB_USERNAME')
-POSTGRES_DB_PASSWORD = os.getenv('POSTGRES_DB_PASSWORD')
+# Each gunicorn worker imports the app, the sweeper lock picks one to sweep
+start_sweeper()
 
 # OpenAI model from environment variables
 OPENAI_EMBEDDING_MODEL = os.getenv('OPENAI_EMBEDDING_MODEL')
 
+# Time /mark_deleted spends on updates before returning partial progress,
+# under the gunicorn timeout
+MARK_DELETED_TIME_BUDGET_SECONDS = int(os.getenv('MARK_DELETED_TIME_BUDGET_SECONDS', 240))
+
+# Token budget of one summary request, larger documents are summarized by
+# section and the section summaries reduced into one
+SUMMARY_SECTION_TOKENS = int(os.getenv('SUMMARY_SECTION_TOKENS', 100_000))
+SUMMARY_MAX_CONCURRENCY = int(os.getenv('SUMMARY_MAX_CONCURRENCY', 4))
+
+# Chunking settings, per page for the VLM strategy and per document otherwise
+CHUNKER_SETTINGS = {
+    "chunking_strategy": "by_title",
+    "chunk_max_characters": 1500,
+    "chunk_overlap": 150,
+}
+# The VLM page chunker has always produced chunks of the by_title defaults.
+# Changing them changes retrieval and every VLM vector ID, so any change
+# needs its own rollout.
+VLM_CHUNKER_SETTINGS = {
+    "chunking_strategy": "by_title",
+    "chunk_max_characters": 500,
+    "chunk_overlap": 0,
+}
+
+def get_chunker_settings(strategy):
+    return VLM_CHUNKER_SETTINGS if strategy == "vlm" else CHUNKER_SETTINGS
+
 # Function to create a directory for the data_source_id
 def create_data_source_directory(base_dir, data_source_id):
     dir_path = os.path.join(base_dir, data_source_id)
@@ -97,46 +172,6 @@ def cleanup_local_files(dir_path):
     except Exception as e:
         logging.error(f"Error during cleanup: {e}")
 
-def get_first_json_file(directory):
-    for root, dirs, files in os.walk(directory):
-        for filename in files:
-            if filename.endswith(".json"):
-                return os.path.join(root, filename)
-    raise Exception("No chunks")
-
-# Function to set Pinecone index host
-def set_index_host(pc, index_name):
-    """
-    Set the Pinecone index host dynamically based on the index name.
-    The function caches the index description to avoid repeated API calls.
-    """
-    if index_name in index_description_cache:
-        index_desc = index_description_cache[index_name]
-        logging.info(f"Using cached index description for: {index_name}")
-    else:
-        try:
-            # Fetch the index description
-            index_desc = pc.describe_index(index_name)
-            logging.info(f"Retrieved index description for: {index_name}")
-            
-            # Cache the index description
-            index_description_cache[index_name] = index_desc
-        except Exception as e:
-            logging.error(f"Error retrieving index description for {index_name}: {e}")
-            raise Exception(f"Failed to describe index: {index_name}")
-    
-    # Access the host directly from the root of the index description
-    index_host = index_desc.get('host')
-    if not index_host:
-        raise Exception(f"Index host not found in index description for {index_name}")
-    
-    full_index_host = f"https://{index_host}"
-    logging.info(f"Setting index host to: {full_index_host}")
-    
-    # Set the index host for the Pinecone client
-    pc.Index(host=full_index_host)
-    return pc
-
 # Function to get summary using OpenAI
 def generate_summary(full_text):
     client = OpenAI(
@@ -174,122 +209,70 @@ def generate_summary(full_text):
 # Function to store summary in the database
 def set_fields_in_db(data_source_id, token_count, summary=None):
     try:
-        conn = psycopg2.connect(
-            dbname=POSTGRES_DB_DATABASE,
-            user=POSTGRES_DB_USERNAME,
-            password=POSTGRES_DB_PASSWORD,
-            host=POSTGRES_DB_HOST,
-            port=POSTGRES_DB_PORT
-        )
-        cursor = conn.cursor()
-
-        if summary is not None:
-            update_query = """
-                UPDATE public.data_sources
-                SET token_count = %s, summary = %s
-                WHERE id = %s;
-            """
-            cursor.execute(update_query, (token_count, summary, data_source_id))
-        else:
-            update_query = """
-                UPDATE public.data_sources
-                SET token_count = %s
-                WHERE id = %s;
-            """
-            cursor.execute(update_query, (token_count, data_source_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                if summary is not None:
+                    update_query = """
+                        UPDATE public.data_sources
+                        SET token_count = %s, summary = %s
+                        WHERE id = %s;
+                    """
+                    cursor.execute(update_query, (token_count, summary, data_source_id))
+                else:
+                    update_query = """
+                        UPDATE public.data_sources
+                        SET token_count = %s
+                        WHERE id = %s;
+                    """
+                    cursor.execute(update_query, (token_count, data_source_id))
         logging.info(f"Summary stored successfully for data_source_id: {data_source_id}")
     except Exception as e:
         logging.error(f"Error storing summary in the database: {e}")
         raise Exception("Failed to store summary in the database.")
 
-def get_datasource_by_id(data_source_id):
-    try:
-        # Connect to the PostgreSQL database
-        conn = psycopg2.connect(
-            dbname=POSTGRES_DB_DATABASE,
-            user=POSTGRES_DB_USERNAME,
-            password=POSTGRES_DB_PASSWORD,
-            host=POSTGRES_DB_HOST,
-            port=POSTGRES_DB_PORT
-        )
-        cursor = conn.cursor()
-
-        # Define the query to retrieve the data source by ID
-        select_query = """
-            SELECT id, name, origin
-            FROM public.data_sources
-            WHERE id = %s;
-        """
-        
-        # Execute the query with the provided data_source_id
-        cursor.execute(select_query, (data_source_id,))
-        
-        # Fetch the result
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-
-        if result:
-            # Return a dictionary with the data source details
-            return {
-                'id': result[0],
-                'name': result[1],
-                'origin': result[2]
-            }
-        else:
-            logging.warning(f"No data source found with id: {data_source_id}")
-            return None
-
-    except Exception as e:
-        logging.error(f"Error retrieving data source by id {data_source_id}: {e}")
-        raise Exception("Failed to retrieve data source.")
+def get_datasource_with_meeting(data_source_id):
+    """
+    Retrieve a data source and its meeting, if any, in a single query.
 
-def get_meeting_by_datasource(data_source_id):
+    Returns:
+        A (datasource_record, meeting_record) tuple. datasource_record is None
+        when the data source does not exist, meeting_record is None when no
+        meeting is linked to it.
+    """
     try:
-        # Connect to the PostgreSQL database
-        conn = psycopg2.connect(
-            dbname=POSTGRES_DB_DATABASE,
-            user=POSTGRES_DB_USERNAME,
-            password=POSTGRES_DB_PASSWORD,
-            host=POSTGRES_DB_HOST,
-            port=POSTGRES_DB_PORT
-        )
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                select_query = """
+                    SELECT ds.id, ds.name, ds.origin, m.id, m.date, m.source
+                    FROM public.data_sources ds
+                    LEFT JOIN public.meetings m ON m.data_source_id = ds.id
+                    WHERE ds.id = %s
+                    LIMIT 1;
+                """
+                cursor.execute(select_query, (data_source_id,))
+                result = cursor.fetchone()
+
+        if not result:
+            logging.warning(f"No data source found with id: {data_source_id}")
+            return None, None
 
-        # Define the query to retrieve the data source by ID
-        select_query = """
-            SELECT id, date, source
-            FROM public.meetings
-            WHERE data_source_id = %s;
-        """
-        
-        # Execute the query with the provided data_source_id
-        cursor.execute(select_query, (data_source_id,))
-        
-        # Fetch the result
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-
-        if result:
-            # Return a dictionary with the data source details
-            return {
-                'id': result[0],
-                'date': result[1],
-                'source': result[2]
+        datasource_record = {
+            'id': result[0],
+            'name': result[1],
+            'origin': result[2]
+        }
+        meeting_record = None
+        if result[3] is not None:
+            meeting_record = {
+                'id': result[3],
+                'date': result[4],
+                'source': result[5]
             }
-        else:
-            logging.warning(f"No meeting found with id: {data_source_id}")
-            return None
+        return datasource_record, meeting_record
 
     except Exception as e:
-        logging.error(f"Error retrieving meeting by id {data_source_id}: {e}")
-        raise Exception("Failed to retrieve meeting.")
+        logging.error(f"Error retrieving data source and meeting by id {data_source_id}: {e}")
+        raise Exception("Failed to retrieve data source.")
 
 def strip_tags(text: str):
     parser = HTMLParser()
@@ -298,202 +281,492 @@ def strip_tags(text: str):
     parser.feed(text)
     return ''.join(result)
 
-def add_embeddings_to_chunks(file_path):
-    try:
-        token_limit = 8000
-        with open(file_path, "r") as file:
-            data = json.load(file)
-        
-            batches = []
-            current_batch = []
-            current_tokens = 0
-
-            # Accumulate text until the batch is under the token limit
-            for item in data:
-                if item["text"] == "":
-                    html_text = item["metadata"].get("text_as_html", "")
-                    stripped = strip_tags(html_text) if html_text else ""
-                    if stripped:
-                        item["text"] = stripped
-                    else:
-                        continue
-
-                text = item["text"]
-                text_tokens = count_tokens(text)
-                if current_tokens + text_tokens > token_limit:
-                    batches.append(current_batch)
-                    current_batch = []
-                    current_tokens = 0
-
-                current_batch.append(item)
-                current_tokens += text_tokens
-
-            if current_batch:
-                logging.info("saving the remainder batch")
-                batches.append(current_batch)
-
-            # Process batches
-            for batch in batches:
-                texts = [item["text"] for item in batch]
-                response = create_embeddings(texts)
-
-                embeddings = [res.embedding for res in response.data]
-
-                # Assign embeddings back to respective items
-                for item, embedding in zip(batch, embeddings):
-                    item["embeddings"] = embedding
-        
-        with open(file_path, "w") as file:
-            json.dump(data, file, indent=2)
-    except BaseException as e:
-        logging.error(str(e))
+# Function to make sure a chunk has text to embed, falling back to its HTML table
+def prepare_chunk_text(item):
+    if item["text"] == "":
+        html_text = item["metadata"].get("text_as_html", "")
+        stripped = strip_tags(html_text) if html_text else ""
+        if not stripped:
+            return False
+        item["text"] = stripped
+        # The cached count was for the empty text
+        item.pop("token_count", None)
+    return True
+
+def build_summary_sections(chunks, section_tokens=SUMMARY_SECTION_TOKENS):
+    """
+    Split the chunk texts into sections of at most section_tokens tokens, one
+    per summary request. Uses the per-chunk token counts.
+    """
+    sections = []
+    texts = []
+    total_tokens = 0
+    for entry in chunks:
+        if texts and total_tokens + entry["token_count"] > section_tokens:
+            sections.append(" ".join(texts))
+            texts = []
+            total_tokens = 0
+        texts.append(entry["text"])
+        total_tokens += entry["token_count"]
+    if texts:
+        sections.append(" ".join(texts))
+    return sections
+
+def summarize_sections(sections):
+    """
+    Summarize a document from its sections. A single section is summarized
+    directly. Larger documents are summarized section by section in parallel,
+    then the section summaries are reduced into one.
+    """
+    if not sections:
+        return generate_summary("")
+    if len(sections) == 1:
+        return generate_summary(sections[0])
+
+    logging.info(f"Summarizing {len(sections)} sections")
+    with ThreadPoolExecutor(
+        max_workers=min(SUMMARY_MAX_CONCURRENCY, len(sections)), thread_name_prefix="summary"
+    ) as executor:
+        section_summaries = list(executor.map(generate_summary, sections))
+
+    combined = "\n\n".join(
+        f"Part {i} of {len(sections)}: {summary}"
+        for i, summary in enumerate(section_summaries, start=1)
+    )
+    return generate_summary(combined)
+
+def iter_embedding_batches(items):
+    """
+    Group chunks into embedding requests packed up to the model's limits, see
+    plan_embedding_batches. Chunks without any text are skipped.
+    """
+    def prepared_items():
+        for item in items:
+            if not prepare_chunk_text(item):
+                continue
+            if "token_count" not in item:
+                item["token_count"] = count_tokens(item["text"])
+            yield item
+
+    yield from plan_embedding_batches(prepared_items())
+
+def add_embeddings_to_chunks(batch):
+    """
+    Embed a batch of chunks. Chunks already in the embedding cache skip the
+    OpenAI call, the rest go through the shared embedding engine, which handles
+    concurrency, rate limits and retries. Errors are raised so a chunk never
+    reaches the upsert without its embedding.
+
+    Returns:
+        The float32 embedding matrix of the batch, one row per chunk.
+    """
+    texts = [item.get("embedding_text", item["text"]) for item in batch]
+    token_counts = [item["token_count"] for item in batch]
+    return embed_texts(texts, token_counts=token_counts)
     
-# Define an endpoint to trigger the full pipeline process
-@app.route('/process', methods=['POST'])
-def process_and_upload():
-    try:
-        logging.info("Starting full pipeline process...")
+# Function to partition a downloaded document through the Unstructured API
+def partition_file(file_path, strategy, split_pdf_concurrency=PDF_PAGE_CONCURRENCY, timeout=None):
+    """
+    Partition a local file through the Unstructured API.
 
-        # Get parameters from the request
-        s3_url = request.json.get("s3_url")
-        pinecone_index_name = request.json.get("pinecone_index_name")
-        data_source_id = request.json.get("data_source_id")
-        data_source_type = request.json.get("data_source_type")
-        pulse_id = request.json.get("pulse_id")  # New parameter for namespace
+    Args:
+        file_path: The file to partition.
+        strategy: The Unstructured partition strategy.
+        split_pdf_concurrency: Pages the API client partitions at the same
+            time when it splits a PDF.
+        timeout: Seconds after which the call is abandoned, None to wait.
 
-        # Check if all required parameters are provided
-        if not s3_url:
-            raise ValueError("Missing s3_url in request")
-        if not pinecone_index_name:
-            raise ValueError("Missing pinecone_index_name in request")
-        if not data_source_id:
-            raise ValueError("Missing data_source_id in request")
-        if not data_source_type:
-            raise ValueError("Missing data_source_type in request")    
-        if not pulse_id:
-            raise ValueError("Missing pulse_id in request")
+    Returns:
+        The partitioned elements as dicts.
+    """
+    partitioner = Partitioner(config=PartitionerConfig(
+        partition_by_api=True,
+        api_key=os.getenv("UNSTRUCTURED_API_KEY"),
+        partition_endpoint=os.getenv("UNSTRUCTURED_API_URL"),
+        strategy=strategy,
+        additional_partition_args={
+            "split_pdf_page": True,
+            "split_pdf_allow_failed": True,
+            "split_pdf_concurrency_level": split_pdf_concurrency,
+        },
+    ))
+    # The API partitioner is a coroutine, run it on this thread's own loop
+    return asyncio.run(asyncio.wait_for(
+        partitioner.run_async(filename=Path(file_path)),
+        timeout=timeout
+    ))
+
+# Function to partition a PDF, reusing the cached results of unchanged pages
+def partition_pdf(file_path, strategy, job_id=None, metrics=None):
+    """
+    Partition a PDF page by page where it pays off. Pages whose fingerprint
+    is in the page cache are not sent to the API again. The missing pages are
+    partitioned as concurrent page ranges, or in one call for a small
+    document without cached pages. The API calls and cached pages are added
+    to the partition stage of metrics.
+
+    Returns:
+        The elements in page order, and the labels of the page ranges that
+        could not be partitioned.
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+    reader = read_pdf(file_path)
+    fingerprints = page_fingerprints(reader) if reader is not None else None
+    if not fingerprints:
+        metrics.add("partition", api_calls=1)
+        return partition_file(file_path, strategy), []
+
+    page_keys = [page_cache_key(fingerprint, strategy) for fingerprint in fingerprints]
+    cached_pages = get_cached_pages(page_keys)
+    missing_pages = [
+        page_number
+        for page_number, key in enumerate(page_keys, start=1)
+        if key not in cached_pages
+    ]
+    logging.info(f"Page cache: {len(page_keys) - len(missing_pages)} of {len(page_keys)} pages cached")
+    metrics.add("partition", pages_cached=len(page_keys) - len(missing_pages))
+
+    new_elements = []
+    failed_ranges = []
+    partitioned_pages = set(missing_pages)
+    page_ranges = []
+    if missing_pages and (cached_pages or len(page_keys) > PDF_SPLIT_MIN_PAGES):
+        page_ranges = split_pdf(reader, os.path.join(os.path.dirname(file_path), "pages"), pages=missing_pages)
+
+    if page_ranges:
+        def report_progress(ranges_done, ranges_total, failed):
+            set_job_stage(
+                job_id,
+                "partition",
+                "in_progress",
+                pages_cached=len(page_keys) - len(missing_pages),
+                ranges_done=ranges_done,
+                ranges_total=ranges_total,
+                failed_ranges=failed
+            )
+
+        metrics.add("partition", api_calls=len(page_ranges))
+        # The ranges in flight share the page requests of the document
+        range_concurrency = max(1, PDF_PAGE_CONCURRENCY // min(PDF_PARTITION_CONCURRENCY, len(page_ranges)))
+        new_elements, failed_ranges = partition_page_ranges(
+            page_ranges,
+            lambda range_path: partition_file(
+                range_path, strategy, split_pdf_concurrency=range_concurrency, timeout=PDF_RANGE_TIMEOUT_SECONDS
+            ),
+            on_progress=report_progress
+        )
+        for page_range in page_ranges:
+            if page_range["label"] in failed_ranges:
+                partitioned_pages -= set(range(page_range["first_page"], page_range["last_page"] + 1))
+    elif missing_pages:
+        if cached_pages:
+            # Splitting failed, the cached pages are partitioned again too
+            cached_pages = {}
+            partitioned_pages = set(range(1, len(page_keys) + 1))
+        metrics.add("partition", api_calls=1)
+        new_elements = partition_file(file_path, strategy)
+
+    new_pages = group_elements_by_page(new_elements)
+    if new_pages is None:
+        logging.warning("Partitioned elements have no page numbers, not caching pages")
+        return new_elements, failed_ranges
+
+    # Pages are cached as page 1 and moved to their page in each document.
+    # Pages without elements may have failed inside the API and are not cached.
+    set_cached_pages([
+        (
+            page_keys[page_number - 1],
+            [
+                dict(element, metadata=dict(element.get("metadata", {}), page_number=1))
+                for element in new_pages[page_number]
+            ]
+        )
+        for page_number in sorted(partitioned_pages)
+        if new_pages.get(page_number)
+    ])
+
+    elements = []
+    for page_number, key in enumerate(page_keys, start=1):
+        if key in cached_pages:
+            for element in cached_pages[key]:
+                element.setdefault("metadata", {})["page_number"] = page_number
+                elements.append(element)
+        else:
+            elements.extend(new_pages.get(page_number, []))
+    return elements, failed_ranges
+
+# Function to partition and chunk a document into compact chunk records
+def partition_document(file_path, strategy, chunks, job_id=None, metrics=None):
+    """
+    Partition the downloaded document, chunk it and add the compact chunk
+    records to chunks. PDFs go through partition_pdf, so only pages that
+    changed since a previous revision reach the API. The partition, chunk
+    and token count stages are recorded in metrics.
+
+    Returns:
+        The total number of tokens in the chunks, and the labels of the page
+        ranges that could not be partitioned.
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+
+    failed_ranges = []
+    started_at = time.monotonic()
+    if strategy == "vlm" and file_path.lower().endswith(".pdf"):
+        elements, failed_ranges = partition_pdf(file_path, strategy, job_id=job_id, metrics=metrics)
+    else:
+        metrics.add("partition", api_calls=1)
+        elements = partition_file(file_path, strategy)
+    logging.info(f"Partitioned {file_path} into {len(elements)} elements")
+    metrics.record(
+        "partition",
+        time.monotonic() - started_at,
+        pages=len({element.get("metadata", {}).get("page_number") for element in elements} - {None}),
+        elements=len(elements),
+        failed_ranges=len(failed_ranges)
+    )
+
+    started_at = time.monotonic()
+    _chunker = Chunker(**get_chunker_settings(strategy))
+    if strategy == "vlm":
+        logging.info("Running manual chunker")
+        # do manual chunking if working with pdfs
+        try:
+            elements = _chunker.chunk_pages(elements)
+        except BaseException as e:
+            logging.error(f"manual chunker fails: {str(e)}")
+    else:
+        elements = _chunker.chunk(elements_from_dicts(elements))
 
-        logging.info(f"Received S3 URL: {s3_url}")
-        logging.info(f"Received Pinecone Index Name: {pinecone_index_name}")
-        logging.info(f"Received Data Source ID: {data_source_id}")
-        logging.info(f"Received Pulse ID: {pulse_id}")
+    records = [compact_chunk_record(element) for element in elements]
+    metrics.record("chunk", time.monotonic() - started_at, chunks=len(records))
 
-        # Create a directory for the data_source_id
-        logging.info("Creating directory for data_source_id...")
-        output_dir = create_data_source_directory(WORK_DIR, data_source_id)
-        chunk_dir = os.path.join(output_dir, 'chunks')  # Directory for storing chunked files
-        os.makedirs(chunk_dir, exist_ok=True)
+    started_at = time.monotonic()
+    # Count every chunk once, the counts are reused for the document
+    # total, the summary input and the embedding batches
+    token_counts = count_tokens_many([record["text"] for record in records])
+    for record, record_tokens in zip(records, token_counts):
+        record["token_count"] = record_tokens
+    metrics.record("token_count", time.monotonic() - started_at, chunks=len(records), tokens=sum(token_counts))
+    chunks.extend(records)
 
-        # Stage 1: Download, chunk, and embed the file
-        logging.info("Stage 1: Downloading, chunking, and embedding the file...")
+    return sum(token_counts), failed_ranges
+
+def get_process_params(payload):
+    """
+    Validate the /process request payload and return the pipeline parameters.
+    """
+    params = {
+        "s3_url": payload.get("s3_url"),
+        "pinecone_index_name": payload.get("pinecone_index_name"),
+        "data_source_id": payload.get("data_source_id"),
+        "data_source_type": payload.get("data_source_type"),
+        "pulse_id": payload.get("pulse_id"),  # New parameter for namespace
+    }
+
+    # Check if all required parameters are provided
+    for name, value in params.items():
+        if not value:
+            raise ValueError(f"Missing {name} in request")
+
+    # Re-ingest only embeds and upserts the chunks that changed since the data
+    # source was last processed, and deletes the vectors of vanished chunks
+    params["reingest"] = bool(payload.get("reingest"))
+    previous_vector_ids = payload.get("previous_vector_ids")
+    if previous_vector_ids is not None and not isinstance(previous_vector_ids, list):
+        raise ValueError("Invalid previous_vector_ids in request")
+    params["previous_vector_ids"] = previous_vector_ids
+
+    return params
+
+def run_process_pipeline(params, job_id=None):
+    """
+    Run the full ingestion pipeline for one data source: download, partition,
+    chunk, summarize, embed and upload to Pinecone. The metrics of every stage
+    go to /metrics and, for an async job, to the metrics of its job record.
+
+    Args:
+        params: The validated request parameters from get_process_params.
+        job_id: The async job to report stage progress to, or None when the
+            pipeline runs inside the request.
+
+    Returns:
+        A dict with the generated vector IDs.
+    """
+    s3_url = params["s3_url"]
+    pinecone_index_name = params["pinecone_index_name"]
+    data_source_id = params["data_source_id"]
+    data_source_type = params["data_source_type"]
+    pulse_id = params["pulse_id"]
+    reingest = params.get("reingest", False)
+
+    logging.info(f"Received S3 URL: {s3_url}")
+    logging.info(f"Received Pinecone Index Name: {pinecone_index_name}")
+    logging.info(f"Received Data Source ID: {data_source_id}")
+    logging.info(f"Received Pulse ID: {pulse_id}")
+
+    purge_expired_checkpoints()
+    metrics = RunMetrics()
+
+    # Create a directory for the data_source_id
+    logging.info("Creating directory for data_source_id...")
+    output_dir = create_data_source_directory(WORK_DIR, data_source_id)
+
+    # Runs the preflight lookups and the download next to the request thread
+    preflight = ThreadPoolExecutor(max_workers=3, thread_name_prefix="preflight")
+    # Runs the summary next to Stage 2
+    background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="background")
+    run_lock = None
+
+    try:
+        # Stage 0: Preflight. Validate the data source, resolve the Pinecone
+        # index and HEAD the S3 object in parallel, and fail fast on a bad
+        # request before any partition work begins.
+        logging.info("Stage 0: Running preflight lookups...")
+        set_job_stage(job_id, "preflight", "in_progress")
 
         file_type = utils.get_file_extension(s3_url=s3_url)
         strategy = "vlm" if file_type in [".pdf", ".pptx", ".ppt"] else "auto"
         logging.info(f"Type {file_type} received, using {strategy} strategy")
 
-        if strategy is "vlm":
-            chunkerConfig = None
+        record_future = preflight.submit(get_datasource_with_meeting, data_source_id)
+        index_future = preflight.submit(get_pinecone_index, pinecone_index_name)
+        try:
+            object_info = utils.get_s3_object_info(s3_url)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise ValueError(f"S3 object not found: {s3_url}")
+            raise
+
+        # A retried request for the same object version resumes after the
+        # stages its previous run checkpointed
+        run_key = checkpoint_key(params, object_info)
+        run_lock = acquire_checkpoint(run_key)
+        checkpoint = load_checkpoint(run_key)
+        if checkpoint:
+            logging.info(f"Resuming from checkpoint {run_key}, completed stages: {', '.join(checkpoint)}")
+
+        # A re-process of an unchanged object reuses the stored partition result
+        cache_key = result_cache_key(object_info, strategy, get_chunker_settings(strategy))
+        if "chunked" in checkpoint:
+            cached_records = load_checkpoint_chunks(run_key)
         else:
-            chunkerConfig = ChunkerConfig(
-                chunking_strategy="by_title",
-                chunk_max_characters=1500,
-                chunk_overlap=150,
-            )
-
-        Pipeline.from_configs(
-            context=ProcessorConfig(
-                verbose=True, tqdm=True, num_processes=5, work_dir=output_dir
-            ),
-            indexer_config=S3IndexerConfig(remote_url=s3_url),
-            downloader_config=S3DownloaderConfig(),
-            source_connection_config=S3ConnectionConfig(
-                access_config=S3AccessConfig(
-                    key=os.getenv("AWS_ACCESS_KEY_ID"),
-                    secret=os.getenv("AWS_SECRET_ACCESS_KEY")
+            cached_records = get_cached_chunks(cache_key)
+
+        def download_source():
+            downloaded = checkpoint.get("downloaded")
+            if downloaded and os.path.exists(downloaded["path"]):
+                logging.info(f"Using checkpointed download {downloaded['path']}")
+                return downloaded["path"]
+            with metrics.timed("download", api_calls=1):
+                file_path = utils.download_s3_object(
+                    s3_url, checkpoint_path(run_key, "source"), object_info["etag"]
                 )
-            ),
-            partitioner_config=PartitionerConfig(
-                partition_by_api=True,
-                api_key=os.getenv("UNSTRUCTURED_API_KEY"),
-                partition_endpoint=os.getenv("UNSTRUCTURED_API_URL"),
-                strategy=strategy,
-                additional_partition_args={
-                    "split_pdf_page": True,
-                    "split_pdf_allow_failed": True,
-                    "split_pdf_concurrency_level": 15,
-                },
-            ),
-            chunker_config=chunkerConfig,
-            # embedder_config=EmbedderConfig(
-            #     embedding_provider="openai",
-            #     embedding_model_name=OPENAI_EMBEDDING_MODEL,
-            #     embedding_api_key=os.getenv("OPENAI_API_KEY")
-            # ),
-            uploader_config=LocalUploaderConfig(output_dir=chunk_dir)  # Save chunks locally in the directory
-        ).run()
-
-        if strategy == "vlm":
-            logging.info("Running manual chunker")
-            # do manual chunking if working with pdfs
-            try:
-                file = Path(get_first_json_file(chunk_dir))
+                metrics.add("download", bytes=os.path.getsize(file_path))
+            save_checkpoint(run_key, "downloaded", path=file_path)
+            return file_path
 
-                output_dir_path = Path(output_dir)
-                pages_output_dir = output_dir_path / 'pages'
+        # The download doesn't need the lookups, start it while they are in
+        # flight. The ETag pins it to the object version the cache key is for.
+        download_future = None
+        if cached_records is None:
+            download_future = preflight.submit(download_source)
 
-                _chunker = Chunker(output_dir=Path(pages_output_dir), chunking_strategy="by_title", chunk_max_characters=1500, chunk_overlap=150)
-                _chunker.run(elements_filepath=file)
-            except BaseException as e:
-                logging.error(f"manual chunker fails: {str(e)}")
-        
-        logging.info("Stage 1 completed: File processed, chunked, and embedded.")
-
-        # Stage 1.5: Generate and store summary
-        logging.info("Stage 1.5: Generating and storing summary...")
-        full_text = ""
-        for root, dirs, files in os.walk(chunk_dir):
-            for filename in files:
-                if filename.endswith(".json"):
-                    file_path = os.path.join(root, filename)
-                    with open(file_path, "r") as file:
-                        data = json.load(file)
-                        full_text += " ".join(entry["text"] for entry in data)
-
-        token_count = count_tokens(full_text)
-        logging.info(f"Total tokens {token_count}")
-        
-        datasource_record = get_datasource_by_id(data_source_id)
+        datasource_record, meeting_record = record_future.result()
         if datasource_record is None:
-            logging.error(f"Bad request: Data source not found")
-            return jsonify({"error": "Data source not found"}), 400
-        
-        meeting_record = get_meeting_by_datasource(data_source_id)
+            raise ValueError("Data source not found")
+        pinecone_index = index_future.result()
+
+        logging.info("Stage 0 completed: Preflight passed.")
+        set_job_stage(
+            job_id, "preflight", "completed", object_size=object_info["size"], checkpoint_key=run_key
+        )
 
+        # Stage 1: Download, partition and chunk the file
+        logging.info("Stage 1: Downloading, partitioning and chunking the file...")
+        set_job_stage(job_id, "partition", "in_progress")
 
-        token_limit = 128_000
-        if datasource_record and datasource_record.get("origin") != "meeting":
-            if token_count > token_limit:
-                full_text = full_text[:2000] # incase file is too large
-            summary = generate_summary(full_text)
-            set_fields_in_db(data_source_id, token_count, summary)
+        # Every later stage works on these in-memory records
+        chunks = ChunkCollection(spill_dir=output_dir)
+        failed_ranges = []
+        if cached_records is not None:
+            chunks.extend(cached_records)
+            token_count = sum(record["token_count"] for record in chunks)
         else:
-            set_fields_in_db(data_source_id, token_count, summary=None)
+            file_path = download_future.result()
+            token_count, failed_ranges = partition_document(
+                file_path, strategy, chunks, job_id=job_id, metrics=metrics
+            )
+            # A document with skipped page ranges is partitioned again next time
+            if not failed_ranges:
+                set_cached_chunks(cache_key, chunks)
+        if not failed_ranges and "chunked" not in checkpoint:
+            save_checkpoint_chunks(run_key, chunks)
+
+        logging.info("Stage 1 completed: File processed and chunked.")
+        set_job_stage(job_id, "partition", "completed", chunks=len(chunks), cached=cached_records is not None)
+
+        # Stage 1.5: Generate and store summary. It runs in the background
+        # while Stage 2 embeds and upserts the chunks.
+        logging.info("Stage 1.5: Generating and storing summary in the background...")
+        set_job_stage(job_id, "summary", "in_progress")
+        logging.info(f"Total tokens {token_count}")
 
-        logging.info("Summary generation and storage completed.")
+        summarize = datasource_record.get("origin") != "meeting"
+        # Sections are built before Stage 2 starts changing the chunk records
+        summary_sections = build_summary_sections(chunks) if summarize else []
+
+        def summary_stage():
+            started_at = time.monotonic()
+            if "summarized" in checkpoint:
+                logging.info("Summary already stored by the previous run.")
+            elif summarize:
+                summary_model = os.getenv("OPENAI_SUMMARY_MODEL")
+                summary = get_cached_summary(cache_key, summary_model)
+                if summary is None:
+                    summary = summarize_sections(summary_sections)
+                    set_cached_summary(cache_key, summary_model, summary)
+                    # One call per section, plus the reduce of several sections
+                    metrics.add(
+                        "summary",
+                        tokens=token_count,
+                        api_calls=len(summary_sections) + 1 if len(summary_sections) > 1 else 1
+                    )
+                set_fields_in_db(data_source_id, token_count, summary)
+            else:
+                set_fields_in_db(data_source_id, token_count, summary=None)
+            save_checkpoint(run_key, "summarized")
+            metrics.record("summary", time.monotonic() - started_at, sections=len(summary_sections))
+
+            logging.info("Summary generation and storage completed.")
+            set_job_stage(
+                job_id, "summary", "completed", token_count=token_count, sections=len(summary_sections)
+            )
 
+        summary_future = background.submit(summary_stage)
 
-        # Stage 2: Add metadata and upload to Pinecone
+        # Stage 2: Add metadata, embed and upload to Pinecone. The stages are
+        # streamed so embedding and upserts start as soon as chunks are ready.
         logging.info("Stage 2: Adding metadata and uploading to Pinecone...")
-        
+        set_job_stage(job_id, "embedding", "in_progress")
+        set_job_stage(job_id, "upsert", "in_progress")
+
         # Initialize list to store generated vector IDs
         vector_ids = []
+        embedded_chunks = [0]
+        upsert_latencies = []
+        progress_lock = threading.Lock()
 
-        def add_metadata_to_chunks(file_path):
-            with open(file_path, "r") as file:
-                data = json.load(file)
+        def add_metadata_to_chunks(data):
+            """
+            Add custom metadata and an ID to each chunk, yielding the chunks as
+            they are ready so the embedding stage can start right away.
+            """
             previous_page_number = None
             previous_chunk_number = -1
-            # Add custom metadata and generate a unique ID for each chunk
+            seen_ids = set()
+            # Add custom metadata and generate a deterministic ID for each chunk
             for entry in data:
                 if entry["metadata"].get("page_number"):
                     current_page_number = entry["metadata"]["page_number"]
@@ -524,59 +797,214 @@ def process_and_upload():
                     ).timestamp()
                 # Sanitize metadata and retain the text field
                 entry["metadata"] = sanitize_metadata(entry)
-                # Generate a unique ID for each chunk
-                entry["id"] = str(uuid.uuid4())
-            with open(file_path, "w") as file:
-                json.dump(data, file, indent=2)
-
-        # Process all JSON files and add metadata to each chunk
-        for root, dirs, files in os.walk(chunk_dir):
-            for filename in files:
-                if filename.endswith(".json"):
-                    file_path = os.path.join(root, filename)
-                    logging.info(f"Processing file {filename} for metadata addition")
-                    add_metadata_to_chunks(file_path)
-                    add_embeddings_to_chunks(file_path)
-       
-        # Initialize Pinecone and upload the updated chunks
-        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-        pc = set_index_host(pc, pinecone_index_name)
-        pinecone_index = pc.Index(pinecone_index_name)
-
-        for root, dirs, files in os.walk(chunk_dir):
-            for filename in files:
-                if filename.endswith(".json"):
-                    file_path = os.path.join(root, filename)
-                    with open(file_path, "r") as file:
-                        data = json.load(file)
-                    upserts = []
-                    temp_ids = []
-                    for entry in data:
-                        upsert_item = {
-                            "id": entry["id"],
-                            "values": entry["embeddings"],
-                            "metadata": entry["metadata"]
+                # The same chunk text always gets the same ID
+                vector_id = vector_id_for_chunk(
+                    data_source_id,
+                    entry["text"] or entry["metadata"].get("text_as_html", "")
+                )
+                # Repeated chunks are told apart by their occurrence
+                suffix = 0
+                entry["id"] = vector_id
+                while entry["id"] in seen_ids:
+                    suffix += 1
+                    entry["id"] = f"{vector_id}-{suffix}"
+                seen_ids.add(entry["id"])
+                yield entry
+
+        def skip_unchanged_chunks(entries):
+            # Chunks whose vector already exists, or was upserted by the
+            # previous run, keep it as is
+            for entry in entries:
+                if entry["id"] in existing_ids or entry["id"] in resumed_ids:
+                    kept_ids.append(entry["id"])
+                    if entry["id"] not in resumed_ids:
+                        # The chunk may have moved since the previous ingestion
+                        kept_positions[entry["id"]] = {
+                            "page_number": entry["metadata"]["page_number"],
+                            "chunk_number": entry["metadata"]["chunk_number"],
                         }
-                        upserts.append(upsert_item)
-                        temp_ids.append(entry["id"])
-                    # Upload to Pinecone with the namespace set as pulse_id
-                    batch_size = 100
-
-                    for i in range(0, len(upserts), batch_size):
-                        batch = upserts[i:i + batch_size]
-                        pinecone_index.upsert(vectors=batch, namespace=pulse_id)
-                    # Collect the vector IDs for this JSON file
-                    vector_ids.extend(temp_ids)
-                    logging.info(f"Uploaded {filename} to Pinecone with namespace: {pulse_id}")
+                    continue
+                yield entry
+
+        def embed_stage(batch):
+            with metrics.busy("embedding"):
+                embeddings = add_embeddings_to_chunks(batch)
+            metrics.add(
+                "embedding", chunks=len(batch), tokens=sum(item["token_count"] for item in batch), batches=1
+            )
+            with progress_lock:
+                embedded_chunks[0] += len(batch)
+                chunks_embedded = embedded_chunks[0]
+            set_job_stage(job_id, "embedding", "in_progress", chunks_embedded=chunks_embedded)
+
+            if PINECONE_METADATA_MODE == "slim":
+                # Saved before the upsert so a vector never points to missing text
+                store_chunk_texts(
+                    (entry["id"], data_source_id, entry["text"], entry["metadata"].get("text_as_html"))
+                    for entry in batch
+                )
+                for entry in batch:
+                    entry["metadata"] = slim_metadata(entry["metadata"])
+
+            # The values are rows of the batch's embedding matrix, they are
+            # only turned into floats when the upsert request is built
+            upserts = [
+                {
+                    "id": entry["id"],
+                    "values": embeddings[i],
+                    "metadata": entry["metadata"]
+                }
+                for i, entry in enumerate(batch)
+            ]
+            # Upload to Pinecone in batches packed by payload size
+            return pack_upsert_batches(upserts)
+
+        def upsert_stage(batch):
+            # Upload to Pinecone with the namespace set as pulse_id
+            with metrics.busy("upsert"):
+                latency = upsert_batch(pinecone_index, batch, pulse_id)
+            metrics.add("upsert", chunks=len(batch), api_calls=1, batches=1)
+            append_upserted_ids(run_key, [item["id"] for item in batch])
+            # Collect the vector IDs for this batch
+            with progress_lock:
+                vector_ids.extend(item["id"] for item in batch)
+                upsert_latencies.append(latency)
+                vectors_upserted = len(vector_ids)
+            set_job_stage(job_id, "upsert", "in_progress", vectors_upserted=vectors_upserted)
+
+        # Vectors from the previous ingestion of this data source
+        existing_ids = set()
+        kept_ids = []
+        kept_positions = {}
+        resumed_ids = set(load_upserted_ids(run_key))
+        if resumed_ids:
+            logging.info(f"Skipping {len(resumed_ids)} vectors upserted by the previous run")
+        if reingest:
+            if params.get("previous_vector_ids") is not None:
+                existing_ids = set(params["previous_vector_ids"])
+            else:
+                existing_ids = set(list_vector_ids(
+                    pinecone_index, vector_id_prefix(data_source_id), pulse_id
+                ))
+            logging.info(f"Re-ingesting against {len(existing_ids)} existing vectors")
+
+        run_streaming_stages(
+            source=iter_embedding_batches(skip_unchanged_chunks(
+                metrics.busy_iter("metadata", add_metadata_to_chunks(chunks))
+            )),
+            stages=[
+                ("embedding", embed_stage, EMBEDDING_MAX_CONCURRENCY),
+                ("upsert", upsert_stage, UPSERT_MAX_CONCURRENCY),
+            ]
+        )
+
+        # Kept vectors keep their values, only their position is updated
+        moved_count = update_moved_vectors(pinecone_index, kept_positions, pulse_id)
+
+        # Remove the vectors of chunks that are gone from the new version.
+        # The chunks of skipped page ranges are unknown, so nothing is
+        # removed from a partial run.
+        vanished_ids = existing_ids - set(kept_ids) - set(vector_ids)
+        if failed_ranges:
+            logging.warning(f"Partial run, keeping {len(vanished_ids)} previous vectors of {data_source_id}")
+            kept_ids.extend(sorted(vanished_ids))
+            vanished_ids = set()
+        if vanished_ids:
+            delete_vectors(pinecone_index, vanished_ids, pulse_id)
+            if PINECONE_METADATA_MODE == "slim":
+                delete_chunk_texts(vanished_ids)
+
+        metrics.finish("metadata")
+        metrics.finish("embedding")
+        metrics.finish("upsert")
 
         logging.info("Stage 2 completed: Metadata added and uploaded to Pinecone.")
+        set_job_stage(job_id, "embedding", "completed", chunks_embedded=embedded_chunks[0])
+        set_job_stage(
+            job_id,
+            "upsert",
+            "completed",
+            vectors_upserted=len(vector_ids),
+            vectors_kept=len(kept_ids),
+            vectors_moved=moved_count,
+            vectors_deleted=len(vanished_ids),
+            batches=len(upsert_latencies),
+            max_batch_latency_ms=round(max(upsert_latencies, default=0) * 1000)
+        )
+
+        # The request finishes with whichever of the summary and Stage 2 is last
+        summary_future.result()
+
+        # Every stage went through, nothing left to resume
+        clear_checkpoint(run_key)
+
+        count_run("completed")
+        logging.info(f"Stage metrics: {json.dumps(metrics.as_dict())}")
+        # Pages of failed ranges keep their previous vectors or are missing
+        # from the index, the caller retries to fill them in
+        return {"vector_ids": kept_ids + vector_ids, "failed_ranges": failed_ranges}
+
+    except (ValueError, CheckpointBusyError):
+        count_run("rejected")
+        raise
+
+    except Exception:
+        count_run("failed")
+        raise
+
+    finally:
+        update_process_job(job_id, metrics=metrics.as_dict())
+        # The checkpoint of a failed run is kept for a retry, only the work
+        # directory goes. Don't wait for a download that a failed preflight
+        # made useless.
+        preflight.shutdown(wait=False, cancel_futures=True)
+        background.shutdown(wait=False)
+        if run_lock is not None:
+            release_checkpoint(run_lock)
+        # Cleanup local files, make to cleanup even if the request fail
+        logging.info("Cleaning up local files...")
+        cleanup_local_files(output_dir)
+
+# Define an endpoint to trigger the full pipeline process
+@app.route('/process', methods=['POST'])
+def process_and_upload():
+    """
+    Run the ingestion pipeline for a data source. By default the pipeline runs
+    inside the request and the vector IDs are returned. With "async": true in
+    the payload the job is queued on the worker pool and a job ID is returned
+    right away with a 202; progress is available from /process/status/<job_id>.
+    """
+    try:
+        logging.info("Starting full pipeline process...")
+
+        params = get_process_params(request.json)
+
+        if request.json.get("async"):
+            job_id = create_process_job(params["data_source_id"])
+            try:
+                submit_process_job(job_id, run_process_pipeline, params, job_id=job_id)
+            except JobQueueFullError as e:
+                update_process_job(job_id, status="failed", error=str(e))
+                logging.warning(f"Rejected job {job_id}: {e}")
+                return jsonify({"error": str(e)}), 503
+
+            logging.info(f"Queued job {job_id} for data source {params['data_source_id']}")
+            return jsonify({"job_id": job_id}), 202
+
+        result = run_process_pipeline(params)
 
         # Return the vector IDs along with a success message
         return jsonify({
             "message": "File processed, metadata added, and uploaded to Pinecone successfully",
-            "vector_ids": vector_ids
+            "vector_ids": result["vector_ids"],
+            "partial": bool(result["failed_ranges"]),
+            "failed_ranges": result["failed_ranges"]
         }), 200
 
+    except CheckpointBusyError as e:
+        logging.warning(f"Rejected duplicate request: {e}")
+        return jsonify({"error": str(e)}), 409
+
     except ValueError as e:
         logging.error(f"Bad request: {e}")
         return jsonify({"error": str(e)}), 400
@@ -584,11 +1012,30 @@ def process_and_upload():
     except Exception as e:
         logging.error(f"An error occurred: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
-    
-    finally:
-        # Cleanup local files, make to cleanup even if the request fail
-        logging.info("Cleaning up local files...")
-        cleanup_local_files(output_dir)
+
+@app.route('/chunks/text', methods=['POST'])
+def get_chunk_texts_endpoint():
+    """
+    Bulk fetch the full text and HTML of chunks stored with slim Pinecone
+    metadata, by vector ID.
+    """
+    try:
+        vector_ids = request.json.get("vector_ids")
+        if not isinstance(vector_ids, list) or not vector_ids:
+            return jsonify({"error": "Missing vector_ids in request"}), 400
+
+        return jsonify({"chunks": fetch_chunk_texts(vector_ids)}), 200
+
+    except Exception as e:
+        logging.error(f"An error occurred: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/process/status/<job_id>', methods=['GET'])
+def get_process_status_endpoint(job_id):
+    job_data = get_process_job(job_id)
+    if not job_data:
+        return jsonify({"error": "Job ID not found"}), 404
+    return jsonify(job_data), 200
 
 # Endpoint for Elevenlabs dubbing
 def async_dub_process(job_id, source_s3_url, target_s3_url, source_language, target_language):
@@ -667,6 +1114,8 @@ def mark_deleted():
       - pinecone_index_name: The Pinecone index name (organization id).
       - pulse_id: The namespace used in Pinecone.
       - vector_ids: A list of vector ID strings for the datasource.
+    IDs not processed within MARK_DELETED_TIME_BUDGET_SECONDS are returned in
+    remaining_vector_ids.
     """
     try:
         # Retrieve parameters from the request
@@ -681,51 +1130,101 @@ def mark_deleted():
         if not vector_ids or not isinstance(vector_ids, list):
             raise ValueError("Missing or invalid vector_ids in request")
         
-        # Initialize the Pinecone client
-        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-        pc = set_index_host(pc, pinecone_index_name)
-        pinecone_index = pc.Index(pinecone_index_name)
-        
-        updated_vector_ids = []
-        errors = []
-        
-        # Process each vector id
-        for vid in vector_ids:
-            try:
-                # Fetch the vector details from Pinecone.
-                fetched = pinecone_index.fetch(ids=[vid], namespace=pulse_id)
-                # Access the vectors attribute directly, since `fetched` is a FetchResponse object.
-                vectors = fetched.vectors  
-                
-                if vid not in vectors:
-                    raise Exception(f"Vector ID {vid} not found in index.")
-                
-                vector_data = vectors[vid]
-                # Use attribute access to retrieve metadata and values.
-                metadata = vector_data.metadata if hasattr(vector_data, "metadata") and vector_data.metadata is not None else {}
-                metadata["isDeleted"] = True
-                
-                updated_vector = {
-                    "id": vid,
-                    "values": vector_data.values if hasattr(vector_data, "values") else None,
-                    "metadata": metadata
-                }
-                
-                # Upsert the updated vector back into Pinecone.
-                pinecone_index.upsert(vectors=[updated_vector], namespace=pulse_id)
-                updated_vector_ids.append(vid)
-                logging.info(f"Vector {vid} successfully marked as deleted.")
-            except Exception as e:
-                errors.append(f"Error updating {vid}: {str(e)}")
-                logging.error(f"Error updating vector {vid} as deleted: {str(e)}")
-        
+        # Get the shared Pinecone index handle
+        pinecone_index = get_pinecone_index(pinecone_index_name)
+
+        # Flip isDeleted with metadata-only updates, stopping early enough to
+        # answer before the gunicorn timeout
+        result = mark_vectors_deleted(
+            pinecone_index,
+            vector_ids,
+            pulse_id,
+            deadline=time.monotonic() + MARK_DELETED_TIME_BUDGET_SECONDS
+        )
+
+        # Vectors that were already flagged keep their deletedAt
         response = {
             "message": "Operation completed.",
-            "updated_vector_ids": updated_vector_ids
+            "updated_vector_ids": result["updated_ids"] + result["skipped_ids"]
         }
-        if errors:
-            response["errors"] = errors
-        
+        if result["errors"]:
+            response["errors"] = result["errors"]
+        if result["remaining_ids"]:
+            # Partial progress, the caller sends the remaining IDs again
+            response["message"] = "Operation partially completed."
+            response["remaining_vector_ids"] = result["remaining_ids"]
+
+        return jsonify(response), 200
+
+    except ValueError as e:
+        logging.error(f"Bad request: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Operation failed: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/delete_data_source', methods=['POST'])
+def delete_data_source():
+    """
+    Endpoint to delete every Pinecone vector of a data source, found by the
+    data source prefix of the vector IDs.
+    Expects a JSON payload with:
+      - pinecone_index_name: The Pinecone index name (organization id).
+      - pulse_id: The namespace used in Pinecone.
+      - data_source_id: The data source whose vectors are deleted.
+      - mode: "soft" to flag the vectors with isDeleted (default), "hard" to
+        delete them.
+    A soft delete that runs out of MARK_DELETED_TIME_BUDGET_SECONDS returns
+    "complete": false and is finished by calling the endpoint again.
+    """
+    try:
+        pinecone_index_name = request.json.get("pinecone_index_name")
+        pulse_id = request.json.get("pulse_id")
+        data_source_id = request.json.get("data_source_id")
+        mode = request.json.get("mode", "soft")
+
+        if not pinecone_index_name:
+            raise ValueError("Missing pinecone_index_name in request")
+        if not pulse_id:
+            raise ValueError("Missing pulse_id in request")
+        if not data_source_id:
+            raise ValueError("Missing data_source_id in request")
+        if mode not in ("soft", "hard"):
+            raise ValueError("Invalid mode in request, expected soft or hard")
+
+        pinecone_index = get_pinecone_index(pinecone_index_name)
+        vector_ids = list_vector_ids(pinecone_index, vector_id_prefix(data_source_id), pulse_id)
+        logging.info(f"Found {len(vector_ids)} vectors of data source {data_source_id}")
+
+        if mode == "hard":
+            delete_vectors(pinecone_index, vector_ids, pulse_id)
+            if PINECONE_METADATA_MODE == "slim":
+                delete_chunk_texts(vector_ids)
+            return jsonify({
+                "message": "Operation completed.",
+                "deleted": len(vector_ids),
+                "complete": True
+            }), 200
+
+        # Vectors flagged by an earlier call are skipped, so each call moves
+        # on and their deletedAt is kept
+        result = mark_vectors_deleted(
+            pinecone_index,
+            vector_ids,
+            pulse_id,
+            deadline=time.monotonic() + MARK_DELETED_TIME_BUDGET_SECONDS
+        )
+        response = {
+            "message": "Operation completed.",
+            "updated": len(result["updated_ids"]),
+            "already_deleted": len(result["skipped_ids"]),
+            "complete": not result["remaining_ids"] and not result["errors"]
+        }
+        if result["errors"]:
+            response["errors"] = result["errors"]
+        if result["remaining_ids"]:
+            response["message"] = "Operation partially completed."
+            response["remaining"] = len(result["remaining_ids"])
         return jsonify(response), 200
 
     except ValueError as e:
@@ -735,6 +1234,59 @@ def mark_deleted():
         logging.error(f"Operation failed: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/purge_namespace', methods=['POST'])
+def purge_namespace():
+    """
+    Endpoint to hard delete every vector of a pulse namespace, and in slim
+    metadata mode the stored text of its chunks.
+    Expects a JSON payload with:
+      - pinecone_index_name: The Pinecone index name (organization id).
+      - pulse_id: The namespace to purge.
+    """
+    try:
+        pinecone_index_name = request.json.get("pinecone_index_name")
+        pulse_id = request.json.get("pulse_id")
+
+        if not pinecone_index_name:
+            raise ValueError("Missing pinecone_index_name in request")
+        if not pulse_id:
+            raise ValueError("Missing pulse_id in request")
+
+        pinecone_index = get_pinecone_index(pinecone_index_name)
+        # The stored chunk texts are keyed by vector ID only, list the IDs
+        # while they still exist
+        vector_ids = list_vector_ids(pinecone_index, "", pulse_id) if PINECONE_METADATA_MODE == "slim" else []
+        delete_namespace(pinecone_index, pulse_id)
+        delete_chunk_texts(vector_ids)
+        return jsonify({"message": "Operation completed."}), 200
+
+    except ValueError as e:
+        logging.error(f"Bad request: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Operation failed: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/sweep', methods=['POST'])
+def trigger_sweep():
+    """
+    Start a sweep of the soft-deleted vectors in the background. A sweep
+    already running in any worker makes this one a no-op.
+    """
+    threading.Thread(target=run_sweep, name="sweep", daemon=True).start()
+    return jsonify({"message": "Sweep started."}), 202
+
+@app.route('/sweep/status', methods=['GET'])
+def get_sweep_status():
+    return jsonify(get_sweep_state()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Per-stage /process metrics of all workers in the Prometheus text format.
+    """
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/')
 def health_check():
     return 'OK', 200
\ No newline at end of file
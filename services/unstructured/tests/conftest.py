@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The service modules import each other from the service directory, as they
+# do when gunicorn runs flask_processor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The OpenAI client is created when utils.openai_utils is imported, no request
+# is made with this key
+os.environ.setdefault("OPENAI_API_KEY", "test")
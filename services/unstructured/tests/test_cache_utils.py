@@ -0,0 +1,30 @@
+import pytest
+
+from utils import metrics_utils
+from utils.cache_utils import SqliteLRUCache
+
+
+@pytest.fixture
+def counters(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics_utils, "METRICS_DIR", str(tmp_path / "metrics"))
+    monkeypatch.setattr(metrics_utils, "_counters", {})
+    return metrics_utils._counters
+
+
+def test_hits_and_misses_are_counted(tmp_path, counters):
+    cache = SqliteLRUCache(str(tmp_path / "embeddings.sqlite"), max_bytes=1024)
+    cache.set("a", b"1")
+
+    assert cache.get_many(["a", "b", "b"]) == {"a": b"1"}
+    assert counters["unstructured_cache_hits_total"] == {'cache="embeddings"': 1}
+    assert counters["unstructured_cache_misses_total"] == {'cache="embeddings"': 1}
+
+
+def test_evictions_are_counted(tmp_path, counters):
+    cache = SqliteLRUCache(str(tmp_path / "pages.sqlite"), max_bytes=100)
+    cache.set_many([(str(i), b"x" * 30) for i in range(4)])
+
+    # Evicts down to 90% of max_bytes
+    assert len(cache.get_many(["0", "1", "2", "3"])) == 3
+    assert counters["unstructured_cache_evictions_total"] == {'cache="pages"': 1}
+    assert "unstructured_cache_misses_total" in metrics_utils.render_metrics()
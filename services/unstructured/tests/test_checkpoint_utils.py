@@ -0,0 +1,53 @@
+import os
+import time
+
+import pytest
+
+from utils import checkpoint_utils
+from utils.checkpoint_utils import CheckpointBusyError
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint_utils, "CHECKPOINT_DIR", str(tmp_path))
+    monkeypatch.setattr(checkpoint_utils, "CHECKPOINT_RETENTION_SECONDS", 3600)
+    return tmp_path
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_a_key_is_held_by_one_run():
+    lock_file = checkpoint_utils.acquire_checkpoint("ds-1-abc")
+    with pytest.raises(CheckpointBusyError):
+        checkpoint_utils.acquire_checkpoint("ds-1-abc")
+
+    checkpoint_utils.release_checkpoint(lock_file)
+    checkpoint_utils.release_checkpoint(checkpoint_utils.acquire_checkpoint("ds-1-abc"))
+
+
+def test_checkpoint_being_appended_to_is_not_purged(checkpoint_dir):
+    checkpoint_utils.save_checkpoint("ds-1-abc", "downloaded", path="/tmp/file.pdf")
+    age(checkpoint_dir / "ds-1-abc" / "state.json", 7200)
+    checkpoint_utils.append_upserted_ids("ds-1-abc", ["ds-1#a"])
+    age(checkpoint_dir / "ds-1-abc", 7200)
+
+    checkpoint_utils.purge_expired_checkpoints()
+
+    assert checkpoint_utils.load_upserted_ids("ds-1-abc") == ["ds-1#a"]
+
+
+def test_expired_checkpoint_is_purged_unless_running(checkpoint_dir):
+    for key in ("ds-1-abc", "ds-2-abc"):
+        checkpoint_utils.save_checkpoint(key, "downloaded", path="/tmp/file.pdf")
+        age(checkpoint_dir / key / "state.json", 7200)
+        age(checkpoint_dir / key, 7200)
+    lock_file = checkpoint_utils.acquire_checkpoint("ds-2-abc")
+
+    checkpoint_utils.purge_expired_checkpoints()
+    checkpoint_utils.release_checkpoint(lock_file)
+
+    assert not os.path.exists(checkpoint_dir / "ds-1-abc")
+    assert os.path.exists(checkpoint_dir / "ds-2-abc")
@@ -0,0 +1,35 @@
+from chunker import Chunker
+
+PAGE_HTML = '<div class="Page" data-page-number="1"></div>'
+
+
+def element(text, page_number=None, html="<p></p>"):
+    metadata = {"text_as_html": html}
+    if page_number is not None:
+        metadata["page_number"] = page_number
+    return {"type": "NarrativeText", "text": text, "metadata": metadata}
+
+
+def test_split_into_pages_keeps_the_page_numbers_of_partitioned_elements():
+    # Pages 3 and 4 were in a skipped range
+    elements = [
+        element("a", 1, PAGE_HTML),
+        element("b", 2, PAGE_HTML),
+        element("c", 2),
+        element("e", 5, PAGE_HTML),
+    ]
+    pages = list(Chunker("basic", 500)._split_into_pages(elements))
+    assert [[e["text"] for e in page] for page in pages] == [["a"], ["b", "c"], ["e"]]
+    assert [page[0]["metadata"]["page_number"] for page in pages] == [1, 2, 5]
+
+
+def test_split_into_pages_counts_page_markers_without_page_numbers():
+    elements = [element("a", html=PAGE_HTML), element("b"), element("c", html=PAGE_HTML)]
+    pages = list(Chunker("basic", 500)._split_into_pages(elements))
+    assert [[e["metadata"]["page_number"] for e in page] for page in pages] == [[1, 1], [2]]
+
+
+def test_chunk_pages_numbers_chunks_by_their_page():
+    elements = [element("first page", 1, PAGE_HTML), element("fifth page", 5, PAGE_HTML)]
+    chunks = Chunker("basic", 500).chunk_pages(elements)
+    assert [chunk["metadata"]["page_number"] for chunk in chunks] == [1, 5]
@@ -0,0 +1,185 @@
+import threading
+
+import httpx
+import numpy as np
+import openai
+import pytest
+
+from utils import embedding_utils
+from utils.embedding_utils import (
+    EmbeddingDispatcher,
+    RateLimiter,
+    fit_embedding_input,
+    plan_embedding_batches,
+)
+
+
+def truncate_words(text, max_tokens):
+    # One token per word, enough to check the truncation is used
+    words = text.split()
+    return " ".join(words[:max_tokens]), min(len(words), max_tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(embedding_utils, "truncate_to_tokens", truncate_words)
+
+
+def chunk(tokens, word="word"):
+    return {"text": " ".join([word] * tokens), "token_count": tokens}
+
+
+def test_input_under_the_limit_is_left_alone():
+    item = chunk(50)
+    fit_embedding_input(item, max_input_tokens=100)
+    assert item == chunk(50)
+
+
+def test_input_over_the_limit_is_truncated_for_the_embedding_only():
+    item = chunk(150)
+    fit_embedding_input(item, max_input_tokens=100)
+
+    assert item["embedding_text"] == " ".join(["word"] * 100)
+    assert item["text"] == " ".join(["word"] * 150)
+    assert item["token_count"] == 100
+
+
+def test_batches_are_split_by_number_of_inputs():
+    batches = list(plan_embedding_batches([chunk(1) for _ in range(5)], max_inputs=2, max_tokens=1000))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_batches_are_split_by_tokens_with_headroom():
+    # 90% of 100 tokens fit in a request
+    batches = list(plan_embedding_batches([chunk(40), chunk(40), chunk(40)], max_inputs=10, max_tokens=100))
+    assert [[item["token_count"] for item in batch] for batch in batches] == [[40, 40], [40]]
+
+
+def test_oversized_input_gets_a_batch_of_its_own():
+    limit = embedding_utils.EMBEDDING_MAX_INPUT_TOKENS
+    items = [chunk(10), chunk(limit * 2), chunk(10)]
+
+    batches = list(plan_embedding_batches(items, max_inputs=10, max_tokens=limit))
+
+    assert [len(batch) for batch in batches] == [1, 1, 1]
+    assert batches[1][0]["token_count"] == limit
+    assert "embedding_text" in batches[1][0]
+
+
+def test_no_batches_without_items():
+    assert list(plan_embedding_batches([], max_inputs=10, max_tokens=100)) == []
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(embedding_utils, "time", clock)
+    return clock
+
+
+def test_calls_within_the_budget_do_not_wait(clock):
+    limiter = RateLimiter(requests_per_minute=10, tokens_per_minute=1000)
+    for _ in range(4):
+        limiter.acquire(250)
+    assert clock.sleeps == []
+
+
+def test_call_waits_for_the_tokens_it_misses(clock):
+    limiter = RateLimiter(requests_per_minute=10, tokens_per_minute=600)
+    limiter.acquire(600)
+    limiter.acquire(60)
+    # 60 tokens refill in 6 seconds at 600 per minute
+    assert sum(clock.sleeps) == pytest.approx(6)
+
+
+def test_call_waits_for_the_requests_it_misses(clock):
+    limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=10 ** 6)
+    limiter.acquire(1)
+    limiter.acquire(1)
+    limiter.acquire(1)
+    assert sum(clock.sleeps) == pytest.approx(30)
+
+
+def test_call_over_the_token_budget_waits_for_a_full_bucket(clock):
+    limiter = RateLimiter(requests_per_minute=10, tokens_per_minute=1000)
+    limiter.acquire(500)
+
+    # Would never fit otherwise, it takes the whole bucket instead
+    limiter.acquire(5000)
+
+    assert sum(clock.sleeps) == pytest.approx(30)
+    assert limiter.available_tokens == pytest.approx(0)
+
+
+def test_block_pauses_every_caller(clock):
+    limiter = RateLimiter(requests_per_minute=10, tokens_per_minute=1000)
+    limiter.block(5)
+    limiter.acquire(1)
+    assert sum(clock.sleeps) == pytest.approx(5)
+
+
+class FakeEngine:
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = []
+
+    def embed(self, texts, token_count=None):
+        self.requests.append(list(texts))
+        if self.error is not None:
+            raise self.error
+        if "bad input" in texts:
+            raise ValueError("Invalid input")
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+
+def embed_concurrently(dispatcher, calls):
+    results = [None] * len(calls)
+
+    def embed(index):
+        try:
+            results[index] = dispatcher.embed(calls[index], token_count=len(calls[index]))
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=embed, args=(index,)) for index in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_bad_input_fails_only_its_caller():
+    engine = FakeEngine()
+    dispatcher = EmbeddingDispatcher(engine, max_wait_seconds=0.5, max_inputs=20, max_tokens=100)
+
+    ok, bad = embed_concurrently(dispatcher, [["a", "bb"], ["bad input"]])
+
+    assert engine.requests[0] in (["a", "bb", "bad input"], ["bad input", "a", "bb"])
+    assert ok.tolist() == [[1.0], [2.0]]
+    assert isinstance(bad, ValueError)
+
+
+def test_retryable_error_is_not_sent_again_per_caller():
+    # Raised by the engine once its retries are spent
+    error = openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))
+    engine = FakeEngine(error)
+    dispatcher = EmbeddingDispatcher(engine, max_wait_seconds=0.5, max_inputs=20, max_tokens=100)
+
+    results = embed_concurrently(dispatcher, [["a"], ["b"]])
+
+    assert len(engine.requests) == 1
+    assert results == [error, error]
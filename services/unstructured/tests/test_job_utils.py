@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils import job_utils
+
+
+@pytest.fixture(autouse=True)
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_utils, "JOBS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_failed_job_fails_its_running_stage():
+    job_id = job_utils.create_process_job("ds-1")
+    job_utils.set_job_stage(job_id, "partition", "completed")
+    job_utils.set_job_stage(job_id, "embedding", "in_progress")
+
+    job_utils.fail_process_job(job_id, "boom")
+
+    job = job_utils.get_process_job(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "boom"
+    assert job["stages"]["partition"]["status"] == "completed"
+    assert job["stages"]["embedding"]["status"] == "failed"
+    assert "completed_at" in job["stages"]["embedding"]
+
+
+def test_expired_jobs_are_purged(jobs_dir, monkeypatch):
+    monkeypatch.setattr(job_utils, "PROCESS_JOB_RETENTION_SECONDS", 3600)
+    old_job_id = job_utils.create_process_job("ds-1")
+    expired_at = time.time() - 7200
+    os.utime(jobs_dir / f"{old_job_id}.json", (expired_at, expired_at))
+
+    job_id = job_utils.create_process_job("ds-2")
+
+    assert job_utils.get_process_job(old_job_id) is None
+    assert job_utils.get_process_job(job_id)["status"] == "queued"
+
+
+def test_submitted_job_runs_with_its_job_id():
+    job_id = job_utils.create_process_job("ds-1")
+
+    def pipeline(params, job_id=None):
+        assert params == {"data_source_id": "ds-1"}
+        job_utils.set_job_stage(job_id, "partition", "completed")
+        return {"vector_ids": ["ds-1#a"]}
+
+    job_utils.submit_process_job(job_id, pipeline, {"data_source_id": "ds-1"}, job_id=job_id)
+    job = wait_for_job(job_id)
+    assert job["status"] == "completed"
+    assert job["vector_ids"] == ["ds-1#a"]
+    assert job["stages"]["partition"]["status"] == "completed"
+
+
+def test_job_of_an_exited_worker_is_reported_failed():
+    job_id = job_utils.create_process_job("ds-1")
+    job_utils.set_job_stage(job_id, "partition", "in_progress")
+    worker = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    job_utils.update_process_job(job_id, status="in_progress", owner_pid=int(worker.stdout))
+
+    job = job_utils.get_process_job(job_id)
+
+    assert job["status"] == "failed"
+    assert job["stages"]["partition"]["status"] == "failed"
+    assert job_utils.get_process_job(job_id)["status"] == "failed"
+
+
+def test_job_with_a_stale_heartbeat_is_reported_failed(monkeypatch):
+    monkeypatch.setattr(job_utils, "PROCESS_JOB_STALE_SECONDS", 60)
+    job_id = job_utils.create_process_job("ds-1")
+    stale_at = (datetime.now(timezone.utc) - timedelta(seconds=120)).isoformat()
+    job_utils.update_process_job(job_id, heartbeat_at=stale_at)
+
+    assert job_utils.get_process_job(job_id)["status"] == "failed"
+
+
+def test_heartbeat_keeps_a_long_job_alive(monkeypatch):
+    monkeypatch.setattr(job_utils, "PROCESS_JOB_HEARTBEAT_SECONDS", 0.05)
+    monkeypatch.setattr(job_utils, "PROCESS_JOB_STALE_SECONDS", 0.5)
+    monkeypatch.setattr(job_utils, "_heartbeat_thread", None)
+    job_id = job_utils.create_process_job("ds-1")
+
+    job_utils.submit_process_job(job_id, lambda: time.sleep(1.5) or {"vector_ids": []})
+
+    assert wait_for_job(job_id)["status"] == "completed"
+
+
+def wait_for_job(job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = job_utils.get_process_job(job_id)
+        if job["status"] in ("completed", "failed") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
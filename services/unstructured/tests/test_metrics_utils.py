@@ -0,0 +1,56 @@
+import os
+import json
+
+import pytest
+
+from utils import metrics_utils
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics_utils, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics_utils, "_counters", {})
+    monkeypatch.setattr(metrics_utils, "_histograms", {})
+    return tmp_path
+
+
+def write_snapshot(metrics_dir, filename, completed):
+    snapshot = {"histograms": {}, "counters": {"unstructured_process_runs_total": {'status="completed"': completed}}}
+    (metrics_dir / filename).write_text(json.dumps(snapshot))
+
+
+def completed_runs(text):
+    for line in text.splitlines():
+        if line.startswith('unstructured_process_runs_total{status="completed"}'):
+            return int(line.split()[-1])
+    return 0
+
+
+def test_exited_workers_are_archived(metrics_dir, monkeypatch):
+    monkeypatch.setattr(metrics_utils, "_pid_alive", lambda pid: pid != 1001)
+    write_snapshot(metrics_dir, "metrics-1001-aaaa.json", 3)
+    write_snapshot(metrics_dir, "metrics-1002-bbbb.json", 2)
+
+    assert completed_runs(metrics_utils.render_metrics()) == 5
+    assert not os.path.exists(metrics_dir / "metrics-1001-aaaa.json")
+    assert completed_runs(metrics_utils.render_metrics()) == 5
+
+
+def test_recycled_pid_does_not_reset_counters(metrics_dir, monkeypatch):
+    monkeypatch.setattr(metrics_utils, "_pid_alive", lambda pid: True)
+    write_snapshot(metrics_dir, "metrics-1001-aaaa.json", 3)
+    assert completed_runs(metrics_utils.render_metrics()) == 3
+
+    # A new worker with the same PID writes its own snapshot
+    write_snapshot(metrics_dir, "metrics-1001-cccc.json", 1)
+    assert completed_runs(metrics_utils.render_metrics()) == 4
+
+
+def test_folded_snapshot_is_not_counted_twice(metrics_dir, monkeypatch):
+    monkeypatch.setattr(metrics_utils, "_pid_alive", lambda pid: False)
+    write_snapshot(metrics_dir, "metrics-1001-aaaa.json", 3)
+    archive = {"histograms": {}, "counters": {"unstructured_process_runs_total": {'status="completed"': 3}},
+               "folded": ["metrics-1001-aaaa.json"]}
+    (metrics_dir / "metrics-archive.json").write_text(json.dumps(archive))
+
+    assert completed_runs(metrics_utils.render_metrics()) == 3
@@ -0,0 +1,84 @@
+import pytest
+
+from utils import pdf_utils
+from utils.pdf_utils import _offset_page_numbers, _page_runs, partition_page_ranges
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(pdf_utils.time, "sleep", lambda seconds: None)
+
+
+def page_range(first_page, last_page):
+    return {
+        "first_page": first_page,
+        "last_page": last_page,
+        "label": f"pages {first_page}-{last_page}",
+        "path": f"pages-{first_page}-{last_page}.pdf",
+    }
+
+
+def range_elements(pages):
+    # Elements as the API numbers them for a range file, from page 1
+    return [{"text": f"page {page}", "metadata": {"page_number": page}} for page in pages]
+
+
+def test_page_runs_cut_gaps_and_long_runs():
+    assert _page_runs([1, 2, 3, 5, 6, 9], 10) == [[1, 2, 3], [5, 6], [9]]
+    assert _page_runs(list(range(1, 8)), 3) == [[1, 2, 3], [4, 5, 6], [7]]
+    assert _page_runs([], 3) == []
+
+
+def test_offset_page_numbers_moves_elements_to_document_pages():
+    elements = range_elements([1, 2]) + [{"text": "no page", "metadata": {}}, {"text": "no metadata"}]
+
+    _offset_page_numbers(elements, 11)
+
+    assert [element["metadata"].get("page_number") for element in elements] == [11, 12, None, None]
+
+
+def test_failed_range_is_retried_on_its_own():
+    calls = []
+
+    def partition(path):
+        calls.append(path)
+        if path == "pages-11-20.pdf" and calls.count(path) == 1:
+            raise Exception("502 Bad Gateway")
+        return range_elements([1, 2])
+
+    elements, failed_ranges = partition_page_ranges(
+        [page_range(1, 10), page_range(11, 20)], partition, max_workers=2, max_retries=2
+    )
+
+    assert failed_ranges == []
+    assert sorted(calls) == ["pages-1-10.pdf", "pages-11-20.pdf", "pages-11-20.pdf"]
+    assert [element["metadata"]["page_number"] for element in elements] == [1, 2, 11, 12]
+
+
+def test_range_failing_every_attempt_is_left_out():
+    progress = []
+
+    def partition(path):
+        if path == "pages-11-20.pdf":
+            raise Exception("timeout")
+        return range_elements([1])
+
+    elements, failed_ranges = partition_page_ranges(
+        [page_range(1, 10), page_range(11, 20), page_range(21, 30)],
+        partition,
+        on_progress=lambda *args: progress.append(args),
+        max_workers=1,
+        max_retries=1
+    )
+
+    assert failed_ranges == ["pages 11-20"]
+    assert [element["metadata"]["page_number"] for element in elements] == [1, 21]
+    assert progress[-1] == (3, 3, ["pages 11-20"])
+
+
+def test_every_range_failing_fails_the_document():
+    def partition(path):
+        raise Exception("unavailable")
+
+    with pytest.raises(Exception, match="every page range"):
+        partition_page_ranges([page_range(1, 10), page_range(11, 20)], partition, max_retries=1)
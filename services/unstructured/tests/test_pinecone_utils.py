@@ -0,0 +1,140 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils import pinecone_utils
+from utils.pinecone_utils import (
+    estimate_vector_bytes,
+    mark_vectors_deleted,
+    pack_upsert_batches,
+    update_moved_vectors,
+    vector_id_for_chunk,
+)
+
+
+class FakeIndex:
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.updates = []
+
+    def fetch(self, ids, namespace=""):
+        return SimpleNamespace(vectors={
+            vector_id: SimpleNamespace(id=vector_id, metadata=self.metadata[vector_id])
+            for vector_id in ids
+            if vector_id in self.metadata
+        })
+
+    def update(self, id, set_metadata=None, namespace=""):
+        self.updates.append((id, set_metadata))
+
+
+def test_vector_id_depends_on_the_text_only():
+    assert vector_id_for_chunk("ds-1", "Budget review") == vector_id_for_chunk("ds-1", "Budget review")
+    assert vector_id_for_chunk("ds-1", "Budget review") != vector_id_for_chunk("ds-1", "Budget review.")
+    assert vector_id_for_chunk("ds-1", "Budget review").startswith("ds-1#")
+
+
+def test_only_moved_vectors_are_updated(monkeypatch):
+    monkeypatch.setattr(pinecone_utils, "FETCH_BATCH_SIZE", 2)
+    index = FakeIndex({
+        "ds-1#a": {"page_number": 1, "chunk_number": 0, "text": "a"},
+        "ds-1#b": {"page_number": 1, "chunk_number": 1, "text": "b"},
+        "ds-1#c": {"page_number": 2, "chunk_number": 0, "text": "c"},
+    })
+
+    moved = update_moved_vectors(index, {
+        "ds-1#a": {"page_number": 1, "chunk_number": 0},
+        "ds-1#b": {"page_number": 2, "chunk_number": 0},
+        "ds-1#c": {"page_number": 2, "chunk_number": 1},
+        "ds-1#gone": {"page_number": 3, "chunk_number": 0},
+    }, "pulse-1")
+
+    assert moved == 2
+    assert sorted(index.updates) == [
+        ("ds-1#b", {"page_number": 2, "chunk_number": 0}),
+        ("ds-1#c", {"page_number": 2, "chunk_number": 1}),
+    ]
+
+
+def test_vectors_already_marked_deleted_keep_their_deleted_at(monkeypatch):
+    monkeypatch.setattr(pinecone_utils, "FETCH_BATCH_SIZE", 2)
+    index = FakeIndex({
+        "ds-1#a": {"isDeleted": True, "deletedAt": 1700000000},
+        "ds-1#b": {"text": "b"},
+        "ds-1#legacy": {"isDeleted": True},
+    })
+
+    result = mark_vectors_deleted(index, ["ds-1#a", "ds-1#b", "ds-1#legacy", "ds-1#gone"], "pulse-1")
+
+    assert result["skipped_ids"] == ["ds-1#a"]
+    assert sorted(result["updated_ids"]) == ["ds-1#b", "ds-1#legacy"]
+    assert len(result["errors"]) == 1
+    assert sorted(vector_id for vector_id, _ in index.updates) == ["ds-1#b", "ds-1#legacy"]
+
+
+def test_slow_describe_index_does_not_block_other_indexes(monkeypatch):
+    describing = threading.Event()
+    release = threading.Event()
+
+    class Client:
+        def describe_index(self, name):
+            if name == "slow":
+                describing.set()
+                release.wait(5)
+            return {"host": f"{name}.pinecone.local"}
+
+        def Index(self, host):
+            return SimpleNamespace(host=host, close=lambda: None)
+
+    monkeypatch.setattr(pinecone_utils, "_client", Client())
+    monkeypatch.setattr(pinecone_utils, "_index_handles", {})
+    monkeypatch.setattr(pinecone_utils, "index_description_cache", {})
+
+    handles = []
+    thread = threading.Thread(target=lambda: handles.append(pinecone_utils.get_pinecone_index("slow")))
+    thread.start()
+    assert describing.wait(5)
+    # A slow describe_index of one index doesn't block another
+    assert pinecone_utils.get_pinecone_index("fast").host == "https://fast.pinecone.local"
+    release.set()
+    thread.join(5)
+    assert pinecone_utils.get_pinecone_index("slow") is handles[0]
+
+
+def vector(vector_id, dimension=4, text=""):
+    return {"id": vector_id, "values": [0.5] * dimension, "metadata": {"text": text}}
+
+
+def test_batches_are_split_by_vector_count():
+    vectors = [vector(str(i)) for i in range(5)]
+    batches = pack_upsert_batches(vectors, max_bytes=10 ** 6, max_vectors=2)
+    assert [[item["id"] for item in batch] for batch in batches] == [["0", "1"], ["2", "3"], ["4"]]
+
+
+def test_batches_stay_under_the_byte_budget():
+    vectors = [vector(str(i), text="x" * 100) for i in range(10)]
+    max_bytes = estimate_vector_bytes(vectors[0]) * 3
+
+    batches = pack_upsert_batches(vectors, max_bytes=max_bytes, max_vectors=1000)
+
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+    assert all(sum(estimate_vector_bytes(item) for item in batch) <= max_bytes for batch in batches)
+
+
+def test_vector_over_the_byte_budget_is_sent_alone():
+    vectors = [vector("small-1"), vector("huge", text="x" * 5000), vector("small-2")]
+    batches = pack_upsert_batches(vectors, max_bytes=1000, max_vectors=1000)
+    assert [[item["id"] for item in batch] for batch in batches] == [["small-1"], ["huge"], ["small-2"]]
+
+
+def test_estimate_bounds_the_serialized_size():
+    item = vector("ds-1#abc", text="é 会議 📅" * 20)
+    item["values"] = np.array([-1.2345678e-05, -3.4e38, 1e-30, -0.1] * 16, dtype=np.float32)
+    payload = dict(item, values=item["values"].tolist())
+
+    assert estimate_vector_bytes(item) >= len(json.dumps(payload).encode("utf-8"))
+    assert estimate_vector_bytes(item) >= len(
+        json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    )
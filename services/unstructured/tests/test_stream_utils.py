@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from utils.stream_utils import run_streaming_stages
+
+
+def test_items_flow_through_every_stage():
+    results = []
+    run_streaming_stages(
+        source=range(10),
+        stages=[
+            ("double", lambda item: [item * 2]),
+            ("split", lambda item: [item, item + 1], 3),
+            ("collect", results.append),
+        ],
+        queue_size=2
+    )
+    assert sorted(results) == sorted([i * 2 for i in range(10)] + [i * 2 + 1 for i in range(10)])
+
+
+def test_stage_returning_none_emits_nothing():
+    results = []
+    run_streaming_stages(
+        source=range(6),
+        stages=[
+            ("evens", lambda item: [item] if item % 2 == 0 else None),
+            ("collect", results.append),
+        ]
+    )
+    assert sorted(results) == [0, 2, 4]
+
+
+def test_error_in_a_middle_stage_stops_the_pipeline():
+    consumed = []
+    produced = []
+
+    def source():
+        for item in range(1000):
+            produced.append(item)
+            yield item
+
+    def middle(item):
+        if item == 3:
+            raise RuntimeError("middle stage failed")
+        return [item]
+
+    with pytest.raises(RuntimeError, match="middle stage failed"):
+        run_streaming_stages(
+            source=source(),
+            stages=[("middle", middle, 2), ("last", consumed.append)],
+            queue_size=2
+        )
+
+    # Back pressure and the stop keep the source from running to the end
+    assert len(produced) < 1000
+    assert 3 not in consumed
+
+
+def test_error_in_the_source_is_raised():
+    def source():
+        yield 1
+        raise ValueError("bad source")
+
+    with pytest.raises(ValueError, match="bad source"):
+        run_streaming_stages(source=source(), stages=[("last", lambda item: None)])
+
+
+def test_failing_workers_of_one_stage_do_not_hang():
+    started = threading.Barrier(2, timeout=5)
+
+    def fail(item):
+        started.wait()
+        raise RuntimeError(f"failed on {item}")
+
+    with pytest.raises(RuntimeError, match="failed on"):
+        run_streaming_stages(source=[1, 2], stages=[("fail", fail, 2)])
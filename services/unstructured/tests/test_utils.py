@@ -0,0 +1,75 @@
+import io
+import os
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+from utils import utils
+from utils.utils import get_file_extension, parse_s3_url
+
+
+@pytest.mark.parametrize("s3_url, expected", [
+    ("s3://bucket/folder/report.pdf", ("bucket", "folder/report.pdf")),
+    ("s3://bucket/Q1+Q2 report.pdf", ("bucket", "Q1+Q2 report.pdf")),
+    ("s3://bucket/50%.pdf", ("bucket", "50%.pdf")),
+    ("s3://bucket/50%20off.pdf", ("bucket", "50%20off.pdf")),
+    ("s3://bucket/notes #3.pdf", ("bucket", "notes #3.pdf")),
+    ("s3://bucket/what?.pdf", ("bucket", "what?.pdf")),
+    ("s3://my.dotted.bucket/a/b.pdf", ("my.dotted.bucket", "a/b.pdf")),
+])
+def test_parse_s3_url_keeps_the_key_literal(s3_url, expected):
+    assert parse_s3_url(s3_url) == expected
+
+
+@pytest.mark.parametrize("s3_url", ["https://bucket/key.pdf", "s3://bucket", "s3://bucket/", "s3:///key.pdf"])
+def test_parse_s3_url_rejects_invalid_urls(s3_url):
+    with pytest.raises(ValueError):
+        parse_s3_url(s3_url)
+
+
+def test_get_file_extension_of_special_file_names():
+    assert get_file_extension("s3://bucket/notes #3.pdf") == ".pdf"
+    assert get_file_extension("s3://my.bucket/Q1+Q2?.PPTX") == ".PPTX"
+
+
+@pytest.fixture
+def s3_stub(monkeypatch):
+    client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test")
+    monkeypatch.setattr(utils, "get_s3_client", lambda: client)
+    with Stubber(client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def object_response(data):
+    return {"Body": StreamingBody(io.BytesIO(data), len(data)), "ContentLength": len(data), "ETag": '"abc"'}
+
+
+def test_download_s3_object_pins_the_etag(tmp_path, s3_stub):
+    s3_stub.add_response(
+        "get_object",
+        object_response(b"%PDF-1.4 report"),
+        {"Bucket": "my.bucket", "Key": "docs/Q1+Q2 report.pdf", "IfMatch": '"abc"'}
+    )
+
+    file_path = utils.download_s3_object("s3://my.bucket/docs/Q1+Q2 report.pdf", str(tmp_path), "abc")
+
+    assert file_path == str(tmp_path / "Q1+Q2 report.pdf")
+    assert (tmp_path / "Q1+Q2 report.pdf").read_bytes() == b"%PDF-1.4 report"
+    assert sorted(os.listdir(tmp_path)) == ["Q1+Q2 report.pdf"]
+
+
+def test_download_s3_object_without_etag(tmp_path, s3_stub):
+    s3_stub.add_response("get_object", object_response(b"data"), {"Bucket": "bucket", "Key": "a.txt"})
+    assert open(utils.download_s3_object("s3://bucket/a.txt", str(tmp_path)), "rb").read() == b"data"
+
+
+def test_changed_object_fails_without_leaving_a_file(tmp_path, s3_stub):
+    s3_stub.add_client_error("get_object", service_error_code="PreconditionFailed", http_status_code=412)
+
+    with pytest.raises(ClientError):
+        utils.download_s3_object("s3://bucket/a.pdf", str(tmp_path), "abc")
+    assert os.listdir(tmp_path) == []
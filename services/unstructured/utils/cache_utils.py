@@ -0,0 +1,126 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from utils.metrics_utils import count_cache
+
+# Local directory for the service's persistent caches
+CACHE_DIR = os.getenv('CACHE_DIR', '/app/cache')
+
+# SQLite variables per statement are limited, look keys up in slices
+_LOOKUP_SLICE = 500
+
+
+class SqliteLRUCache:
+    """
+    A key/value cache stored in a local SQLite file and shared by every
+    gunicorn worker in the container. Entries are evicted least recently used
+    first once the stored values exceed max_bytes.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Exported as the cache label of the unstructured_cache_* metrics
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        """
+        Return a dict of the cached values for the given keys. Missing keys are
+        left out and counted as misses.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        try:
+            conn = self._connection()
+            for i in range(0, len(keys), _LOOKUP_SLICE):
+                key_slice = keys[i:i + _LOOKUP_SLICE]
+                placeholders = ",".join("?" * len(key_slice))
+                rows = conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})",
+                    key_slice
+                ).fetchall()
+                found.update(rows)
+            if found:
+                with conn:
+                    now = time.time()
+                    conn.executemany(
+                        "UPDATE entries SET accessed_at = ? WHERE key = ?",
+                        [(now, key) for key in found]
+                    )
+        except sqlite3.Error as e:
+            # The cache must never fail a request, treat errors as misses
+            logging.warning(f"Cache lookup failed for {self.path}: {e}")
+            found = {}
+
+        count_cache(self.name, hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items):
+        """
+        Store (key, value) pairs, value being bytes, then evict the least
+        recently used entries if the cache is over its size limit.
+        """
+        if not items:
+            return
+        try:
+            conn = self._connection()
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    [(key, value, len(value), now) for key, value in items]
+                )
+            self._evict(conn)
+        except sqlite3.Error as e:
+            logging.warning(f"Cache write failed for {self.path}: {e}")
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def _evict(self, conn):
+        total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        # Evict down to 90% of the limit so we don't evict on every write
+        target_bytes = int(self.max_bytes * 0.9)
+        evicted = 0
+        with conn:
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall()
+            keys = []
+            for key, size in rows:
+                if total_bytes <= target_bytes:
+                    break
+                keys.append((key,))
+                total_bytes -= size
+                evicted += 1
+            conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+        count_cache(self.name, evictions=evicted)
+        logging.info(f"Evicted {evicted} entries from {self.path}")
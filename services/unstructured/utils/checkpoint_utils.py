@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+
+# Stage checkpoints of /process runs, kept after a failure so a retried
+# request can resume, and removed once the run succeeds or the retention
+# period has passed.
+CHECKPOINT_DIR = os.getenv('PROCESS_CHECKPOINT_DIR', '/app/working/checkpoints')
+CHECKPOINT_RETENTION_SECONDS = int(os.getenv('PROCESS_CHECKPOINT_RETENTION_SECONDS', 24 * 3600))
+
+_STATE_FILE = "state.json"
+_CHUNKS_FILE = "chunks.jsonl"
+_UPSERTED_FILE = "upserted_ids.txt"
+_LOCK_SUFFIX = ".lock"
+
+_checkpoint_lock = threading.Lock()
+
+
+class CheckpointBusyError(Exception):
+    pass
+
+
+def checkpoint_key(params, object_info):
+    """
+    Key of a /process run: the data source, its destination and the S3
+    object version. A retry of the same request gets the same key, a new
+    version of the file starts over.
+    """
+    key_data = {
+        "data_source_id": params["data_source_id"],
+        "s3_url": params["s3_url"],
+        "etag": object_info["etag"],
+        "pinecone_index_name": params["pinecone_index_name"],
+        "pulse_id": params["pulse_id"],
+    }
+    digest = hashlib.sha256(json.dumps(key_data, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{params['data_source_id']}-{digest}"
+
+
+def checkpoint_path(key, *names):
+    return os.path.join(CHECKPOINT_DIR, key, *names)
+
+
+def acquire_checkpoint(key):
+    """
+    Take the lock of a run key, so two identical requests don't write the
+    same checkpoint. Release it with release_checkpoint().
+
+    Raises:
+        CheckpointBusyError: If another run holds the key.
+    """
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    lock_path = os.path.join(CHECKPOINT_DIR, f"{key}{_LOCK_SUFFIX}")
+    while True:
+        lock_file = open(lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise CheckpointBusyError(f"A run for the same request is already in progress ({key})")
+        # The previous holder removes the lock file on release, retry if we
+        # locked the file it just removed
+        try:
+            if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                return lock_file
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+
+
+def release_checkpoint(lock_file):
+    try:
+        os.remove(lock_file.name)
+    except FileNotFoundError:
+        pass
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+
+def load_checkpoint(key):
+    """
+    The stages completed by a previous run with this key, as a dict of stage
+    name to details. Empty when there is no checkpoint or it expired.
+    """
+    try:
+        with open(checkpoint_path(key, _STATE_FILE), "r") as file:
+            state = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+    if time.time() - state.get("updated_at", 0) > CHECKPOINT_RETENTION_SECONDS:
+        clear_checkpoint(key)
+        return {}
+    return state.get("stages", {})
+
+
+def save_checkpoint(key, stage, **details):
+    """
+    Mark a stage as completed in the checkpoint.
+    """
+    with _checkpoint_lock:
+        os.makedirs(checkpoint_path(key), exist_ok=True)
+        path = checkpoint_path(key, _STATE_FILE)
+        try:
+            with open(path, "r") as file:
+                state = json.load(file)
+        except (FileNotFoundError, ValueError):
+            state = {"stages": {}}
+        state["stages"][stage] = details
+        state["updated_at"] = time.time()
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, path)
+
+
+def save_checkpoint_chunks(key, records):
+    """
+    Store the chunk records of a run, then mark the chunked stage.
+    """
+    os.makedirs(checkpoint_path(key), exist_ok=True)
+    count = 0
+    with open(checkpoint_path(key, _CHUNKS_FILE), "w", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            file.write("\n")
+            count += 1
+    save_checkpoint(key, "chunked", chunks=count)
+
+
+def load_checkpoint_chunks(key):
+    """
+    Stream the chunk records stored by save_checkpoint_chunks.
+    """
+    with open(checkpoint_path(key, _CHUNKS_FILE), "r", encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def append_upserted_ids(key, vector_ids):
+    """
+    Record the vector IDs of an upserted batch. The file is appended to after
+    every batch, so a run that fails midway keeps the batches that made it.
+    """
+    with _checkpoint_lock:
+        os.makedirs(checkpoint_path(key), exist_ok=True)
+        with open(checkpoint_path(key, _UPSERTED_FILE), "a") as file:
+            file.write("".join(f"{vector_id}\n" for vector_id in vector_ids))
+
+
+def load_upserted_ids(key):
+    try:
+        with open(checkpoint_path(key, _UPSERTED_FILE), "r") as file:
+            return [line.rstrip("\n") for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def clear_checkpoint(key):
+    shutil.rmtree(checkpoint_path(key), ignore_errors=True)
+
+
+def _last_written_at(key):
+    # Upserted IDs are appended to their file, which doesn't touch the
+    # directory, so look at the newest file inside
+    path = checkpoint_path(key)
+    times = [os.path.getmtime(path)]
+    for name in os.listdir(path):
+        try:
+            times.append(os.path.getmtime(os.path.join(path, name)))
+        except OSError:
+            continue
+    return max(times)
+
+
+def purge_expired_checkpoints():
+    """
+    Remove the checkpoints of runs that were never retried within the
+    retention period. Checkpoints of running requests are left alone.
+    """
+    try:
+        keys = [name for name in os.listdir(CHECKPOINT_DIR) if not name.endswith(_LOCK_SUFFIX)]
+    except FileNotFoundError:
+        return
+    now = time.time()
+    for key in keys:
+        try:
+            if now - _last_written_at(key) <= CHECKPOINT_RETENTION_SECONDS:
+                continue
+        except OSError:
+            continue
+        try:
+            lock_file = acquire_checkpoint(key)
+        except CheckpointBusyError:
+            continue
+        try:
+            logging.info(f"Removing expired checkpoint {key}")
+            clear_checkpoint(key)
+        finally:
+            release_checkpoint(lock_file)
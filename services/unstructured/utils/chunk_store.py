@@ -0,0 +1,80 @@
+import logging
+
+from psycopg2.extras import execute_values
+
+from utils.db_utils import db_connection
+
+# Rows written or looked up per statement
+_STORE_SLICE = 500
+
+
+def store_chunk_texts(rows):
+    """
+    Save the full text and HTML of chunks whose Pinecone metadata is slimmed.
+
+    Args:
+        rows: (vector_id, data_source_id, text, text_as_html) tuples.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            for i in range(0, len(rows), _STORE_SLICE):
+                execute_values(
+                    cursor,
+                    """
+                        INSERT INTO public.data_source_chunks
+                            (vector_id, data_source_id, text, text_as_html, created_at, updated_at)
+                        VALUES %s
+                        ON CONFLICT (vector_id) DO UPDATE
+                        SET text = EXCLUDED.text,
+                            text_as_html = EXCLUDED.text_as_html,
+                            updated_at = EXCLUDED.updated_at;
+                    """,
+                    rows[i:i + _STORE_SLICE],
+                    template="(%s, %s, %s, %s, NOW(), NOW())"
+                )
+    logging.info(f"Stored the text of {len(rows)} chunks")
+
+
+def fetch_chunk_texts(vector_ids):
+    """
+    Bulk fetch the stored text of chunks by vector ID.
+
+    Returns:
+        A dict of vector ID to {"text", "text_as_html"}. IDs without stored
+        text are left out.
+    """
+    vector_ids = list(dict.fromkeys(vector_ids))
+    texts = {}
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            for i in range(0, len(vector_ids), _STORE_SLICE):
+                cursor.execute(
+                    """
+                        SELECT vector_id, text, text_as_html
+                        FROM public.data_source_chunks
+                        WHERE vector_id = ANY(%s);
+                    """,
+                    (vector_ids[i:i + _STORE_SLICE],)
+                )
+                for vector_id, text, text_as_html in cursor.fetchall():
+                    texts[vector_id] = {"text": text, "text_as_html": text_as_html}
+    return texts
+
+
+def delete_chunk_texts(vector_ids):
+    """
+    Delete the stored text of chunks whose vectors were removed.
+    """
+    vector_ids = list(vector_ids)
+    if not vector_ids:
+        return
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            for i in range(0, len(vector_ids), _STORE_SLICE):
+                cursor.execute(
+                    "DELETE FROM public.data_source_chunks WHERE vector_id = ANY(%s);",
+                    (vector_ids[i:i + _STORE_SLICE],)
+                )
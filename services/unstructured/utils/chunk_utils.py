@@ -0,0 +1,119 @@
+import os
+import json
+import logging
+
+# Size of the in-memory chunk records, in bytes of text, above which a
+# document's chunks are spilled to a JSONL file in its work directory
+CHUNK_SPILL_BYTES = int(os.getenv('CHUNK_SPILL_BYTES', 64 * 1024 * 1024))
+
+# Element metadata that is never sent to Pinecone. orig_elements in particular
+# is a compressed copy of every source element and dwarfs the chunk itself.
+DROPPED_METADATA_KEYS = ("data_source", "filetype", "orig_elements")
+
+# "full" upserts every sanitized metadata field to Pinecone. "slim" upserts
+# only SLIM_METADATA_FIELDS and keeps the full text and HTML of each chunk in
+# the data_source_chunks table, see utils/chunk_store.py.
+PINECONE_METADATA_MODE = os.getenv('PINECONE_METADATA_MODE', 'full')
+PINECONE_SLIM_TEXT_BYTES = int(os.getenv('PINECONE_SLIM_TEXT_BYTES', 1024))
+
+# Metadata kept in slim mode, with the byte budget of string values. None
+# keeps the value as is.
+SLIM_METADATA_FIELDS = {
+    "text": PINECONE_SLIM_TEXT_BYTES,
+    "filename": 256,
+    "data_source_id": None,
+    "data_source_type": None,
+    "data_source_origin": None,
+    "document_token_count": None,
+    "page_number": None,
+    "chunk_number": None,
+    "datetime": None,
+    "date": None,
+}
+
+
+def compact_chunk_record(element):
+    """
+    Keep only what the pipeline needs from a chunked element.
+    """
+    metadata = {
+        key: value
+        for key, value in element.get("metadata", {}).items()
+        if key not in DROPPED_METADATA_KEYS
+    }
+    return {"text": element.get("text", ""), "metadata": metadata}
+
+
+def _truncate_utf8(value, max_bytes):
+    encoded = value.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return value, False
+    # Don't leave half of a multibyte character at the end
+    return encoded[:max_bytes].decode("utf-8", errors="ignore"), True
+
+
+def slim_metadata(metadata):
+    """
+    Keep only the allowlisted metadata fields, cutting strings down to their
+    byte budget. text becomes a preview and text_truncated tells whether the
+    full text has to be fetched from the chunk store.
+    """
+    slim = {}
+    for key, max_bytes in SLIM_METADATA_FIELDS.items():
+        value = metadata.get(key)
+        if value is None:
+            continue
+        truncated = False
+        if max_bytes is not None and isinstance(value, str):
+            value, truncated = _truncate_utf8(value, max_bytes)
+        if key == "text":
+            slim["text_truncated"] = truncated
+        slim[key] = value
+    return slim
+
+
+def _record_size(record):
+    return len(record["text"]) + len(record["metadata"].get("text_as_html") or "")
+
+
+class ChunkCollection:
+    """
+    The chunks of one document, kept in order from partitioning to upsert so
+    every stage works on the same records instead of re-reading chunk files.
+    When the records grow past spill_bytes they are moved to a compact JSONL
+    file and streamed back from disk on iteration.
+    """
+
+    def __init__(self, spill_dir, spill_bytes=CHUNK_SPILL_BYTES):
+        self.spill_path = os.path.join(spill_dir, "chunks.jsonl")
+        self.spill_bytes = spill_bytes
+        self.records = []
+        self.records_size = 0
+        self.spilled_count = 0
+
+    def __len__(self):
+        return self.spilled_count + len(self.records)
+
+    def extend(self, records):
+        for record in records:
+            self.records.append(record)
+            self.records_size += _record_size(record)
+        if self.records_size > self.spill_bytes:
+            self._spill()
+
+    def _spill(self):
+        with open(self.spill_path, "a", encoding="utf-8") as file:
+            for record in self.records:
+                file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+                file.write("\n")
+        logging.info(f"Spilled {len(self.records)} chunks to {self.spill_path}")
+        self.spilled_count += len(self.records)
+        self.records = []
+        self.records_size = 0
+
+    def __iter__(self):
+        if self.spilled_count:
+            with open(self.spill_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    yield json.loads(line)
+        yield from self.records
@@ -0,0 +1,77 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# Database connection details from environment variables
+POSTGRES_DB_HOST = os.getenv('POSTGRES_DB_HOST')
+POSTGRES_DB_PORT = os.getenv('POSTGRES_DB_PORT', 5432)
+POSTGRES_DB_DATABASE = os.getenv('POSTGRES_DB_DATABASE')
+POSTGRES_DB_USERNAME = os.getenv('POSTGRES_DB_USERNAME')
+POSTGRES_DB_PASSWORD = os.getenv('POSTGRES_DB_PASSWORD')
+
+# Connections kept open per gunicorn worker
+POSTGRES_POOL_MIN_CONNECTIONS = int(os.getenv('POSTGRES_POOL_MIN_CONNECTIONS', 0))
+POSTGRES_POOL_MAX_CONNECTIONS = int(os.getenv('POSTGRES_POOL_MAX_CONNECTIONS', 4))
+
+_pool = None
+_pool_pid = None
+# ThreadedConnectionPool raises instead of waiting when it is exhausted
+_pool_slots = threading.BoundedSemaphore(POSTGRES_POOL_MAX_CONNECTIONS)
+_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """
+    Get the connection pool of the current process. The pool is created on
+    first use, so each gunicorn worker opens its own connections after the fork
+    instead of sharing sockets inherited from the master.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadedConnectionPool(
+                POSTGRES_POOL_MIN_CONNECTIONS,
+                POSTGRES_POOL_MAX_CONNECTIONS,
+                dbname=POSTGRES_DB_DATABASE,
+                user=POSTGRES_DB_USERNAME,
+                password=POSTGRES_DB_PASSWORD,
+                host=POSTGRES_DB_HOST,
+                port=POSTGRES_DB_PORT,
+                # Detect connections dropped by the server while idle in the pool
+                keepalives=1,
+                keepalives_idle=30,
+                keepalives_interval=10,
+                keepalives_count=3,
+            )
+            _pool_pid = os.getpid()
+            logging.info(f"Created Postgres connection pool for pid {_pool_pid}")
+        return _pool
+
+
+@contextmanager
+def db_connection():
+    """
+    Borrow a connection from the pool. The transaction is committed when the
+    block succeeds and rolled back otherwise. Connections that broke during
+    the block are discarded instead of going back to the pool.
+    """
+    pool = get_db_pool()
+    with _pool_slots:
+        conn = pool.getconn()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=discard or bool(conn.closed))
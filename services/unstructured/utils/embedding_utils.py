@@ -0,0 +1,462 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import openai
+import numpy as np
+
+from utils.openai_utils import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_MODEL,
+    count_tokens,
+    create_embeddings,
+    decode_embeddings,
+    truncate_to_tokens,
+)
+from utils.cache_utils import CACHE_DIR, SqliteLRUCache
+from utils.metrics_utils import observe_stage
+
+# Concurrency and OpenAI rate limit budget for one gunicorn worker process.
+# Split the organization limits between the workers when changing these.
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', 4))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv('EMBEDDING_REQUESTS_PER_MINUTE', 1000))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv('EMBEDDING_TOKENS_PER_MINUTE', 250000))
+EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', 6))
+
+# Limits of the embeddings endpoint per model: tokens of a single input,
+# inputs of a request and tokens of a request
+EMBEDDING_MODEL_LIMITS = {
+    "text-embedding-3-small": {"input_tokens": 8191, "request_inputs": 2048, "request_tokens": 300000},
+    "text-embedding-3-large": {"input_tokens": 8191, "request_inputs": 2048, "request_tokens": 300000},
+    "text-embedding-ada-002": {"input_tokens": 8191, "request_inputs": 2048, "request_tokens": 300000},
+}
+_model_limits = EMBEDDING_MODEL_LIMITS.get(EMBEDDING_MODEL, EMBEDDING_MODEL_LIMITS["text-embedding-3-small"])
+EMBEDDING_MAX_INPUT_TOKENS = int(os.getenv('EMBEDDING_MAX_INPUT_TOKENS', _model_limits["input_tokens"]))
+EMBEDDING_MAX_BATCH_INPUTS = int(os.getenv('EMBEDDING_MAX_BATCH_INPUTS', _model_limits["request_inputs"]))
+# A request larger than the per-minute budget could never be sent
+EMBEDDING_MAX_BATCH_TOKENS = min(
+    int(os.getenv('EMBEDDING_MAX_BATCH_TOKENS', _model_limits["request_tokens"])),
+    EMBEDDING_TOKENS_PER_MINUTE
+)
+
+# How long an embedding call waits for calls of other requests to share its
+# OpenAI request, 0 sends every call on its own
+EMBEDDING_BATCH_WAIT_MS = int(os.getenv('EMBEDDING_BATCH_WAIT_MS', 20))
+
+# Chunk token counts use the chat model's encoding, which can differ from the
+# embedding model's by a few percent. Requests are packed with this headroom.
+_TOKEN_COUNT_HEADROOM = 0.9
+
+# Size of the on-disk embedding cache shared by the workers, 0 disables it
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Embeddings of a reduced size are cached apart from the full size ones
+EMBEDDING_CACHE_MODEL = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
+
+# Errors worth retrying, everything else fails the batch straight away
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class RateLimiter:
+    """
+    Token bucket limiter for a per-minute request budget and a per-minute token
+    budget. acquire() blocks until both budgets have room for the call.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.available_requests = min(
+            self.requests_per_minute,
+            self.available_requests + elapsed * self.requests_per_minute / 60
+        )
+        self.available_tokens = min(
+            self.tokens_per_minute,
+            self.available_tokens + elapsed * self.tokens_per_minute / 60
+        )
+
+    def acquire(self, tokens):
+        # A single call larger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.available_requests >= 1 and self.available_tokens >= tokens:
+                        self.available_requests -= 1
+                        self.available_tokens -= tokens
+                        return
+                    missing_requests = max(0, 1 - self.available_requests)
+                    missing_tokens = max(0, tokens - self.available_tokens)
+                    wait = max(
+                        missing_requests * 60 / self.requests_per_minute,
+                        missing_tokens * 60 / self.tokens_per_minute
+                    )
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """
+        Pause every caller, e.g. after OpenAI answered with a 429.
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def _retry_after(error, attempt):
+    """
+    Seconds to wait before retrying, from the Retry-After header when OpenAI
+    sent one, otherwise exponential backoff with jitter.
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        header = response.headers.get("retry-after")
+        try:
+            if header is not None:
+                return float(header)
+        except ValueError:
+            pass
+    return min(60, 2 ** attempt) + random.random()
+
+
+class EmbeddingEngine:
+    """
+    Process wide entry point for embedding calls. It bounds the number of
+    concurrent requests, keeps them within the requests/min and tokens/min
+    budget and retries a failed batch on its own.
+    """
+
+    def __init__(self, max_concurrency, requests_per_minute, tokens_per_minute, max_retries):
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+
+    def embed(self, texts, token_count=None):
+        """
+        Embed a batch of texts.
+
+        Args:
+            texts: The texts to embed in one request.
+            token_count: The number of tokens in texts, counted when omitted.
+
+        Returns:
+            The float32 embedding matrix, one row per text.
+
+        Raises:
+            Exception: If the batch still fails after the configured retries.
+        """
+        if token_count is None:
+            token_count = sum(count_tokens(text) for text in texts)
+
+        observe_stage("embedding", api_calls=1)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(token_count)
+            try:
+                with self.slots:
+                    response = create_embeddings(texts)
+                return decode_embeddings(response)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    logging.error(f"Embedding batch failed after {attempt + 1} attempts: {e}")
+                    raise Exception(f"Failed to create embeddings: {e}")
+                delay = _retry_after(e, attempt)
+                if isinstance(e, openai.RateLimitError):
+                    self.rate_limiter.block(delay)
+                observe_stage("embedding", retries=1)
+                logging.warning(
+                    f"Embedding batch of {len(texts)} texts failed ({type(e).__name__}), "
+                    f"retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+
+def fit_embedding_input(item, max_input_tokens=EMBEDDING_MAX_INPUT_TOKENS):
+    """
+    Make sure a chunk fits in a single embedding input. An oversized text is
+    truncated into item["embedding_text"], only for the embedding, and
+    item["text"] is left whole.
+    """
+    if item["token_count"] <= max_input_tokens * _TOKEN_COUNT_HEADROOM:
+        return
+    text, token_count = truncate_to_tokens(item["text"], max_input_tokens)
+    if text != item["text"]:
+        logging.warning(
+            f"Chunk of {item['token_count']} tokens is over the embedding input limit, "
+            f"embedding its first {max_input_tokens} tokens"
+        )
+        item["embedding_text"] = text
+    item["token_count"] = token_count
+
+
+def plan_embedding_batches(items, max_inputs=EMBEDDING_MAX_BATCH_INPUTS,
+                           max_tokens=EMBEDDING_MAX_BATCH_TOKENS):
+    """
+    Pack chunks into embedding requests as large as the model allows, by
+    number of inputs and total tokens. Each chunk is fitted into a single
+    input first.
+
+    Args:
+        items: Chunks with "text" and "token_count".
+
+    Yields:
+        Lists of chunks, one per embedding request.
+    """
+    token_budget = max_tokens * _TOKEN_COUNT_HEADROOM
+    current_batch = []
+    current_tokens = 0
+    for item in items:
+        fit_embedding_input(item)
+        if current_batch and (
+            len(current_batch) >= max_inputs or current_tokens + item["token_count"] > token_budget
+        ):
+            yield current_batch
+            current_batch = []
+            current_tokens = 0
+        current_batch.append(item)
+        current_tokens += item["token_count"]
+
+    if current_batch:
+        yield current_batch
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_embedding_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = EmbeddingEngine(
+                max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+                tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+                max_retries=EMBEDDING_MAX_RETRIES,
+            )
+        return _engine
+
+
+class EmbeddingDispatcher:
+    """
+    Coalesces the embedding calls of concurrent requests in this process into
+    fuller OpenAI requests. A call waits up to max_wait_seconds for other
+    calls to join it, and the request goes out as soon as it is full. Each
+    caller gets back the rows of its own texts.
+    """
+
+    def __init__(self, engine, max_wait_seconds, max_inputs, max_tokens):
+        self.engine = engine
+        self.max_wait_seconds = max_wait_seconds
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens * _TOKEN_COUNT_HEADROOM
+        self.pending = []
+        self.pending_inputs = 0
+        self.pending_tokens = 0
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(
+            max_workers=EMBEDDING_MAX_CONCURRENCY,
+            thread_name_prefix="embedding-dispatch"
+        )
+        self.thread = threading.Thread(target=self._run, name="embedding-dispatcher", daemon=True)
+        self.thread.start()
+
+    def embed(self, texts, token_count=None):
+        """
+        Embed texts, sharing the OpenAI request with concurrent calls.
+
+        Returns:
+            The float32 embedding matrix, one row per text.
+        """
+        if token_count is None:
+            token_count = sum(count_tokens(text) for text in texts)
+        # A call filling half a request gains nothing from waiting for others
+        if len(texts) * 2 >= self.max_inputs or token_count * 2 >= self.max_tokens:
+            return self.engine.embed(texts, token_count=token_count)
+
+        future = Future()
+        with self.condition:
+            self.pending.append((texts, token_count, time.monotonic(), future))
+            self.pending_inputs += len(texts)
+            self.pending_tokens += token_count
+            self.condition.notify()
+        return future.result()
+
+    def _full(self):
+        return self.pending_inputs >= self.max_inputs or self.pending_tokens >= self.max_tokens
+
+    def _take_batch(self):
+        # The oldest calls that fit in one request, the rest wait for the next
+        batch = []
+        inputs = 0
+        tokens = 0
+        while self.pending:
+            texts, token_count = self.pending[0][:2]
+            if batch and (inputs + len(texts) > self.max_inputs or tokens + token_count > self.max_tokens):
+                break
+            batch.append(self.pending.pop(0))
+            inputs += len(texts)
+            tokens += token_count
+        self.pending_inputs -= inputs
+        self.pending_tokens -= tokens
+        return batch
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = self.pending[0][2] + self.max_wait_seconds
+                while not self._full():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self._take_batch()
+            self.executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        texts = [text for call_texts, _, _, _ in batch for text in call_texts]
+        token_count = sum(call[1] for call in batch)
+        if len(batch) > 1:
+            logging.info(f"Coalesced {len(batch)} embedding calls into one request of {len(texts)} texts")
+        try:
+            embeddings = self.engine.embed(texts, token_count=token_count)
+        except Exception as e:
+            # A bad input fails the whole request, so each call is sent again
+            # on its own to fail only its caller. Errors that outlived the
+            # retries would fail every call again.
+            if len(batch) == 1 or isinstance(e, RETRYABLE_ERRORS):
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                return
+            logging.warning(f"Coalesced embedding request failed ({e}), sending its {len(batch)} calls one by one")
+            for call_texts, call_token_count, _, future in batch:
+                try:
+                    future.set_result(self.engine.embed(call_texts, token_count=call_token_count))
+                except Exception as call_error:
+                    future.set_exception(call_error)
+            return
+
+        offset = 0
+        for call_texts, _, _, future in batch:
+            future.set_result(embeddings[offset:offset + len(call_texts)])
+            offset += len(call_texts)
+
+
+_dispatcher = None
+
+
+def get_embedding_dispatcher():
+    """
+    The embedding entry point of this process: the dispatcher, or the engine
+    itself when EMBEDDING_BATCH_WAIT_MS is 0.
+    """
+    global _dispatcher
+    engine = get_embedding_engine()
+    if EMBEDDING_BATCH_WAIT_MS <= 0:
+        return engine
+    with _engine_lock:
+        if _dispatcher is None:
+            _dispatcher = EmbeddingDispatcher(
+                engine,
+                max_wait_seconds=EMBEDDING_BATCH_WAIT_MS / 1000,
+                max_inputs=EMBEDDING_MAX_BATCH_INPUTS,
+                max_tokens=EMBEDDING_MAX_BATCH_TOKENS,
+            )
+        return _dispatcher
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    The embedding cache, or None when it is disabled.
+    """
+    global _cache
+    if EMBEDDING_CACHE_MAX_BYTES <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SqliteLRUCache(
+                os.path.join(CACHE_DIR, "embeddings.sqlite"),
+                max_bytes=EMBEDDING_CACHE_MAX_BYTES
+            )
+        return _cache
+
+
+def embedding_cache_key(model, text):
+    """
+    Content address of a chunk's embedding: the model and the hash of the text
+    with unicode and whitespace differences normalized away.
+    """
+    normalized = " ".join(unicodedata.normalize("NFC", text).split())
+    return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+def embed_texts(texts, token_counts=None):
+    """
+    Embed texts, serving the ones seen before from the embedding cache and
+    sending only the misses to OpenAI through the embedding dispatcher.
+
+    Args:
+        texts: The texts to embed.
+        token_counts: The token count of each text, counted when omitted.
+
+    Returns:
+        The float32 embedding matrix, one row per text.
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        total_tokens = sum(token_counts) if token_counts is not None else None
+        return get_embedding_dispatcher().embed(texts, token_count=total_tokens)
+
+    keys = [embedding_cache_key(EMBEDDING_CACHE_MODEL, text) for text in texts]
+    cached = cache.get_many(keys)
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+
+    new_embeddings = None
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        total_tokens = sum(token_counts[i] for i in missing) if token_counts is not None else None
+        new_embeddings = get_embedding_dispatcher().embed(missing_texts, token_count=total_tokens)
+        # Cache entries are the raw float32 bytes of each row
+        cache.set_many([
+            (keys[i], new_embeddings[row].tobytes())
+            for row, i in enumerate(missing)
+        ])
+
+    if new_embeddings is not None:
+        dimensions = new_embeddings.shape[1]
+    else:
+        dimensions = len(next(iter(cached.values()))) // 4
+    embeddings = np.empty((len(texts), dimensions), dtype=np.float32)
+    for i, key in enumerate(keys):
+        if key in cached:
+            embeddings[i] = np.frombuffer(cached[key], dtype=np.float32)
+    if missing:
+        embeddings[missing] = new_embeddings
+
+    logging.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+    return embeddings
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+# Job records live on the local filesystem so that every gunicorn worker in the
+# container can answer a status request, whichever worker is running the job.
+JOBS_DIR = os.getenv('PROCESS_JOBS_DIR', '/app/working/jobs')
+# Job records not updated for this long are removed
+PROCESS_JOB_RETENTION_SECONDS = int(os.getenv('PROCESS_JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+# The worker owning a job refreshes its heartbeat_at this often. A queued or
+# running job whose owner is gone, or whose heartbeat is older than the stale
+# limit, is reported failed: a worker killed by the gunicorn timeout takes its
+# jobs with it.
+PROCESS_JOB_HEARTBEAT_SECONDS = int(os.getenv('PROCESS_JOB_HEARTBEAT_SECONDS', 30))
+PROCESS_JOB_STALE_SECONDS = int(os.getenv('PROCESS_JOB_STALE_SECONDS', 180))
+
+# Number of /process jobs a worker runs at the same time, and how many more it
+# will accept and queue before rejecting new jobs.
+PROCESS_JOB_WORKERS = int(os.getenv('PROCESS_JOB_WORKERS', 2))
+PROCESS_JOB_QUEUE_SIZE = int(os.getenv('PROCESS_JOB_QUEUE_SIZE', 8))
+
+_executor = None
+_executor_lock = threading.Lock()
+_job_slots = threading.BoundedSemaphore(PROCESS_JOB_WORKERS + PROCESS_JOB_QUEUE_SIZE)
+_job_file_lock = threading.Lock()
+_owned_jobs = set()
+_heartbeat_thread = None
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _job_path(job_id):
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _get_executor():
+    """
+    Create the worker pool lazily so it is owned by the gunicorn worker process
+    rather than the master that imported the app.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=PROCESS_JOB_WORKERS,
+                thread_name_prefix='process-job'
+            )
+        return _executor
+
+
+def _write_job(job):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    path = _job_path(job["job_id"])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(job, file)
+    os.replace(tmp_path, path)
+
+
+def _read_job(job_id):
+    try:
+        with open(_job_path(job_id), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _owner_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_abandoned(job):
+    if job["status"] not in ("queued", "in_progress"):
+        return False
+    owner_pid = job.get("owner_pid")
+    if owner_pid is not None and not _owner_is_alive(owner_pid):
+        return True
+    heartbeat_at = datetime.fromisoformat(job.get("heartbeat_at") or job["updated_at"])
+    return (datetime.now(timezone.utc) - heartbeat_at).total_seconds() > PROCESS_JOB_STALE_SECONDS
+
+
+def get_process_job(job_id):
+    """
+    Retrieve a /process job record, or None if the job is unknown. A queued or
+    running job whose worker is gone is marked failed first.
+    """
+    job = _read_job(job_id)
+    if job is None or not _is_abandoned(job):
+        return job
+    with _job_file_lock:
+        # Checked again in case the job moved on in the meantime
+        job = _read_job(job_id)
+        if job is not None and _is_abandoned(job):
+            logging.warning(f"Job {job_id} lost its worker {job.get('owner_pid')}, marking it failed")
+            _fail_job(job, "The worker running the job exited")
+    return job
+
+
+def purge_expired_jobs():
+    """
+    Remove the job records that were not updated within the retention period.
+    """
+    try:
+        filenames = os.listdir(JOBS_DIR)
+    except FileNotFoundError:
+        return
+    now = time.time()
+    for filename in filenames:
+        path = os.path.join(JOBS_DIR, filename)
+        try:
+            if now - os.path.getmtime(path) > PROCESS_JOB_RETENTION_SECONDS:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+def create_process_job(data_source_id):
+    """
+    Create a queued /process job record and return its job ID.
+    """
+    purge_expired_jobs()
+    job_id = str(uuid.uuid4())
+    _write_job({
+        "job_id": job_id,
+        "data_source_id": data_source_id,
+        "status": "queued",
+        "stages": {},
+        "vector_ids": None,
+        "error": None,
+        "owner_pid": os.getpid(),
+        "created_at": _now(),
+        "updated_at": _now(),
+        "heartbeat_at": _now(),
+    })
+    return job_id
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(PROCESS_JOB_HEARTBEAT_SECONDS)
+        with _executor_lock:
+            job_ids = list(_owned_jobs)
+        for job_id in job_ids:
+            with _job_file_lock:
+                job = _read_job(job_id)
+                if job is None or job["status"] not in ("queued", "in_progress"):
+                    continue
+                job["heartbeat_at"] = _now()
+                _write_job(job)
+
+
+def _own_job(job_id):
+    """
+    Keep the heartbeat of a job going until _release_job, from a thread
+    started lazily in the gunicorn worker.
+    """
+    global _heartbeat_thread
+    with _executor_lock:
+        _owned_jobs.add(job_id)
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="job-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+
+def _release_job(job_id):
+    with _executor_lock:
+        _owned_jobs.discard(job_id)
+
+
+def update_process_job(job_id, **fields):
+    """
+    Update top level fields of a job record. A job_id of None is ignored so the
+    pipeline can report progress the same way in synchronous mode.
+    """
+    if job_id is None:
+        return
+    with _job_file_lock:
+        job = _read_job(job_id)
+        if job is None:
+            logging.warning(f"Job {job_id} not found while updating it")
+            return
+        job.update(fields)
+        job["updated_at"] = _now()
+        _write_job(job)
+
+
+def set_job_stage(job_id, stage, status, **details):
+    """
+    Record the progress of a single pipeline stage on the job record.
+
+    Args:
+        job_id: The job to update, or None in synchronous mode.
+        stage: The stage name, e.g. "partition" or "upsert".
+        status: One of "in_progress", "completed" or "failed".
+        details: Extra progress information stored on the stage.
+    """
+    if job_id is None:
+        return
+    with _job_file_lock:
+        job = _read_job(job_id)
+        if job is None:
+            logging.warning(f"Job {job_id} not found while updating stage {stage}")
+            return
+        stage_record = job["stages"].setdefault(stage, {})
+        stage_record["status"] = status
+        if status == "in_progress":
+            stage_record.setdefault("started_at", _now())
+        else:
+            stage_record["completed_at"] = _now()
+        stage_record.update(details)
+        job["updated_at"] = _now()
+        _write_job(job)
+
+
+def fail_process_job(job_id, error):
+    """
+    Mark a job failed, along with the stages it was still running.
+    """
+    with _job_file_lock:
+        job = _read_job(job_id)
+        if job is None:
+            logging.warning(f"Job {job_id} not found while failing it")
+            return
+        _fail_job(job, error)
+
+
+def _fail_job(job, error):
+    for stage_record in job["stages"].values():
+        if stage_record.get("status") == "in_progress":
+            stage_record["status"] = "failed"
+            stage_record["completed_at"] = _now()
+    job["status"] = "failed"
+    job["error"] = error
+    job["updated_at"] = _now()
+    _write_job(job)
+
+
+def submit_process_job(job_id, fn, /, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) on the bounded worker pool for the given job.
+    The job is marked completed with the returned vector IDs and failed page
+    ranges, or failed with the raised error.
+
+    Raises:
+        JobQueueFullError: If the worker already has the maximum number of jobs
+            running or queued.
+    """
+    if not _job_slots.acquire(blocking=False):
+        raise JobQueueFullError("Ingestion queue is full, retry later.")
+
+    def run():
+        try:
+            update_process_job(job_id, status="in_progress")
+            result = fn(*args, **kwargs)
+            update_process_job(
+                job_id,
+                status="completed",
+                vector_ids=result.get("vector_ids", []),
+                partial=bool(result.get("failed_ranges")),
+                failed_ranges=result.get("failed_ranges", [])
+            )
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}", exc_info=True)
+            fail_process_job(job_id, str(e))
+        finally:
+            _release_job(job_id)
+            _job_slots.release()
+
+    _own_job(job_id)
+    try:
+        _get_executor().submit(run)
+    except Exception:
+        _release_job(job_id)
+        _job_slots.release()
+        raise
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+
+# Every gunicorn worker writes a snapshot of its metrics here, /metrics adds
+# up the snapshots of all workers
+METRICS_DIR = os.getenv('METRICS_DIR', '/app/working/metrics')
+# A worker rewrites its snapshot at most this often, and at the end of a run
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 1))
+
+# Totals of workers that have exited, so the counters don't go backwards when
+# a worker is replaced
+_ARCHIVE_FILE = "metrics-archive.json"
+_LOCK_FILE = "metrics.lock"
+
+STAGE_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Counts recorded per stage, exported as unstructured_stage_<name>_total
+STAGE_COUNTS = ("bytes", "pages", "chunks", "tokens", "api_calls", "retries")
+
+_DESCRIPTIONS = {
+    "unstructured_stage_duration_seconds": "Duration of /process stages",
+    "unstructured_stage_bytes_total": "Bytes handled by /process stages",
+    "unstructured_stage_pages_total": "Pages handled by /process stages",
+    "unstructured_stage_chunks_total": "Chunks handled by /process stages",
+    "unstructured_stage_tokens_total": "Tokens handled by /process stages",
+    "unstructured_stage_api_calls_total": "External API calls made by /process stages",
+    "unstructured_stage_retries_total": "External API calls retried by /process stages",
+    "unstructured_process_runs_total": "Finished /process runs",
+    "unstructured_cache_hits_total": "Keys found in the local caches",
+    "unstructured_cache_misses_total": "Keys not found in the local caches",
+    "unstructured_cache_evictions_total": "Entries evicted from the local caches",
+}
+
+_histograms = {}
+_counters = {}
+_metrics_lock = threading.Lock()
+_last_flush = [0.0]
+_snapshot_names = {}
+_DONE = object()
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+def _inc(name, labels, value):
+    series = _counters.setdefault(name, {})
+    series[labels] = series.get(labels, 0) + value
+
+
+def observe_stage(stage, duration=None, **counts):
+    """
+    Record what a stage did: its duration in the stage histogram and its
+    counts (see STAGE_COUNTS) in the per-stage counters.
+    """
+    labels = _labels(stage=stage)
+    with _metrics_lock:
+        if duration is not None:
+            histogram = _histograms.setdefault(labels, {
+                "buckets": [0] * len(STAGE_DURATION_BUCKETS),
+                "sum": 0.0,
+                "count": 0,
+            })
+            for i, bound in enumerate(STAGE_DURATION_BUCKETS):
+                if duration <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += duration
+            histogram["count"] += 1
+        for name, value in counts.items():
+            if value:
+                _inc(f"unstructured_stage_{name}_total", labels, value)
+    flush_metrics()
+
+
+def count_run(status):
+    with _metrics_lock:
+        _inc("unstructured_process_runs_total", _labels(status=status), 1)
+    flush_metrics(force=True)
+
+
+def count_cache(cache, **counts):
+    """
+    Count the hits, misses and evictions of a local cache.
+    """
+    labels = _labels(cache=cache)
+    with _metrics_lock:
+        for name, value in counts.items():
+            if value:
+                _inc(f"unstructured_cache_{name}_total", labels, value)
+    flush_metrics()
+
+
+def _snapshot_name():
+    # The name is unique per process, not just per PID, so a worker that gets
+    # the PID of an exited one doesn't overwrite its totals
+    pid = os.getpid()
+    if pid not in _snapshot_names:
+        _snapshot_names[pid] = f"metrics-{pid}-{uuid.uuid4().hex[:8]}.json"
+    return _snapshot_names[pid]
+
+
+def _snapshot_pid(filename):
+    try:
+        return int(filename.split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _empty_snapshot():
+    return {"histograms": {}, "counters": {}}
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, snapshot):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(snapshot, file)
+    os.replace(tmp_path, path)
+
+
+def _merge_snapshot(total, snapshot):
+    for labels, histogram in snapshot.get("histograms", {}).items():
+        merged = total["histograms"].setdefault(labels, {
+            "buckets": [0] * len(STAGE_DURATION_BUCKETS),
+            "sum": 0.0,
+            "count": 0,
+        })
+        merged["buckets"] = [a + b for a, b in zip(merged["buckets"], histogram["buckets"])]
+        merged["sum"] += histogram["sum"]
+        merged["count"] += histogram["count"]
+    for name, series in snapshot.get("counters", {}).items():
+        merged = total["counters"].setdefault(name, {})
+        for labels, value in series.items():
+            merged[labels] = merged.get(labels, 0) + value
+
+
+def _archive_dead_snapshots(filenames):
+    """
+    Fold the snapshots of workers that are no longer running into the archive
+    and remove them. The archive remembers what it folded, so a snapshot is
+    counted once even if removing it fails. Call with the metrics lock held.
+
+    Returns:
+        The archive and the snapshot files of running workers.
+    """
+    archive_path = os.path.join(METRICS_DIR, _ARCHIVE_FILE)
+    archive = _read_snapshot(archive_path) or dict(_empty_snapshot(), folded=[])
+    dead = [
+        filename for filename in filenames
+        if _snapshot_pid(filename) is not None and not _pid_alive(_snapshot_pid(filename))
+    ]
+    if not dead:
+        return archive, filenames
+
+    folded = set(archive.get("folded", []))
+    for filename in dead:
+        snapshot = None if filename in folded else _read_snapshot(os.path.join(METRICS_DIR, filename))
+        if snapshot is not None:
+            _merge_snapshot(archive, snapshot)
+            folded.add(filename)
+    archive["folded"] = sorted(folded)
+    _write_snapshot(archive_path, archive)
+
+    for filename in dead:
+        try:
+            os.remove(os.path.join(METRICS_DIR, filename))
+        except FileNotFoundError:
+            pass
+    archive["folded"] = []
+    _write_snapshot(archive_path, archive)
+    return archive, [filename for filename in filenames if filename not in dead]
+
+
+def flush_metrics(force=False):
+    """
+    Write this worker's metrics snapshot, unless it was written less than
+    METRICS_FLUSH_SECONDS ago.
+    """
+    now = time.monotonic()
+    with _metrics_lock:
+        if not force and now - _last_flush[0] < METRICS_FLUSH_SECONDS:
+            return
+        _last_flush[0] = now
+        snapshot = json.dumps({"histograms": _histograms, "counters": _counters})
+
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, _snapshot_name())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(snapshot)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not write metrics snapshot: {e}")
+
+
+def render_metrics():
+    """
+    The metrics of every worker in the Prometheus text format.
+    """
+    flush_metrics(force=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    total = _empty_snapshot()
+    with open(os.path.join(METRICS_DIR, _LOCK_FILE), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            filenames = sorted(
+                filename for filename in os.listdir(METRICS_DIR)
+                if filename.startswith("metrics-") and filename.endswith(".json") and filename != _ARCHIVE_FILE
+            )
+            archive, filenames = _archive_dead_snapshots(filenames)
+            _merge_snapshot(total, archive)
+            for filename in filenames:
+                snapshot = _read_snapshot(os.path.join(METRICS_DIR, filename))
+                if snapshot is not None:
+                    _merge_snapshot(total, snapshot)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    histograms = total["histograms"]
+    counters = total["counters"]
+
+    lines = []
+    name = "unstructured_stage_duration_seconds"
+    lines.append(f"# HELP {name} {_DESCRIPTIONS[name]}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in sorted(histograms.items()):
+        for bound, count in zip(STAGE_DURATION_BUCKETS, histogram["buckets"]):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram['sum']}")
+        lines.append(f"{name}_count{{{labels}}} {histogram['count']}")
+
+    for name, series in sorted(counters.items()):
+        lines.append(f"# HELP {name} {_DESCRIPTIONS.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{name}{{{labels}}} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class RunMetrics:
+    """
+    Stage metrics of one /process run, kept as a per-stage breakdown for the
+    job record. A stage goes to the worker metrics once it is recorded.
+
+    api_calls count requests, not attempts. Retries are counted where the
+    calls are retried, and embedding calls by the shared embedding engine,
+    for the worker metrics only.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, **counts):
+        with self.lock:
+            stage_metrics = self.stages.setdefault(stage, {})
+            for name, value in counts.items():
+                stage_metrics[name] = stage_metrics.get(name, 0) + value
+
+    def record(self, stage, duration, **counts):
+        """
+        Record a finished stage. Counts added earlier with add() are included.
+        """
+        self.add(stage, **counts)
+        with self.lock:
+            stage_metrics = self.stages[stage]
+            stage_metrics["duration_ms"] = round(duration * 1000)
+            totals = {name: stage_metrics[name] for name in STAGE_COUNTS if name in stage_metrics}
+        observe_stage(stage, duration, **totals)
+
+    @contextmanager
+    def timed(self, stage, **counts):
+        started_at = time.monotonic()
+        yield
+        self.record(stage, time.monotonic() - started_at, **counts)
+
+    @contextmanager
+    def busy(self, stage):
+        """
+        Time one piece of a stage that runs in many, possibly concurrent,
+        pieces. finish() records the stage.
+        """
+        started_at = time.monotonic()
+        yield
+        ended_at = time.monotonic()
+        with self.lock:
+            span = self.spans.setdefault(stage, [started_at, ended_at, 0.0])
+            span[0] = min(span[0], started_at)
+            span[1] = max(span[1], ended_at)
+            span[2] += ended_at - started_at
+
+    def busy_iter(self, stage, items):
+        """
+        Yield from items, timing the work of producing each one with busy().
+        The stage counts the items.
+        """
+        items = iter(items)
+        while True:
+            with self.busy(stage):
+                item = next(items, _DONE)
+            if item is _DONE:
+                return
+            self.add(stage, chunks=1)
+            yield item
+
+    def finish(self, stage, **counts):
+        """
+        Record a stage timed with busy(). Its duration runs from the start of
+        the first piece to the end of the last, busy_ms adds up the pieces.
+        """
+        with self.lock:
+            span = self.spans.pop(stage, None)
+        if span is None:
+            return
+        self.add(stage, busy_ms=round(span[2] * 1000))
+        self.record(stage, span[1] - span[0], **counts)
+
+    def as_dict(self):
+        with self.lock:
+            return {stage: dict(stage_metrics) for stage, stage_metrics in self.stages.items()}
@@ -1,25 +1,76 @@
 import tiktoken, os
+import base64
+from functools import lru_cache
 from openai import OpenAI
+import numpy as np
 
 client = OpenAI()
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Reduced embedding size requested from the model, unset for its full size.
+# It must match the dimension of the Pinecone indexes.
+EMBEDDING_DIMENSIONS = int(os.getenv("OPENAI_EMBEDDING_DIMENSIONS")) if os.getenv("OPENAI_EMBEDDING_DIMENSIONS") else None
+
+# tiktoken lookups are not free, resolve each model's encoding once per process
+@lru_cache(maxsize=None)
+def _encoding_for_model(model):
+    return tiktoken.encoding_for_model(model)
+
 def get_encoding():
     model = os.getenv("OPENAI_MODEL")
     if model is None:
         model = "gpt-4o-2024-08-06"
 
-    encoding = tiktoken.encoding_for_model(model)
-
-    return encoding
+    return _encoding_for_model(model)
 
 def count_tokens(text):
     econding = get_encoding()
-    return len(econding.encode(text))
+    return len(econding.encode(text, disallowed_special=()))
+
+def count_tokens_many(texts, num_threads=8):
+    """
+    Count the tokens of many texts at once using tiktoken's batch encoder,
+    which tokenizes on its own thread pool.
+    """
+    encoding = get_encoding()
+    return [
+        len(tokens)
+        for tokens in encoding.encode_batch(texts, num_threads=num_threads, disallowed_special=())
+    ]
+
+def truncate_to_tokens(text, max_tokens, model=EMBEDDING_MODEL):
+    """
+    Cut text down to at most max_tokens tokens of the model's encoding.
+
+    Returns:
+        The text and its number of tokens.
+    """
+    encoding = _encoding_for_model(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    return encoding.decode(tokens[:max_tokens]), max_tokens
 
 def create_embeddings(texts):
-    res = client.embeddings.create(
-        model="text-embedding-3-small",
+    # Retries are handled by the embedding engine, per failed batch
+    options = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+    # base64 embeddings are the raw float32 buffers, a quarter of the JSON size
+    res = client.with_options(max_retries=0).embeddings.create(
+        model=EMBEDDING_MODEL,
         input=texts,
-        encoding_format="float"
+        encoding_format="base64",
+        **options
     )
-    return res
\ No newline at end of file
+    return res
+
+def decode_embeddings(response):
+    """
+    Decode a base64 embeddings response into a float32 matrix, one row per
+    input text.
+    """
+    data = sorted(response.data, key=lambda item: item.index)
+    return np.stack([
+        np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32)
+        for item in data
+    ])
@@ -0,0 +1,243 @@
+import os
+import time
+import hashlib
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pypdf import PdfReader, PdfWriter
+
+from utils.metrics_utils import observe_stage
+
+# PDFs with more pages than this are split locally and partitioned by page
+# range when none of their pages is cached
+PDF_SPLIT_MIN_PAGES = int(os.getenv('PDF_SPLIT_MIN_PAGES', 20))
+PDF_PAGES_PER_RANGE = int(os.getenv('PDF_PAGES_PER_RANGE', 10))
+# Page ranges partitioned at the same time for one document
+PDF_PARTITION_CONCURRENCY = int(os.getenv('PDF_PARTITION_CONCURRENCY', 4))
+# Pages of one document partitioned at the same time. The API client splits
+# each range into pages, and the concurrent ranges share these requests.
+PDF_PAGE_CONCURRENCY = int(os.getenv('PDF_PAGE_CONCURRENCY', 15))
+PDF_PARTITION_MAX_RETRIES = int(os.getenv('PDF_PARTITION_MAX_RETRIES', 2))
+# A page range taking longer than this is abandoned and retried
+PDF_RANGE_TIMEOUT_SECONDS = int(os.getenv('PDF_RANGE_TIMEOUT_SECONDS', 180))
+
+
+def read_pdf(file_path):
+    """
+    Open a PDF for splitting and fingerprinting, or return None when pypdf
+    cannot read it, in which case the whole file should be partitioned at once.
+    """
+    try:
+        reader = PdfReader(file_path)
+        len(reader.pages)
+        return reader
+    except Exception as e:
+        logging.warning(f"Could not read {file_path}, partitioning it whole: {e}")
+        return None
+
+
+def _hash_resources(resources, digest, depth=0):
+    # Images and form XObjects are drawn by name from the content stream, so
+    # their data goes into the fingerprint along with the fonts in use
+    resources = resources.get_object() if resources is not None else None
+    if not resources or depth > 4:
+        return
+
+    fonts = resources.get("/Font")
+    if fonts:
+        fonts = fonts.get_object()
+        for name in sorted(fonts):
+            digest.update(f"{name}={fonts[name].get_object().get('/BaseFont')}".encode("utf-8"))
+
+    xobjects = resources.get("/XObject")
+    if not xobjects:
+        return
+    xobjects = xobjects.get_object()
+    for name in sorted(xobjects):
+        xobject = xobjects[name].get_object()
+        try:
+            data = xobject.get_data()
+        except Exception:
+            data = repr(xobject).encode("utf-8")
+        digest.update(name.encode("utf-8"))
+        digest.update(hashlib.sha256(data).digest())
+        if xobject.get("/Subtype") == "/Form":
+            _hash_resources(xobject.get("/Resources"), digest, depth + 1)
+
+
+def page_fingerprint(page):
+    """
+    Content hash of a PDF page: its size and rotation, its content stream and
+    the data of the images, forms and fonts it uses. Re-exporting a document
+    leaves the fingerprint of an unchanged page as is.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr([float(value) for value in page.mediabox]).encode("utf-8"))
+    digest.update(str(page.get("/Rotate", 0)).encode("utf-8"))
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    _hash_resources(page.get("/Resources"), digest)
+    return digest.hexdigest()
+
+
+def page_fingerprints(reader):
+    """
+    The fingerprint of every page of a PDF, or None if one of the pages
+    cannot be read.
+    """
+    try:
+        return [page_fingerprint(page) for page in reader.pages]
+    except Exception as e:
+        logging.warning(f"Could not fingerprint PDF pages: {e}")
+        return None
+
+
+def _page_runs(pages, pages_per_range):
+    # Group sorted page numbers into runs of consecutive pages, cut every
+    # pages_per_range pages
+    runs = []
+    for page_number in pages:
+        run = runs[-1] if runs else None
+        if run and page_number == run[-1] + 1 and len(run) < pages_per_range:
+            run.append(page_number)
+        else:
+            runs.append([page_number])
+    return runs
+
+
+def split_pdf(reader, output_dir, pages=None, pages_per_range=PDF_PAGES_PER_RANGE):
+    """
+    Write page range files of a PDF.
+
+    Args:
+        reader: The PDF from read_pdf.
+        output_dir: The directory of the range files.
+        pages: The 1-based page numbers to write, every page when omitted.
+            Consecutive pages go in the same range.
+        pages_per_range: The maximum number of pages in a range.
+
+    Returns:
+        A list of dicts with the first and last page, a label and the path of
+        each range, in page order. The list is empty when the PDF cannot be
+        split, in which case the whole file should be partitioned at once.
+    """
+    if pages is None:
+        pages = range(1, len(reader.pages) + 1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    page_ranges = []
+    try:
+        for run in _page_runs(sorted(pages), pages_per_range):
+            first_page, last_page = run[0], run[-1]
+            writer = PdfWriter()
+            for page_number in run:
+                writer.add_page(reader.pages[page_number - 1])
+            range_path = os.path.join(output_dir, f"pages-{first_page}-{last_page}.pdf")
+            with open(range_path, "wb") as file:
+                writer.write(file)
+            page_ranges.append({
+                "first_page": first_page,
+                "last_page": last_page,
+                "label": f"pages {first_page}-{last_page}",
+                "path": range_path,
+            })
+    except Exception as e:
+        logging.warning(f"Could not split the PDF into page ranges: {e}")
+        return []
+
+    logging.info(f"Split {len(pages)} pages into {len(page_ranges)} page ranges")
+    return page_ranges
+
+
+def group_elements_by_page(elements):
+    """
+    Group elements by their page number. Elements without a page number
+    belong to the page of the element before them.
+
+    Returns:
+        A dict of page number to elements, or None if the elements cannot be
+        attributed to pages.
+    """
+    pages = {}
+    page_number = None
+    for element in elements:
+        page_number = element.get("metadata", {}).get("page_number") or page_number
+        if page_number is None:
+            return None
+        pages.setdefault(page_number, []).append(element)
+    return pages
+
+
+def _offset_page_numbers(elements, first_page):
+    # Elements of a range are numbered from 1, move them to the document's pages
+    for element in elements:
+        metadata = element.setdefault("metadata", {})
+        if metadata.get("page_number"):
+            metadata["page_number"] += first_page - 1
+    return elements
+
+
+def partition_page_ranges(page_ranges, partition_fn, on_progress=None,
+                          max_workers=PDF_PARTITION_CONCURRENCY, max_retries=PDF_PARTITION_MAX_RETRIES):
+    """
+    Partition page ranges concurrently and merge their elements in page order.
+    Each range is retried on its own. A range that still fails is left out
+    with a warning so it doesn't fail the whole document.
+
+    Args:
+        page_ranges: The ranges from split_pdf.
+        partition_fn: Called with a range file path, returns its elements.
+        on_progress: Called with (ranges_done, ranges_total, failed_ranges)
+            every time a range finishes.
+
+    Returns:
+        The merged elements, and the labels of the page ranges left out.
+
+    Raises:
+        Exception: If every page range failed.
+    """
+    results = [None] * len(page_ranges)
+    failed_ranges = []
+    done = [0]
+    progress_lock = threading.Lock()
+
+    def partition_range(index):
+        page_range = page_ranges[index]
+        label = page_range["label"]
+        for attempt in range(max_retries + 1):
+            try:
+                elements = partition_fn(page_range["path"])
+                results[index] = _offset_page_numbers(elements, page_range["first_page"])
+                logging.info(f"Partitioned {label} into {len(elements)} elements")
+                break
+            except Exception as e:
+                if attempt == max_retries:
+                    logging.warning(f"Skipping {label} after {attempt + 1} failed attempts: {e}")
+                    with progress_lock:
+                        failed_ranges.append(label)
+                    break
+                delay = min(30, 2 ** attempt) + random.random()
+                logging.warning(f"Partitioning {label} failed ({e}), retrying in {delay:.1f}s")
+                observe_stage("partition", retries=1)
+                time.sleep(delay)
+
+        with progress_lock:
+            done[0] += 1
+            progress = (done[0], len(page_ranges), list(failed_ranges))
+        if on_progress is not None:
+            on_progress(*progress)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="partition") as executor:
+        list(executor.map(partition_range, range(len(page_ranges))))
+
+    if page_ranges and len(failed_ranges) == len(page_ranges):
+        raise Exception("Failed to partition every page range of the document")
+
+    elements = []
+    for range_elements in results:
+        if range_elements:
+            elements.extend(range_elements)
+    return elements, failed_ranges
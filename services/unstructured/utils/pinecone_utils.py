@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pinecone import Pinecone
+from cachetools import TTLCache
+
+from utils.metrics_utils import observe_stage
+
+# Cache for storing index descriptions (TTL set to 1 hour)
+index_description_cache = TTLCache(maxsize=100, ttl=3600)
+
+# Index handles unused for this long are dropped along with their connections
+PINECONE_INDEX_IDLE_SECONDS = int(os.getenv('PINECONE_INDEX_IDLE_SECONDS', 900))
+
+# Pinecone accepts at most 1000 IDs per delete request
+DELETE_BATCH_SIZE = 1000
+
+# Fetches go in the query string, keep batches well under URL length limits
+FETCH_BATCH_SIZE = int(os.getenv('PINECONE_FETCH_BATCH_SIZE', 100))
+# Concurrent metadata-only updates, e.g. when marking vectors as deleted
+UPDATE_MAX_CONCURRENCY = int(os.getenv('PINECONE_UPDATE_MAX_CONCURRENCY', 16))
+
+# Upsert requests are limited to 2MB and 1000 vectors. Batches are packed by
+# estimated payload size, leaving headroom for the request envelope.
+UPSERT_MAX_BATCH_BYTES = int(os.getenv('PINECONE_UPSERT_MAX_BATCH_BYTES', 1536 * 1024))
+UPSERT_MAX_BATCH_VECTORS = int(os.getenv('PINECONE_UPSERT_MAX_BATCH_VECTORS', 1000))
+UPSERT_MAX_CONCURRENCY = int(os.getenv('PINECONE_UPSERT_MAX_CONCURRENCY', 4))
+UPSERT_MAX_RETRIES = int(os.getenv('PINECONE_UPSERT_MAX_RETRIES', 4))
+
+# Upper bound of a float32 value written as JSON with its separator, e.g.
+# "-1.2345678442216013e-05, "
+_FLOAT_JSON_BYTES = 25
+
+_client = None
+_index_handles = {}
+_registry_lock = threading.Lock()
+# TTLCache is not thread safe
+_description_cache_lock = threading.Lock()
+
+# Separates the data source ID from the chunk hash in a vector ID, so the
+# vectors of a data source can be listed by prefix
+VECTOR_ID_SEPARATOR = "#"
+
+
+def get_pinecone_client():
+    """
+    The Pinecone client shared by every request of this worker process.
+    """
+    global _client
+    if _client is None:
+        _client = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    return _client
+
+
+def get_index_host(pc, index_name):
+    """
+    Resolve the Pinecone index host from the index name.
+    The function caches the index description to avoid repeated API calls.
+    """
+    with _description_cache_lock:
+        index_desc = index_description_cache.get(index_name)
+    if index_desc is not None:
+        logging.info(f"Using cached index description for: {index_name}")
+    else:
+        try:
+            # Fetch the index description
+            index_desc = pc.describe_index(index_name)
+            logging.info(f"Retrieved index description for: {index_name}")
+
+            # Cache the index description
+            with _description_cache_lock:
+                index_description_cache[index_name] = index_desc
+        except Exception as e:
+            logging.error(f"Error retrieving index description for {index_name}: {e}")
+            raise Exception(f"Failed to describe index: {index_name}")
+
+    # Access the host directly from the root of the index description
+    index_host = index_desc.get('host')
+    if not index_host:
+        raise Exception(f"Index host not found in index description for {index_name}")
+
+    return f"https://{index_host}"
+
+
+def _close_index(index_name, pinecone_index):
+    close = getattr(pinecone_index, "close", None)
+    try:
+        if close is not None:
+            close()
+        logging.info(f"Dropped idle Pinecone index handle: {index_name}")
+    except Exception as e:
+        logging.warning(f"Error closing Pinecone index handle {index_name}: {e}")
+
+
+def get_pinecone_index(index_name):
+    """
+    Get the Pinecone index handle for an index name. Handles are kept per
+    worker process so HTTP connections stay alive across requests, and are
+    dropped after PINECONE_INDEX_IDLE_SECONDS without use.
+    """
+    now = time.monotonic()
+    with _registry_lock:
+        for name, (handle, last_used) in list(_index_handles.items()):
+            if name != index_name and now - last_used > PINECONE_INDEX_IDLE_SECONDS:
+                del _index_handles[name]
+                _close_index(name, handle)
+
+        if index_name in _index_handles:
+            pinecone_index = _index_handles[index_name][0]
+            _index_handles[index_name] = (pinecone_index, now)
+            return pinecone_index
+
+    # Resolving the host may call the control plane, which must not hold up
+    # the threads using other indexes
+    pc = get_pinecone_client()
+    index_host = get_index_host(pc, index_name)
+    new_index = pc.Index(host=index_host)
+
+    with _registry_lock:
+        if index_name in _index_handles:
+            # Another thread opened the index meanwhile, keep its handle
+            pinecone_index = _index_handles[index_name][0]
+        else:
+            logging.info(f"Opening Pinecone index handle for {index_name} at {index_host}")
+            pinecone_index = new_index
+        _index_handles[index_name] = (pinecone_index, now)
+    if pinecone_index is not new_index:
+        _close_index(index_name, new_index)
+    return pinecone_index
+
+
+def vector_id_prefix(data_source_id):
+    return f"{data_source_id}{VECTOR_ID_SEPARATOR}"
+
+
+def vector_id_for_chunk(data_source_id, text):
+    """
+    Deterministic vector ID of a chunk: the data source ID followed by a hash
+    of the chunk's text. An unchanged chunk keeps its ID wherever it moves in
+    the document, so its vector can be kept.
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+    return f"{vector_id_prefix(data_source_id)}{digest}"
+
+
+def list_vector_ids(pinecone_index, prefix, namespace):
+    """
+    List every vector ID starting with prefix in a namespace, following
+    Pinecone's pagination.
+    """
+    vector_ids = []
+    for page in pinecone_index.list(prefix=prefix, namespace=namespace):
+        vector_ids.extend(page)
+    return vector_ids
+
+
+def delete_namespace(pinecone_index, namespace):
+    """
+    Hard delete every vector of a namespace.
+    """
+    pinecone_index.delete(delete_all=True, namespace=namespace)
+    logging.info(f"Purged namespace: {namespace}")
+
+
+def delete_vectors(pinecone_index, vector_ids, namespace):
+    """
+    Hard delete vectors by ID in batches.
+    """
+    vector_ids = list(vector_ids)
+    for i in range(0, len(vector_ids), DELETE_BATCH_SIZE):
+        batch = vector_ids[i:i + DELETE_BATCH_SIZE]
+        pinecone_index.delete(ids=batch, namespace=namespace)
+    logging.info(f"Deleted {len(vector_ids)} vectors from namespace: {namespace}")
+
+
+def estimate_vector_bytes(vector):
+    """
+    Estimated serialized size of one upsert item. The metadata is sized as
+    ASCII-escaped JSON, an upper bound whether or not the client escapes
+    non-ASCII text, and the values are bounded by their length.
+    """
+    metadata_bytes = len(json.dumps(vector.get("metadata") or {}))
+    return len(vector["id"]) + len(vector["values"]) * _FLOAT_JSON_BYTES + metadata_bytes + 64
+
+
+def pack_upsert_batches(vectors, max_bytes=UPSERT_MAX_BATCH_BYTES, max_vectors=UPSERT_MAX_BATCH_VECTORS):
+    """
+    Split vectors into upsert batches that stay under the request size and
+    vector count limits.
+    """
+    batches = []
+    current_batch = []
+    current_bytes = 0
+    for vector in vectors:
+        vector_bytes = estimate_vector_bytes(vector)
+        if current_batch and (current_bytes + vector_bytes > max_bytes or len(current_batch) >= max_vectors):
+            batches.append(current_batch)
+            current_batch = []
+            current_bytes = 0
+        current_batch.append(vector)
+        current_bytes += vector_bytes
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+def _is_retryable(error):
+    # Client errors other than throttling will fail again, don't retry them
+    status = getattr(error, "status", None)
+    return status is None or status == 429 or status >= 500
+
+
+def _vector_payload(vector):
+    # Values stay float32 rows of the embedding matrix until the request is built
+    if isinstance(vector["values"], np.ndarray):
+        return dict(vector, values=vector["values"].tolist())
+    return vector
+
+
+def upsert_batch(pinecone_index, batch, namespace, max_retries=UPSERT_MAX_RETRIES):
+    """
+    Upsert one batch, retrying only this batch on throttling, server and
+    connection errors.
+
+    Returns:
+        The latency of the successful request, in seconds.
+    """
+    vectors = [_vector_payload(vector) for vector in batch]
+    for attempt in range(max_retries + 1):
+        started_at = time.monotonic()
+        try:
+            pinecone_index.upsert(vectors=vectors, namespace=namespace)
+            latency = time.monotonic() - started_at
+            logging.info(f"Upserted {len(batch)} vectors to namespace {namespace} in {latency * 1000:.0f}ms")
+            return latency
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable(e):
+                logging.error(f"Upsert of {len(batch)} vectors failed after {attempt + 1} attempts: {e}")
+                raise
+            delay = min(30, 2 ** attempt) + random.random()
+            logging.warning(f"Upsert of {len(batch)} vectors failed ({e}), retrying in {delay:.1f}s")
+            observe_stage("upsert", retries=1)
+            time.sleep(delay)
+
+
+def update_metadata(pinecone_index, vector_id, metadata, namespace, max_retries=UPSERT_MAX_RETRIES):
+    """
+    Set metadata fields of one vector without re-sending its values, retrying
+    on throttling, server and connection errors.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            pinecone_index.update(id=vector_id, set_metadata=metadata, namespace=namespace)
+            return
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable(e):
+                raise
+            time.sleep(min(30, 2 ** attempt) + random.random())
+
+
+def update_moved_vectors(pinecone_index, positions, namespace):
+    """
+    Bring the position metadata of kept vectors up to date. Vectors are
+    fetched in batches and the ones whose chunk moved get a metadata-only
+    update.
+
+    Args:
+        pinecone_index: The index holding the vectors.
+        positions: A dict of vector ID to its new metadata fields, e.g.
+            {"page_number": 3, "chunk_number": 0}.
+        namespace: The namespace of the vectors.
+
+    Returns:
+        The number of updated vectors.
+    """
+    vector_ids = list(positions)
+    moved = []
+    for i in range(0, len(vector_ids), FETCH_BATCH_SIZE):
+        batch = vector_ids[i:i + FETCH_BATCH_SIZE]
+        found = pinecone_index.fetch(ids=batch, namespace=namespace).vectors
+        for vector_id in batch:
+            if vector_id not in found:
+                continue
+            metadata = found[vector_id].metadata or {}
+            if any(metadata.get(name) != value for name, value in positions[vector_id].items()):
+                moved.append(vector_id)
+    if not moved:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=UPDATE_MAX_CONCURRENCY, thread_name_prefix="pinecone-update") as executor:
+        list(executor.map(
+            lambda vector_id: update_metadata(pinecone_index, vector_id, positions[vector_id], namespace),
+            moved
+        ))
+    logging.info(f"Updated the position of {len(moved)} kept vectors in namespace {namespace}")
+    return len(moved)
+
+
+def mark_vectors_deleted(pinecone_index, vector_ids, namespace, deadline=None, verify=True):
+    """
+    Flag vectors as deleted with metadata-only updates. IDs are checked in
+    fetch batches, unless verify is False, and the updates of a batch run
+    concurrently. Checked vectors that already have isDeleted and deletedAt
+    are skipped, so their grace period doesn't start over. The work stops
+    at the deadline (a time.monotonic() value) and the IDs not yet processed
+    are returned, so the caller can send them again.
+
+    Returns:
+        A dict with the updated IDs, the skipped IDs, the errors and the
+        remaining IDs.
+    """
+    vector_ids = list(dict.fromkeys(vector_ids))
+    deleted_at = int(time.time())
+    updated_ids = []
+    skipped_ids = []
+    errors = []
+    remaining_ids = []
+
+    def mark(vector_id):
+        try:
+            update_metadata(
+                pinecone_index,
+                vector_id,
+                {"isDeleted": True, "deletedAt": deleted_at},
+                namespace
+            )
+            return vector_id, None
+        except Exception as e:
+            logging.error(f"Error updating vector {vector_id} as deleted: {str(e)}")
+            return vector_id, f"Error updating {vector_id}: {str(e)}"
+
+    with ThreadPoolExecutor(max_workers=UPDATE_MAX_CONCURRENCY, thread_name_prefix="pinecone-update") as executor:
+        for i in range(0, len(vector_ids), FETCH_BATCH_SIZE):
+            if deadline is not None and time.monotonic() > deadline:
+                remaining_ids = vector_ids[i:]
+                logging.warning(f"Stopped marking vectors as deleted, {len(remaining_ids)} left")
+                break
+
+            batch = vector_ids[i:i + FETCH_BATCH_SIZE]
+            if not verify:
+                found = batch
+            else:
+                try:
+                    found = pinecone_index.fetch(ids=batch, namespace=namespace).vectors
+                except Exception as e:
+                    errors.extend(f"Error updating {vector_id}: {str(e)}" for vector_id in batch)
+                    logging.error(f"Error fetching {len(batch)} vectors: {str(e)}")
+                    continue
+
+            existing = []
+            for vector_id in batch:
+                if vector_id in found:
+                    metadata = (verify and found[vector_id].metadata) or {}
+                    if metadata.get("isDeleted") and "deletedAt" in metadata:
+                        skipped_ids.append(vector_id)
+                    else:
+                        existing.append(vector_id)
+                else:
+                    errors.append(f"Error updating {vector_id}: Vector ID {vector_id} not found in index.")
+
+            for vector_id, error in executor.map(mark, existing):
+                if error:
+                    errors.append(error)
+                else:
+                    updated_ids.append(vector_id)
+
+    logging.info(
+        f"Marked {len(updated_ids)} vectors as deleted in namespace {namespace}, "
+        f"{len(skipped_ids)} already were"
+    )
+    return {
+        "updated_ids": updated_ids,
+        "skipped_ids": skipped_ids,
+        "errors": errors,
+        "remaining_ids": remaining_ids
+    }
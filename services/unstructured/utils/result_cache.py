@@ -0,0 +1,147 @@
+import os
+import json
+import zlib
+import hashlib
+import logging
+import threading
+
+from utils.cache_utils import CACHE_DIR, SqliteLRUCache
+
+# Size of the partition and summary result cache, 0 disables it
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Size of the per-page partition cache, 0 disables it
+PAGE_CACHE_MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Bump when the partition or chunking output changes shape so old entries are
+# no longer used
+RESULT_CACHE_VERSION = 2
+PAGE_CACHE_VERSION = 1
+
+_cache = None
+_page_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    The partition/summary result cache, or None when it is disabled.
+    """
+    global _cache
+    if RESULT_CACHE_MAX_BYTES <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SqliteLRUCache(
+                os.path.join(CACHE_DIR, "results.sqlite"),
+                max_bytes=RESULT_CACHE_MAX_BYTES
+            )
+        return _cache
+
+
+def result_cache_key(object_info, strategy, chunker_config):
+    """
+    Key of a document's partition result: the S3 object version (ETag and
+    size) and everything in the pipeline configuration that changes the chunks.
+    """
+    key_data = {
+        "version": RESULT_CACHE_VERSION,
+        "bucket": object_info["bucket"],
+        "key": object_info["key"],
+        "etag": object_info["etag"],
+        "size": object_info["size"],
+        "strategy": strategy,
+        "chunker": chunker_config,
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _encode(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode(value):
+    return json.loads(zlib.decompress(value).decode("utf-8"))
+
+
+def get_cached_chunks(cache_key):
+    """
+    The chunk records stored for cache_key, or None on a miss.
+    """
+    cache = get_result_cache()
+    if cache is None or cache_key is None:
+        return None
+    value = cache.get(f"chunks:{cache_key}")
+    if value is None:
+        return None
+    logging.info(f"Using cached partition result {cache_key}")
+    return _decode(value)
+
+
+def set_cached_chunks(cache_key, records):
+    cache = get_result_cache()
+    if cache is None or cache_key is None:
+        return
+    cache.set(f"chunks:{cache_key}", _encode(list(records)))
+
+
+def get_cached_summary(cache_key, model):
+    cache = get_result_cache()
+    if cache is None or cache_key is None:
+        return None
+    value = cache.get(f"summary:{model}:{cache_key}")
+    if value is None:
+        return None
+    logging.info(f"Using cached summary {cache_key}")
+    return _decode(value)
+
+
+def set_cached_summary(cache_key, model, summary):
+    cache = get_result_cache()
+    if cache is None or cache_key is None:
+        return
+    cache.set(f"summary:{model}:{cache_key}", _encode(summary))
+
+
+def get_page_cache():
+    """
+    The per-page partition cache, or None when it is disabled.
+    """
+    global _page_cache
+    if PAGE_CACHE_MAX_BYTES <= 0:
+        return None
+    with _cache_lock:
+        if _page_cache is None:
+            _page_cache = SqliteLRUCache(
+                os.path.join(CACHE_DIR, "pages.sqlite"),
+                max_bytes=PAGE_CACHE_MAX_BYTES
+            )
+        return _page_cache
+
+
+def page_cache_key(fingerprint, strategy):
+    """
+    Key of one PDF page's partition result. Pages are keyed by content, so an
+    unchanged page of a new revision, or of another document, is a hit.
+    """
+    return f"page:{PAGE_CACHE_VERSION}:{strategy}:{fingerprint}"
+
+
+def get_cached_pages(keys):
+    """
+    The elements stored for each page key found in the cache, as a dict.
+    """
+    cache = get_page_cache()
+    if cache is None:
+        return {}
+    return {key: _decode(value) for key, value in cache.get_many(keys).items()}
+
+
+def set_cached_pages(items):
+    """
+    Store (key, elements) pairs, one per page.
+    """
+    cache = get_page_cache()
+    if cache is None:
+        return
+    cache.set_many([(key, _encode(elements)) for key, elements in items])
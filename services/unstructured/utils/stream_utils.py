@@ -0,0 +1,112 @@
+import os
+import queue
+import logging
+import threading
+
+# Maximum number of items waiting between two pipeline stages
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 4))
+
+_POLL_INTERVAL = 0.1
+_DONE = object()
+
+
+def run_streaming_stages(source, stages, queue_size=STREAM_QUEUE_SIZE):
+    """
+    Run a producer/consumer pipeline where each stage works on its own thread
+    and hands its output to the next stage through a bounded queue, so a slow
+    stage applies back pressure instead of buffering the whole document.
+
+    Args:
+        source: An iterable of items fed to the first stage. It is consumed on
+            its own thread, so it may be a generator doing real work.
+        stages: A list of (name, fn) or (name, fn, workers) tuples. fn(item)
+            returns an iterable of items for the next stage, or None to emit
+            nothing. The return value of the last stage is ignored. With
+            workers > 1 the stage runs fn on that many threads, so items may
+            reach the next stage out of order.
+        queue_size: Maximum number of items waiting in front of each stage.
+
+    Raises:
+        The first exception raised by the source or any stage. The other
+        stages are stopped as soon as an error is seen.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stop = threading.Event()
+    errors = []
+
+    def fail(name, e):
+        logging.error(f"Streaming stage {name} failed: {e}")
+        errors.append(e)
+        stop.set()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def produce():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+        except BaseException as e:
+            fail("source", e)
+        finally:
+            put(queues[0], _DONE)
+
+    def consume(index, name, fn, state):
+        next_queue = queues[index + 1] if index + 1 < len(queues) else None
+        try:
+            while True:
+                item = get(queues[index])
+                if item is _DONE:
+                    # Hand the end marker back so sibling workers see it too
+                    put(queues[index], _DONE)
+                    break
+                outputs = fn(item)
+                if next_queue is None or outputs is None:
+                    continue
+                for output in outputs:
+                    if not put(next_queue, output):
+                        return
+        except BaseException as e:
+            fail(name, e)
+        finally:
+            with state["lock"]:
+                state["active"] -= 1
+                last_worker = state["active"] == 0
+            if last_worker and next_queue is not None:
+                put(next_queue, _DONE)
+
+    threads = [threading.Thread(target=produce, name="stream-source", daemon=True)]
+    for index, stage in enumerate(stages):
+        name, fn = stage[0], stage[1]
+        workers = stage[2] if len(stage) > 2 else 1
+        state = {"lock": threading.Lock(), "active": workers}
+        for worker in range(workers):
+            threads.append(threading.Thread(
+                target=consume,
+                args=(index, name, fn, state),
+                name=f"stream-{name}-{worker}",
+                daemon=True
+            ))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
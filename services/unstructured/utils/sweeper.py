@@ -0,0 +1,229 @@
+import os
+import json
+import math
+import time
+import fcntl
+import logging
+import threading
+
+from utils.cache_utils import CACHE_DIR
+from utils.chunk_store import delete_chunk_texts
+from utils.chunk_utils import PINECONE_METADATA_MODE
+from utils.pinecone_utils import (
+    delete_vectors,
+    get_pinecone_client,
+    get_pinecone_index,
+    mark_vectors_deleted,
+)
+
+# The sweeper hard deletes vectors flagged isDeleted once their grace period
+# is over. The background loop is off unless enabled, POST /sweep runs it once.
+SWEEPER_ENABLED = os.getenv('SWEEPER_ENABLED', 'false').lower() == 'true'
+SWEEP_INTERVAL_SECONDS = int(os.getenv('SWEEP_INTERVAL_SECONDS', 3600))
+SWEEP_GRACE_SECONDS = int(os.getenv('SWEEP_GRACE_SECONDS', 7 * 24 * 3600))
+# Vectors found per query, at most 1000 with metadata included
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', 1000))
+SWEEP_MAX_DELETES_PER_SECOND = float(os.getenv('SWEEP_MAX_DELETES_PER_SECOND', 200))
+# Comma separated indexes the sweeper may delete from. The Pinecone project can
+# hold indexes of other services, so nothing is swept unless it is listed.
+SWEEP_INDEX_NAMES = [name.strip() for name in os.getenv('SWEEP_INDEX_NAMES', '').split(',') if name.strip()]
+
+# Shared by the gunicorn workers: the lock lets a single worker sweep at a time
+# and the state file records what each namespace's last sweep did
+SWEEP_LOCK_PATH = os.path.join(CACHE_DIR, 'sweeper.lock')
+SWEEP_STATE_PATH = os.path.join(CACHE_DIR, 'sweeper.json')
+
+_sweeper_thread = None
+_sweeper_thread_lock = threading.Lock()
+
+
+def get_sweep_state():
+    try:
+        with open(SWEEP_STATE_PATH, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {"namespaces": {}}
+
+
+def _save_sweep_state(state):
+    os.makedirs(os.path.dirname(SWEEP_STATE_PATH), exist_ok=True)
+    tmp_path = f"{SWEEP_STATE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file)
+    os.replace(tmp_path, SWEEP_STATE_PATH)
+
+
+def _query_ids(pinecone_index, namespace, query_vector, metadata_filter):
+    response = pinecone_index.query(
+        vector=query_vector,
+        top_k=SWEEP_BATCH_SIZE,
+        namespace=namespace,
+        filter=metadata_filter,
+        include_values=False,
+        include_metadata=False,
+    )
+    return [match.id for match in response.matches]
+
+
+def sweep_namespace(pinecone_index, namespace, dimension, on_progress=None):
+    """
+    Hard delete the soft-deleted vectors of a namespace whose grace period is
+    over, throttled to SWEEP_MAX_DELETES_PER_SECOND.
+
+    Vectors flagged before deletedAt was recorded get it set to now first,
+    so their grace period starts with this sweep.
+
+    Returns:
+        The number of deleted vectors.
+    """
+    # Any direction works, the filter does the selection
+    query_vector = [1 / math.sqrt(dimension)] * dimension
+    # Queries are eventually consistent and can return vectors that were just
+    # updated or deleted, stop once a query has nothing new
+    handled_ids = set()
+
+    try:
+        while True:
+            legacy_ids = [
+                vector_id
+                for vector_id in _query_ids(pinecone_index, namespace, query_vector, {
+                    "isDeleted": {"$eq": True},
+                    "deletedAt": {"$exists": False},
+                })
+                if vector_id not in handled_ids
+            ]
+            if not legacy_ids:
+                break
+            mark_vectors_deleted(pinecone_index, legacy_ids, namespace, verify=False)
+            handled_ids.update(legacy_ids)
+    except Exception as e:
+        logging.warning(f"Could not stamp deletedAt in namespace {namespace}: {e}")
+
+    cutoff = int(time.time()) - SWEEP_GRACE_SECONDS
+    deleted = 0
+    while True:
+        vector_ids = [
+            vector_id
+            for vector_id in _query_ids(pinecone_index, namespace, query_vector, {
+                "isDeleted": {"$eq": True},
+                "deletedAt": {"$lte": cutoff},
+            })
+            if vector_id not in handled_ids
+        ]
+        if not vector_ids:
+            break
+
+        started_at = time.monotonic()
+        delete_vectors(pinecone_index, vector_ids, namespace)
+        if PINECONE_METADATA_MODE == "slim":
+            delete_chunk_texts(vector_ids)
+        handled_ids.update(vector_ids)
+        deleted += len(vector_ids)
+        if on_progress is not None:
+            on_progress(deleted)
+
+        # Spread the deletes out to stay under the configured rate
+        delay = len(vector_ids) / SWEEP_MAX_DELETES_PER_SECOND - (time.monotonic() - started_at)
+        if delay > 0:
+            time.sleep(delay)
+
+    return deleted
+
+
+def sweep_all():
+    """
+    Sweep every namespace of the SWEEP_INDEX_NAMES indexes, skipping the
+    namespaces swept within the last SWEEP_INTERVAL_SECONDS, so a sweep cut
+    short by a restart picks up where it stopped. Progress is saved to the
+    state file as it goes.
+
+    Returns:
+        The total number of deleted vectors.
+    """
+    state = get_sweep_state()
+    pc = get_pinecone_client()
+    total_deleted = 0
+
+    if not SWEEP_INDEX_NAMES:
+        logging.warning("SWEEP_INDEX_NAMES is empty, nothing to sweep")
+        return 0
+    existing_names = set(pc.list_indexes().names())
+    for index_name in sorted(SWEEP_INDEX_NAMES):
+        if index_name not in existing_names:
+            logging.warning(f"Index {index_name} in SWEEP_INDEX_NAMES does not exist, skipping it")
+            continue
+
+        dimension = pc.describe_index(index_name).dimension
+        pinecone_index = get_pinecone_index(index_name)
+        namespaces = pinecone_index.describe_index_stats().namespaces or {}
+
+        for namespace in sorted(namespaces):
+            state_key = f"{index_name}/{namespace}"
+            last_sweep = state["namespaces"].get(state_key, {})
+            if time.time() - last_sweep.get("completed_at", 0) < SWEEP_INTERVAL_SECONDS:
+                continue
+
+            def save_progress(deleted):
+                state["namespaces"][state_key] = dict(last_sweep, in_progress_deleted=deleted)
+                _save_sweep_state(state)
+
+            try:
+                deleted = sweep_namespace(pinecone_index, namespace, dimension, on_progress=save_progress)
+            except Exception as e:
+                logging.error(f"Sweep of {state_key} failed: {e}", exc_info=True)
+                continue
+
+            total_deleted += deleted
+            state["namespaces"][state_key] = {"completed_at": time.time(), "deleted": deleted}
+            _save_sweep_state(state)
+            if deleted:
+                logging.info(f"Swept {deleted} soft-deleted vectors from {state_key}")
+
+    return total_deleted
+
+
+def run_sweep():
+    """
+    Run a sweep unless another worker holds the sweeper lock.
+
+    Returns:
+        The number of deleted vectors, or None if the sweep was skipped.
+    """
+    os.makedirs(os.path.dirname(SWEEP_LOCK_PATH), exist_ok=True)
+    with open(SWEEP_LOCK_PATH, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.info("Sweep already running in another worker, skipping")
+            return None
+        try:
+            started_at = time.monotonic()
+            deleted = sweep_all()
+            logging.info(f"Sweep completed in {time.monotonic() - started_at:.0f}s, deleted {deleted} vectors")
+            return deleted
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _sweep_loop():
+    while True:
+        try:
+            run_sweep()
+        except Exception as e:
+            logging.error(f"Sweep failed: {e}", exc_info=True)
+        time.sleep(SWEEP_INTERVAL_SECONDS)
+
+
+def start_sweeper():
+    """
+    Start the background sweep loop of this worker process when the sweeper
+    is enabled. Every worker runs the loop, the lock makes one of them sweep.
+    """
+    global _sweeper_thread
+    if not SWEEPER_ENABLED:
+        return
+    with _sweeper_thread_lock:
+        if _sweeper_thread is None:
+            _sweeper_thread = threading.Thread(target=_sweep_loop, name="sweeper", daemon=True)
+            _sweeper_thread.start()
+            logging.info("Started the soft-delete sweeper")
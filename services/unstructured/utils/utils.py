@@ -1,9 +1,85 @@
-from urllib.parse import urlparse
 import os
+import shutil
+import boto3
 
 def get_file_extension(s3_url: str):
-    parsed_url = urlparse(s3_url)
-    file_name = os.path.basename(parsed_url.path)
+    _, key = parse_s3_url(s3_url)
+    file_name = os.path.basename(key)
     file_extension = os.path.splitext(file_name)[1]
 
-    return file_extension
\ No newline at end of file
+    return file_extension
+
+def parse_s3_url(s3_url: str):
+    """
+    Split an s3://bucket/key URL into its bucket name and object key.
+
+    The key is taken literally, without unquoting: the API builds these URLs
+    from raw file names, so "+", "%", "#" and "?" are part of the key.
+    """
+    if not s3_url.startswith("s3://"):
+        raise ValueError(f"Invalid S3 URL: {s3_url}")
+    bucket_name, _, key = s3_url[len("s3://"):].partition('/')
+    if not bucket_name or not key:
+        raise ValueError(f"Invalid S3 URL: {s3_url}")
+
+    return bucket_name, key
+
+def get_s3_client():
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+    )
+
+def get_s3_object_info(s3_url: str):
+    """
+    HEAD the object behind an S3 URL.
+
+    Returns:
+        A dict with the bucket, key, ETag and size of the object.
+    """
+    bucket_name, key = parse_s3_url(s3_url)
+    response = get_s3_client().head_object(Bucket=bucket_name, Key=key)
+
+    return {
+        "bucket": bucket_name,
+        "key": key,
+        "etag": response["ETag"].strip('"'),
+        "size": response["ContentLength"],
+    }
+
+def download_s3_object(s3_url: str, target_dir: str, etag: str = None):
+    """
+    Download the object behind an S3 URL into target_dir.
+
+    Args:
+        s3_url: The s3://bucket/key URL of the object.
+        target_dir: The local directory to download into.
+        etag: When given, the download fails if the object changed since it
+            was read with this ETag.
+
+    Returns:
+        The local path of the downloaded file.
+    """
+    bucket_name, key = parse_s3_url(s3_url)
+    os.makedirs(target_dir, exist_ok=True)
+    file_path = os.path.join(target_dir, os.path.basename(key))
+
+    # download_file doesn't accept IfMatch, a single GET pins the version
+    request = {"Bucket": bucket_name, "Key": key}
+    if etag:
+        request["IfMatch"] = f'"{etag}"'
+    response = get_s3_client().get_object(**request)
+
+    # Written aside first, a checkpoint must never see a partial download
+    tmp_path = f"{file_path}.part"
+    try:
+        with open(tmp_path, "wb") as file:
+            shutil.copyfileobj(response["Body"], file, 1024 * 1024)
+        os.replace(tmp_path, file_path)
+    finally:
+        response["Body"].close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return file_path